@@ -50,6 +50,7 @@ try:
     t2 = time.time()
     print mosaic.shape
     print "Mosaic took", t2 - t1, "s"
+    mosaic.close()
 
     cv2.waitKey(0)
 
@@ -66,10 +67,10 @@ t2 = time.time()
 print "Calibration took", t2 - t1, "s"
 print calibrated_stage.M, calibrated_stage.r0
 t1 = time.time()
-mosaic = calibrated_stage.mosaic(camera.width * 3, camera.height * 3)
-t2 = time.time()
-print mosaic.shape
-print "Mosaic took", t2 - t1, "s"
+with calibrated_stage.mosaic(camera.width * 3, camera.height * 3) as mosaic:
+    t2 = time.time()
+    print mosaic.shape
+    print "Mosaic took", t2 - t1, "s"
 
-pylab.imshow(mosaic[::5,::5], cmap = 'gray')
-pylab.show()
+    pylab.imshow(mosaic.region(0, 0, mosaic.shape[1], mosaic.shape[0], level=2), cmap = 'gray')
+    pylab.show()
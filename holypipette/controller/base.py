@@ -1,8 +1,11 @@
 """
 Module defining the `TaskController` class.
 """
+import contextlib
 import functools
+import threading
 import time
+import weakref
 
 from holypipette.log_utils import LoggingObject
 
@@ -24,6 +27,59 @@ def check_for_abort(obj, func):
     return decorated
 
 
+class AbortEvent(object):
+    """
+    An event signalling an abort request. It behaves like `threading.Event`,
+    but it can have child events (e.g. for subtasks running in other threads)
+    that are set together with their parent.
+    """
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._children = weakref.WeakSet()
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent._children.add(self)
+                if parent.is_set():
+                    self._event.set()
+
+    def child(self):
+        """Returns a new event that will be set when this event is set."""
+        return AbortEvent(parent=self)
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            children = list(self._children)
+        for child in children:
+            child.set()
+
+    def clear(self):
+        """Clears the event (but not its children)."""
+        self._event.clear()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the event is set or until the timeout (in seconds) has
+        passed. Returns whether the event is set.
+        """
+        return self._event.wait(timeout)
+
+
+# The abort event of the task executed in the current thread (see
+# `TaskController.abort_scope`)
+_task_context = threading.local()
+
+
+def current_abort_event():
+    """Returns the abort event of the task running in the current thread, or
+       ``None`` if no task is running."""
+    return getattr(_task_context, 'abort_event', None)
+
+
 class TaskController(LoggingObject):
     """
     Base class for objects that control the high-level logic to control the
@@ -40,12 +96,18 @@ class TaskController(LoggingObject):
     `~TaskController.info`, or
     `~TaskController.warn` is called (which otherwise simply forward their
     message to the logging system). Finally, tasks should call `sleep`
-    (instead of `time.sleep`) which will periodically check for an abort
-    request during the sleep time.
+    (instead of `time.sleep`) which will return immediately when an abort is
+    requested during the sleep time.
+
+    Abort requests are signalled with an `AbortEvent`. While a task is
+    executed (see `abort_scope`), its event is shared with all other
+    `TaskController` objects used from the same thread (e.g. the manipulators
+    or the pressure controller used by an `.AutoPatcher`), so that their waits
+    are interrupted as well. Subtasks can be executed in parallel with
+    `run_concurrently`.
     """
     def __init__(self):
         super(TaskController, self).__init__()
-        self.abort_requested = False
         self.saved_state = None
         self.saved_state_question = None
         # Overwrite the logging functions so that they check for `abort_requested`
@@ -53,6 +115,45 @@ class TaskController(LoggingObject):
         self.info = check_for_abort(self, self.info)
         self.warn = check_for_abort(self, self.warn)
 
+    @property
+    def abort_event(self):
+        """The `AbortEvent` signalling an abort request for this object."""
+        # Created on demand, since some subclasses (FakeAmplifier,
+        # MultiClampChannel, UMP) do not call TaskController.__init__
+        if getattr(self, '_abort_event', None) is None:
+            self._abort_event = AbortEvent()
+        return self._abort_event
+
+    @property
+    def abort_requested(self):
+        """Whether an abort has been requested, either for this object or for
+        the task running in the current thread."""
+        event = current_abort_event()
+        return self.abort_event.is_set() or (event is not None and event.is_set())
+
+    @abort_requested.setter
+    def abort_requested(self, value):
+        if value:
+            self.abort_event.set()
+        else:
+            self.abort_event.clear()
+
+    @contextlib.contextmanager
+    def abort_scope(self, event=None):
+        """
+        Context manager that makes ``event`` (by default, the abort event of
+        this object) the abort event for all `TaskController` objects used in
+        the current thread.
+        """
+        if event is None:
+            event = self.abort_event
+        previous = current_abort_event()
+        _task_context.abort_event = event
+        try:
+            yield event
+        finally:
+            _task_context.abort_event = previous
+
     def abort_if_requested(self):
         """
         Checks for an abort request and interrupts the current task if
@@ -68,19 +169,114 @@ class TaskController(LoggingObject):
             raise RequestedAbortException()
 
     def sleep(self, seconds):
-        """Convenience function that sleeps (as `time.sleep`) but remains
-        sensitive to abort requests"""
-        check_every = 0.25
-        start = time.time()
+        """Convenience function that sleeps (as `time.sleep`) but returns
+        immediately with a `RequestedAbortException` if an abort is
+        requested"""
+        self.abort_if_requested()
+        event = current_abort_event()
+        if event is None:
+            event = self.abort_event
+        if event.wait(max(seconds, 0)):
+            raise RequestedAbortException()
         self.abort_if_requested()
-        while time.time() - start < (seconds-check_every):
-            time.sleep(check_every)
-            self.abort_if_requested()
 
-        remaining = seconds - (time.time() - start)
-        if remaining > 0:
-            time.sleep(remaining)
+    def wait_for(self, condition, timeout=None, interval=0.01):
+        """
+        Waits until ``condition()`` returns ``True``, while remaining
+        sensitive to abort requests.
+
+        Parameters
+        ----------
+        condition : function
+            Function without arguments, called every ``interval`` seconds.
+        timeout : float, optional
+            Maximum waiting time in seconds (no maximum by default).
+        interval : float, optional
+            Time between two calls of ``condition``.
+
+        Returns
+        -------
+        success : bool
+            ``False`` if the timeout was reached.
+        """
+        start = time.time()
+        while not condition():
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            self.sleep(interval)
+        return True
+
+    def run_concurrently(self, *tasks):
+        """
+        Runs several subtasks in parallel threads and waits for their
+        completion. An abort request for the current task is transmitted to
+        all subtasks; if one subtask fails, the other ones are aborted.
+
+        Parameters
+        ----------
+        tasks : functions or (function, arguments) tuples
+            The subtasks, usually methods of `TaskController` objects.
+
+        Returns
+        -------
+        results : list
+            The return values of the subtasks.
+        """
+        parent = current_abort_event()
+        if parent is None:
+            parent = self.abort_event
+        event = parent.child()
+        results = [None]*len(tasks)
+        errors = []
+
+        def run(index, func, args):
+            with self.abort_scope(event):
+                try:
+                    results[index] = func(*args)
+                except Exception as ex:
+                    errors.append(ex)
+                    event.set()  # abort the other subtasks
+
+        threads = []
+        for index, task in enumerate(tasks):
+            if callable(task):
+                func, args = task, ()
+            else:
+                func, args = task[0], tuple(task[1:])
+            thread = threading.Thread(target=run, args=(index, func, args),
+                                      name='subtask_{}'.format(getattr(func, '__name__', index)))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
         self.abort_if_requested()
+        # Report the original error rather than the induced aborts
+        if errors:
+            raise next((e for e in errors if not isinstance(e, RequestedAbortException)),
+                       errors[0])
+        return results
+
+    def resources(self, task=None):
+        """
+        The hardware resources (e.g. ``'stage'``, ``'microscope'``,
+        ``'pressure'``) that a task of this object needs exclusive access to.
+        Tasks that do not share any resource can be executed in parallel by
+        the `.TaskInterface`. Should be overwritten in subclasses; by default,
+        the object itself is the only resource.
+
+        Parameters
+        ----------
+        task : str, optional
+            The name of the method that will be executed, for objects where
+            different tasks use different resources.
+
+        Returns
+        -------
+        resources : tuple
+            The resources, as hashable objects (usually strings).
+        """
+        return (self,)
 
     # SAVED STATES:
     # Functions to overwrite to enable a reset of the state after a failed or
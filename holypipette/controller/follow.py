@@ -0,0 +1,189 @@
+'''
+Following of a moving target (e.g. a paramecium) with the stage.
+'''
+from __future__ import absolute_import
+import threading
+import time
+
+import numpy as np
+
+from holypipette.controller.base import AbortEvent, RequestedAbortException
+from holypipette.utils.monitor import Monitor
+
+__all__ = ['StageFollower']
+
+
+class StageFollower(Monitor):
+    '''
+    Keeps a moving target at the center of the image by moving the stage, in a
+    control loop running at a fixed rate in a background thread (see
+    `.Monitor`; the buffer records the error and the commanded move at each
+    step).
+
+    Target positions reported with `set_target` (e.g. by a tracker on each
+    frame) are converted to positions relative to the stage, and smoothed with
+    an alpha-beta filter that also estimates the target's velocity. At each
+    step of the loop, the stage position that centers the target, predicted
+    ``prediction`` seconds ahead, is compared with the current stage position
+    (from `.CalibratedStage.position_monitor`), and a PID controller computes
+    the move. Only the latest target position is used, so that reports
+    arriving faster than the loop are coalesced; a move is only sent when the
+    previous one is finished, and skipped if another task uses the stage.
+    `stop` does not wait for the control loop, it interrupts the current move.
+
+    Parameters
+    ----------
+    stage : `.CalibratedStage`
+        The stage.
+    rate : float, optional
+        Rate of the control loop in Hz.
+    gain : float, optional
+        Proportional gain (fraction of the error corrected in one step).
+    integral_gain : float, optional
+        Integral gain (per s).
+    derivative_gain : float, optional
+        Derivative gain (in s).
+    deadband : float, optional
+        Errors smaller than this value (in pixels) are not corrected.
+    max_step : float, optional
+        Maximum length of a move (in pixels).
+    alpha, beta : float, optional
+        Position and velocity gains of the alpha-beta filter.
+    prediction : float, optional
+        The target position is predicted this long (in s) ahead, to
+        compensate for the latency of the moves.
+    timeout : float, optional
+        The stage stops following when the target has not been reported for
+        this long (in s).
+    resource_locks : `.ResourceLocks`, optional
+        The locks of the task executor, to avoid moving the stage while it is
+        used by another task.
+    '''
+    def __init__(self, stage, rate=5., gain=0.5, integral_gain=0.,
+                 derivative_gain=0., deadband=5., max_step=np.inf, alpha=0.5,
+                 beta=0.1, prediction=0.2, timeout=1., resource_locks=None):
+        super(StageFollower, self).__init__(rate, duration=60., channels=4)
+        self.stage = stage
+        self.gain = gain
+        self.integral_gain = integral_gain
+        self.derivative_gain = derivative_gain
+        self.deadband = deadband
+        self.max_step = max_step
+        self.alpha = alpha
+        self.beta = beta
+        self.prediction = prediction
+        self.timeout = timeout
+        self.resource_locks = resource_locks
+        self._target_lock = threading.Lock()
+        self._abort_event = AbortEvent()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets the target and the state of the controller.
+        '''
+        with self._target_lock:
+            self._estimate = None  # target position relative to the stage
+            self._velocity = np.zeros(2)
+            self._estimate_time = None
+        self._integral = np.zeros(2)
+        self._previous_error = None
+        self._previous_time = None
+
+    def start(self, rate=None):
+        self.stage.position_monitor.start()
+        if not self.is_running:
+            self._abort_event = AbortEvent()
+        super(StageFollower, self).start(rate)
+
+    def stop(self):
+        # Called from the GUI thread: interrupt the current move instead of
+        # waiting for it
+        if self._users <= 1:
+            self._abort_event.set()
+        super(StageFollower, self).stop(wait=False)
+        self.stage.position_monitor.stop()
+
+    def set_target(self, position, t=None):
+        '''
+        Reports the position of the target.
+
+        Parameters
+        ----------
+        position : tuple
+            The position ``(x, y)`` on screen, relative to the image center (in
+            pixels).
+        t : float, optional
+            The time of the observation (by default, now).
+        '''
+        if t is None:
+            t = time.time()
+        stage_position = self.stage.position_monitor.position_at(t)
+        if stage_position is None:
+            return
+        # Position relative to the stage (see `.CalibratedStage.map_position`)
+        observed = np.asarray(position[:2], dtype=float) - stage_position
+        with self._target_lock:
+            if self._estimate is None or t <= self._estimate_time:
+                self._estimate = observed
+                self._velocity = np.zeros(2)
+            else:
+                dt = t - self._estimate_time
+                predicted = self._estimate + self._velocity * dt
+                residual = observed - predicted
+                self._estimate = predicted + self.alpha * residual
+                self._velocity = self._velocity + self.beta * residual / dt
+            self._estimate_time = t
+
+    def read(self):
+        # One step of the control loop
+        now = time.time()
+        with self._target_lock:
+            estimate, velocity, t = self._estimate, self._velocity, self._estimate_time
+        if estimate is None or now - t > self.timeout:
+            self._integral = np.zeros(2)
+            self._previous_error = None
+            return None
+        stage_position = self.stage.position_monitor.position_at(now)
+        if stage_position is None:
+            return None
+        # The target is centered when the stage is at -(target position)
+        desired = -(estimate + velocity * (now - t + self.prediction))
+        error = desired - stage_position
+        if np.sqrt(np.sum(error**2)) < self.deadband:
+            self._previous_error = None
+            return error[0], error[1], 0., 0.
+        dt = 1. / self.rate if self._previous_time is None else now - self._previous_time
+        self._previous_time = now
+        self._integral += error * dt
+        derivative = np.zeros(2)
+        if self._previous_error is not None:
+            derivative = (error - self._previous_error) / dt
+        self._previous_error = error
+        move = (self.gain * error + self.integral_gain * self._integral +
+                self.derivative_gain * derivative)
+        length = np.sqrt(np.sum(move**2))
+        if length > self.max_step:
+            move *= self.max_step / length
+        if not self._move(move):
+            return error[0], error[1], 0., 0.
+        return error[0], error[1], move[0], move[1]
+
+    def _move(self, move):
+        # Moves the stage and waits until the move is finished (so that there
+        # is at most one move in flight), unless the stage is used by another
+        # task
+        resources = self.stage.resources('reference_relative_move')
+        if (self.resource_locks is not None and
+                not self.resource_locks.acquire(resources, blocking=False)):
+            return False
+        try:
+            with self.stage.abort_scope(self._abort_event):
+                self.stage.reference_relative_move(move)
+                self.stage.wait_until_still()
+        except RequestedAbortException:
+            return False
+        finally:
+            if self.resource_locks is not None:
+                self.resource_locks.release(resources)
+        return True
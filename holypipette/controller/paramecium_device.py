@@ -1,36 +1,11 @@
 from .base import TaskController
-from time import sleep
+import time
 from scipy.optimize import golden, minimize_scalar
 from numpy import array,arange
 import numpy as np
 import warnings
-import os
-from holypipette.utils.filelock import FileLock
-
-#### Copied and simplified from clampy
-def load_data(filename):
-    '''
-    Loads a text data file, with the following conventions:
-    - header gives variable names (separated by spaces)
-    - one column = one variable
-    Returns a dictionary of signals
-    '''
-    _, ext = os.path.splitext(filename)
-
-    f = open(filename, 'r')
-    variables = f.readline().split()
-    f.close()
-
-    # Load signals
-    signals = {}
-    M = np.loadtxt(filename, skiprows=1, unpack=True)
-    if len(M.shape) == 1:
-        M = M.reshape((1,len(M)))
-    for name, value in zip(variables, M):
-        signals[name] = value
-
-    return signals
-
+from holypipette.utils.datachannel import DataChannel
+from holypipette.electrophysiology import PulseAnalyzer
 
 class ParameciumDeviceController(TaskController):
     def __init__(self, calibrated_unit, microscope,
@@ -42,6 +17,28 @@ class ParameciumDeviceController(TaskController):
         self.microscope = microscope
         self.camera = camera
 
+    def resources(self, task=None):
+        return self.calibrated_unit.resources()
+
+    @property
+    def oscilloscope(self):
+        '''
+        The `.DataChannel` receiving the recordings of the acquisition program.
+        '''
+        if getattr(self, '_oscilloscope', None) is None:
+            self._oscilloscope = DataChannel(self.config.oscilloscope_port)
+            self._oscilloscope.start()
+        return self._oscilloscope
+
+    @property
+    def pulse_analyzer(self):
+        '''
+        The `.PulseAnalyzer` analyzing the recordings of the oscilloscope.
+        '''
+        if getattr(self, '_pulse_analyzer', None) is None:
+            self._pulse_analyzer = PulseAnalyzer()
+        return self._pulse_analyzer
+
     def partial_withdraw(self):
         self.calibrated_unit.relative_move(self.config.withdraw_distance * self.calibrated_unit.up_direction[0], 0)
 
@@ -59,54 +56,51 @@ class ParameciumDeviceController(TaskController):
         # move in
         self.calibrated_unit.relative_move(-self.config.short_withdraw_distance*self.calibrated_unit.up_direction[0],0)
 
+    def record_sweeps(self):
+        '''
+        Receives the sweeps recorded at the current position from the
+        oscilloscope (see `.ParameciumDeviceConfig.averaged_sweeps`). Sweeps
+        received before the call (e.g. during a movement) are discarded.
+        '''
+        self.oscilloscope.discard()
+        return [self.oscilloscope.receive(controller=self)
+                for _ in range(int(self.config.averaged_sweeps))]
+
+    def analyze_sweeps(self, sweeps):
+        '''
+        Returns V0, R and Re, calculated on the average of the given sweeps.
+        '''
+        self.pulse_analyzer.averaging = len(sweeps)
+        self.pulse_analyzer.reset()
+        for signals in sweeps:
+            self.pulse_analyzer.add(signals)
+        results = self.pulse_analyzer.averaged()
+        return results['V0'], results['R'], results['Re']
+
     def electrophysiological_parameters(self):
         '''
         Reads from the oscilloscope and returns V0, R and Re
         '''
-        # Load data
-        filename = self.config.oscilloscope_filename
-        while not os.path.exists(filename):
-            sleep(0.01)  # wait for new data
-        lock = FileLock(filename + ".lock")
-        with lock:
-            data = load_data(filename)
-            os.remove(filename)
-
-        V1, V2, I, t = data['V1'], data['V2'], data['Ic2'], data['t']
-        dt = t[1]-t[0]
-
-        # Calculate stimulus characteristics
-        threshold = 1e-12
-        I0 = np.mean(I[np.abs(I)>threshold])
-        T0 = (np.abs(I)>threshold).nonzero()[0][0]*dt
-        T1 = (np.abs(I)>threshold).sum()*dt
-
-        # Calculate offset and resistance
-        V0 = np.mean(V1[:int(T0 / dt)])  # calculated on initial pause
-        Vpeak = np.mean(V1[int((T0 + 2 * T1 / 3.) / dt):int((T0 + T1) / dt)])  # calculated on last third of the pulse
-        R1 = (Vpeak - V0) / I0
-
-        # Calculate electrode resistance
-        V02 = np.mean(V2[:int(T0 / dt)])  # calculated on initial pause
-        Vpeak = np.mean(V2[int((T0 + 2 * T1 / 3.) / dt):int((T0 + T1) / dt)])  # calculated on last third of the pulse
-        R2 = ((Vpeak - V02) / I0)
-
-        if R2>R1:
-            R, Re = R1, R2-R1
-        else:
-            R, Re = R2, R1-R2
-
-        return V0, R, Re
+        return self.analyze_sweeps(self.record_sweeps())
 
     def move_pipette_until_drop(self):
         '''
         Moves pipette down until Vm drops
         '''
-        previous_V0, previous_R, previous_Re = self.electrophysiological_parameters()
-
         nsteps = int((self.config.working_level-self.config.impalement_level)/self.config.impalement_step)
         step_movement = np.array([0, 0, -self.config.impalement_step * self.microscope.up_direction])
-        success = False
+        if self.config.pipelined_impalement:
+            success = self._pipelined_impalement(nsteps, step_movement)
+        else:
+            success = self._sequential_impalement(nsteps, step_movement)
+
+        if success:
+            self.info('Successful impalement')
+        else:
+            self.info('Impalement failed')
+
+    def _sequential_impalement(self, nsteps, step_movement):
+        previous_V0, previous_R, previous_Re = self.electrophysiological_parameters()
         for _ in range(nsteps):
             # Move down one step
             self.calibrated_unit.reference_relative_move(step_movement)
@@ -115,87 +109,181 @@ class ParameciumDeviceController(TaskController):
             V0, R, Re = self.electrophysiological_parameters()
             self.info('V = {} mV'.format(V0*1000))
             if V0-previous_V0<-.1: # 10 mV drop
-                success = True
-                break
+                return True
             previous_V0, previous_R, previous_Re = V0, R, Re
             self.sleep(self.config.pause_between_steps)
+        return False
 
-        if success:
-            self.info('Successful impalement')
+    def _pipelined_impalement(self, nsteps, step_movement):
+        '''
+        Moves to the next step as soon as the sweeps at the current position
+        have been recorded, and analyzes them during the movement. If the
+        potential has dropped, the pipette moves back by one step.
+        '''
+        def move_down():
+            self.calibrated_unit.reference_relative_move(step_movement)
+            self.calibrated_unit.wait_until_still()
+
+        previous_V0, _, _ = self.electrophysiological_parameters()
+        move_down()
+        for step in range(nsteps):
+            sweeps = self.record_sweeps()
+            last_step = step == nsteps - 1
+            if last_step:
+                V0, _, _ = self.analyze_sweeps(sweeps)
+            else:
+                _, (V0, _, _) = self.run_concurrently(move_down,
+                                                      (self.analyze_sweeps, sweeps))
+            self.info('V = {} mV'.format(V0*1000))
+            if V0-previous_V0<-.1: # 10 mV drop
+                if not last_step:
+                    self.debug('Potential drop detected one step earlier, moving back')
+                    self.calibrated_unit.reference_relative_move(-step_movement)
+                    self.calibrated_unit.wait_until_still()
+                return True
+            previous_V0 = V0
+        return False
+
+    def _brightness(self, image=None):
+        if image is None:
+            image = self.camera.snap()
+        return image.mean()
+
+    def _edge_in_view(self, image, axis, direction, threshold):
+        '''
+        Estimates the position of the edge of the illuminated region from the
+        intensity profile of the image along a stage axis. Returns the stage
+        displacement (in um) that would bring the edge to the center of the
+        image, or ``None`` if the edge is not visible (or if the stage is not
+        calibrated).
+        '''
+        stage = self.calibrated_stage
+        if not stage.calibrated:
+            return None
+        d = stage.M[:2, axis]  # image displacement (pixels) per um
+        norm = np.dot(d, d)
+        if norm == 0:
+            return None
+        if image.ndim == 3:
+            image = image.mean(axis=2)
+        height, width = image.shape
+        y, x = np.mgrid[:height, :width]
+        # Displacement (um) bringing each pixel to the center
+        displacement = -((x - width / 2.) * d[0] + (y - height / 2.) * d[1]) / norm
+        # Intensity profile (10 um bins) in the search direction
+        bins = np.round(direction * displacement / 10.).astype(int)
+        ahead = bins >= 0
+        counts = np.bincount(bins[ahead])
+        sums = np.bincount(bins[ahead], weights=image[ahead])
+        valid = counts > 0.2 * counts.max()
+        profile = sums[valid] / counts[valid]
+        below = (profile < threshold).nonzero()[0]
+        if len(below) == 0 or below[0] == 0:  # no edge, or already beyond the edge
+            return None
+        return direction * 10. * np.arange(len(counts))[valid][below[0]]
+
+    def _scan_for_edge(self, axis, target, threshold):
+        '''
+        Moves the stage continuously towards ``target``, sampling the image
+        brightness during the movement. Returns the last position with a bright
+        image and the first position with a dark image (``None`` if the target
+        has been reached without detecting the edge).
+        '''
+        stage = self.calibrated_stage
+        samples = [(time.time(), stage.position(axis=axis), None)]
+        stage.absolute_move(target, axis=axis)
+        while True:
+            self.sleep(self.config.autocenter_scan_interval)
+            t, x, I = time.time(), stage.position(axis=axis), self._brightness()
+            if I < threshold:
+                stage.stop(axis)
+                stage.wait_until_still()
+                # The image lags behind the position: take the previous sample
+                bright = samples[-2][1] if len(samples) > 1 else samples[-1][1]
+                self.debug('Edge detected between {:.0f} and {:.0f} um after {:.1f}s'.format(bright, x, t - samples[0][0]))
+                return bright, x
+            # Not moving anymore (once the movement has started: the stage
+            # may not have moved yet at the first samples)
+            started = x != samples[0][1] or t - samples[0][0] > 1.
+            if started and x == samples[-1][1]:
+                return x, None
+            samples.append((t, x, I))
+
+    def _find_edge(self, axis, direction, threshold):
+        '''
+        Finds the position of the edge of the illuminated region along an axis
+        and direction, with an exponential search (or a continuous scan)
+        followed by bisection. Returns ``None`` if no edge has been found.
+        '''
+        stage = self.calibrated_stage
+        x0 = stage.position(axis=axis)
+        max_distance = self.config.autocenter_max_distance
+
+        def probe(x):
+            stage.absolute_move(x, axis=axis)
+            stage.wait_until_still()
+            image = self.camera.snap()
+            offset = self._edge_in_view(image, axis, direction, threshold)
+            return self._brightness(image) >= threshold, offset
+
+        # Bracket the edge
+        if self.config.continuous_autocenter:
+            bright, dark = self._scan_for_edge(axis, x0 + direction*max_distance, threshold)
         else:
-            self.info('Impalement failed')
+            bright, dark = x0, None
+            distance = self.config.autocenter_step
+            while dark is None:
+                x = x0 + direction*min(distance, max_distance)
+                is_bright, offset = probe(x)
+                if offset is not None:
+                    return x + offset
+                if is_bright:
+                    if distance >= max_distance:
+                        break
+                    bright = x
+                    distance *= 2
+                else:
+                    dark = x
+        if dark is None:
+            return None
+
+        # Bisection
+        while abs(dark - bright) > self.config.autocenter_precision:
+            x = .5*(bright + dark)
+            is_bright, offset = probe(x)
+            if offset is not None:
+                return x + offset
+            if is_bright:
+                bright = x
+            else:
+                dark = x
+        return .5*(bright + dark)
 
     def autocenter(self):
         '''
         Finds the center of the device.
         '''
         # Assume we are in the lighted region
-        I0 = self.camera.snap().mean()
-        self.calibrated_stage.save_state()
-
-        ## Move the stage left and right
-
-        # Move until luminance drops by 50%
-        n = 0
-        I = I0
-        while (I>.5*I0) and (n<30):
-            self.calibrated_stage.relative_move(500., axis=0)
-            self.calibrated_stage.wait_until_still()
-            I = self.camera.snap().mean()
-            n += 1
-        x0 = self.calibrated_stage.position(axis=0)
-        self.calibrated_stage.recover_state()
-        if n==30: # fail
-            self.info('Autocenter failed')
-            return
-
-        n = 0
-        I = I0
-        while (I > .5 * I0) and (n < 30):
-            self.calibrated_stage.relative_move(-500., axis=0)
-            self.calibrated_stage.wait_until_still()
-            I = self.camera.snap().mean()
-            n += 1
-        x1 = self.calibrated_stage.position(axis=0)
-        self.calibrated_stage.recover_state()
-        if n == 30:  # fail
-            self.info('Autocenter failed')
-            return
-
-        # Place at midpoint
-        x = .5*(x0+x1)
-        self.calibrated_stage.absolute_move(x,axis=0)
-        self.calibrated_stage.wait_until_still()
-
-        ## Move the stage up and down
-        n = 0
-        I = I0
-        while (I>.5*I0) and (n<30):
-            self.calibrated_stage.relative_move(500., axis=1)
-            self.calibrated_stage.wait_until_still()
-            I = self.camera.snap().mean()
-            n += 1
-        y0 = self.calibrated_stage.position(axis=1)
-        self.calibrated_stage.recover_state()
-        if n==30: # fail
-            self.info('Autocenter failed')
-            return
-
-        n = 0
-        I = I0
-        while (I > .5 * I0) and (n < 30):
-            self.calibrated_stage.relative_move(-500., axis=1)
-            self.calibrated_stage.wait_until_still()
-            I = self.camera.snap().mean()
-            n += 1
-        y1 = self.calibrated_stage.position(axis=1)
-        self.calibrated_stage.recover_state()
-        if n == 30:  # fail
-            self.info('Autocenter failed')
-            return
-
-        # Place at midpoint
-        y = .5*(y0+y1)
-        self.calibrated_stage.absolute_move(y,axis=1)
-        self.calibrated_stage.wait_until_still()
-        self.info('Autocenter succeeded')
+        I0 = self._brightness()
+        threshold = .5*I0  # Edge: luminance drops by 50%
+        stage = self.calibrated_stage
+        stage.save_state()
+        t0 = time.time()
+
+        for axis in range(2):
+            start = stage.position(axis=axis)
+            edges = []
+            for direction in [1, -1]:
+                edge = self._find_edge(axis, direction, threshold)
+                stage.absolute_move(start, axis=axis)
+                stage.wait_until_still()
+                if edge is None:  # fail
+                    self.info('Autocenter failed')
+                    stage.recover_state()
+                    return
+                edges.append(edge)
+            # Place at midpoint
+            stage.absolute_move(.5*(edges[0] + edges[1]), axis=axis)
+            stage.wait_until_still()
+        stage.delete_state()
+        self.info('Autocenter succeeded ({:.1f}s)'.format(time.time() - t0))
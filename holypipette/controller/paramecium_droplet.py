@@ -3,6 +3,9 @@ from time import sleep
 from scipy.optimize import golden, minimize_scalar
 from numpy import array,arange
 
+from holypipette.devices.camera.framewatcher import FrameWatcher
+from holypipette.vision.contact import ContrastContactDetector
+
 class ParameciumDropletController(TaskController):
     def __init__(self, calibrated_unit, microscope,
                  calibrated_stage, camera, config):
@@ -14,6 +17,9 @@ class ParameciumDropletController(TaskController):
         self.camera = camera
         self.paramecium_tank_position = None
 
+    def resources(self, task=None):
+        return self.calibrated_unit.resources()
+
     def autofocus(self, position):
         '''
         Autofocus on cell at the clicked position
@@ -27,17 +33,19 @@ class ParameciumDropletController(TaskController):
         x, y, z = position
         bracket = (z-100., z+100.) # 200 um around the current focus position
 
+        roi_statistics = self.camera.roi_statistics
+        roi = roi_statistics.add((x + width / 2 - size / 2, y + height / 2 - size / 2,
+                                  x + width / 2 + size / 2, y + height / 2 + size / 2))
+
         def image_variance(z):
             self.microscope.absolute_move(z)
             sleep(self.config.autofocus_sleep) # more?
-            image = self.camera.snap()
-            frame = image[int(y + height / 2 - size / 2):int(y + height / 2 + size / 2),
-                    int(x + width / 2 - size / 2):int(
-                        x + width / 2 + size / 2)]  # is there a third dimension?
-            variance = frame.var()
-            return -variance
-
-        z = golden(image_variance, brack = bracket, tol = 0.0001)
+            return -roi_statistics.next(roi).var
+
+        try:
+            z = golden(image_variance, brack = bracket, tol = 0.0001)
+        finally:
+            roi_statistics.remove(roi)
         #z = minimize_scalar(image_variance, bounds=bracket, tol=0.01, method='bounded')
         #zlist = arange(z-100., z+100.,20)
         #variances = -array([image_variance(z0) for z0 in zlist])
@@ -54,15 +62,15 @@ class ParameciumDropletController(TaskController):
         '''
         Moves the pipette down until it touches water.
 
-        Algorithm: move down in steps of 5 um until mean intensity has changed by at least
-        one standard deviation.
+        Algorithm: move down continuously until the contrast around the tip
+        has increased by 30%. Every camera frame is analyzed during the
+        movement.
 
         Note that the focus is untouched (maybe it should follow the tip?).
         '''
-        step_size = 5. # in um
         self.info("Moving the pipette down until it touches water")
 
-        # Region of interest = 20 x 20 um around pipette tip
+        # Region of interest = 50 x 50 um around pipette tip
         x,y,_ = self.calibrated_unit.reference_position()
         width, height = self.camera.width, self.camera.height
         pixel_per_um = getattr(self.camera, 'pixel_per_um', None)
@@ -70,39 +78,17 @@ class ParameciumDropletController(TaskController):
             pixel_per_um = self.calibrated_unit.stage.pixel_per_um()[0]
         frame_width = 50*pixel_per_um
         frame_height = 50*pixel_per_um
-
-        # Refocus on tip
-        #z = self.calibrated_unit.reference_position()[2]
-        #self.microscope.absolute_move(z)
-        #self.microscope.wait_until_still()
-
-        # Take image of ROI
-        image = self.camera.snap()
-        frame = image[int(y+height/2-frame_height/2):int(y+height/2+frame_height/2),
-                int(x+width/2-frame_width/2):int(x+width/2+frame_width/2)] # is there a third dimension?
-        # Mean intensity and contrast of the image
-        mean = mean0 = frame.mean()
-        std = std0 = frame.std()
-
-        i = 0
-        while (std<std0*1.3) and (i<20):
-            mean0=mean
-            #z = self.calibrated_unit.reference_position()[2]
-            self.calibrated_unit.relative_move(-step_size*self.calibrated_unit.up_direction[2], 2)
-            #self.microscope.absolute_move(z)
-            #self.calibrated_unit.wait_until_still(2)
-            sleep(0.2)
-            #self.microscope.wait_until_still()
-            image = self.camera.snap()
-            frame = image[int(y + height / 2 - frame_height / 2):int(y + height / 2 + frame_height / 2),
-                    int(x + width / 2 - frame_width / 2):int(
-                        x + width / 2 + frame_width / 2)]  # is there a third dimension?
-            # Mean intensity and contrast of the image
-            mean = frame.mean()
-            std = frame.std()
-            self.info('Mean = {}; Std = {}'.format(mean,std))
-            i+=1
-        if std>std0*1.5:
+        roi = (x+width/2-frame_width/2, y+height/2-frame_height/2,
+               x+width/2+frame_width/2, y+height/2+frame_height/2)
+
+        detector = ContrastContactDetector(roi, ratio=1.3)
+        with FrameWatcher(self.camera, detector) as watcher:
+            # Contrast of the image before moving
+            self.wait_for(lambda: detector.ready, timeout=2.)
+            contact = self.calibrated_unit.move_until(2, -self.config.contact_velocity*self.calibrated_unit.up_direction[2],
+                                                      self.config.contact_max_distance, watcher.detected)
+        self.info('Std = {} (initially {})'.format(detector.std, detector.baseline))
+        if contact:
             self.info("Successful contact with water surface")
         else:
             self.info("Failed contact with water surface")
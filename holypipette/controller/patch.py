@@ -1,8 +1,14 @@
+import threading
 import time
 
 import numpy as np
 
-from .base import TaskController
+from .base import TaskController, RequestedAbortException, current_abort_event
+from .targetqueue import TargetQueue
+from holypipette.devices.pressurecontroller.waveform import Waveform
+from holypipette.devices.camera.framewatcher import FrameWatcher
+from holypipette.vision.contact import OutlineContactDetector
+from holypipette.utils.statestore import shared_state
 
 
 class AutopatchError(Exception):
@@ -25,20 +31,49 @@ class AutoPatcher(TaskController):
         self.cleaning_bath_position = None
         self.rinsing_bath_position = None
         self.contact_position = None
+        #: Cells to patch with `sequential_patching`
+        self.target_queue = TargetQueue()
         self.initial_resistance = None
 
+    def resources(self, task=None):
+        return ('amplifier', 'pressure') + self.calibrated_unit.resources()
+
+    def resistance(self):
+        '''
+        Filtered resistance, from the amplifier's `.ResistanceMonitor`.
+        '''
+        return self.amplifier.resistance_monitor.filtered(self.config.resistance_filter)
+
+    def wait_for_resistance_sample(self):
+        '''
+        Waits for a new resistance measurement (without busy looping).
+        '''
+        self.amplifier.resistance_monitor.wait_for_sample(0.1)
+        self.abort_if_requested()
+
+    def wait_for_pressure(self, timeout):
+        '''
+        Waits until the measured pressure has settled at the commanded value,
+        using the pressure controller's `.PressureMonitor`. If the controller
+        does not measure pressure, waits for ``timeout`` seconds.
+        '''
+        return self.pressure.pressure_monitor.wait_until_settled(tolerance=self.config.pressure_tolerance,
+                                                                 duration=self.config.pressure_settle_time,
+                                                                 timeout=timeout,
+                                                                 controller=self)
+
     def break_in(self):
         '''
         Breaks in. The pipette must be in cell-attached mode
         '''
         self.info("Breaking in")
-        R = self.amplifier.resistance()
+        R = self.resistance()
         if R < self.config.gigaseal_R:
             raise AutopatchError("Seal lost")
 
         pressure = 0
         trials = 0
-        while self.amplifier.resistance() > self.config.max_cell_R:  # Success when resistance goes below 300 MOhm
+        while self.resistance() > self.config.max_cell_R:  # Success when resistance goes below 300 MOhm
             trials+=1
             self.debug('Trial: '+str(trials))
             pressure += self.config.pressure_ramp_increment
@@ -50,23 +85,160 @@ class AutoPatcher(TaskController):
             self.pressure.ramp(amplitude=pressure, duration=self.config.pressure_ramp_duration)
             self.sleep(1.3)
 
-        self.info("Successful break-in, R = " + str(self.amplifier.resistance() / 1e6))
+        self.info("Successful break-in, R = " + str(self.resistance() / 1e6))
+
+    def _move_down(self, step, threshold):
+        '''
+        Moves the pipette down by ``step`` um while monitoring the resistance.
+        The movement is stopped as soon as the resistance exceeds
+        ``threshold``.
+
+        Returns
+        -------
+        increased : bool
+            Whether the resistance exceeded the threshold.
+        '''
+        monitor = self.amplifier.resistance_monitor
+        window = self.config.resistance_filter
+        # Event used to stop the movement (also set when the task is aborted)
+        parent = current_abort_event()
+        if parent is None:
+            parent = self.abort_event
+        stop_event = parent.child()
+        still = threading.Event()
+
+        def wait_until_still():
+            with self.abort_scope(stop_event):
+                try:
+                    self.calibrated_unit.wait_until_still(2)
+                except RequestedAbortException:
+                    pass  # the unit has been stopped
+                finally:
+                    still.set()
+
+        self.calibrated_unit.relative_move(step, axis=2)  # *calibrated_unit.up_position[2]
+        thread = threading.Thread(target=wait_until_still, name='approach_move')
+        thread.start()
+        try:
+            monitor.wait_until(lambda m: still.is_set() or m.filtered(window) > threshold,
+                               controller=self)
+        finally:
+            stop_event.set()
+            thread.join()
+        return self.resistance() > threshold
+
+    def approach(self, R, before_step=None):
+        '''
+        Moves the pipette down towards the cell until the resistance increases.
+
+        The step size adapts to the situation: steps of up to
+        ``approach_step_max`` are made when the pipette is far from the cell
+        (i.e., from ``cell_distance`` below the initial position) and the
+        resistance is stable, fine steps of ``approach_step_min`` when it is
+        close to the cell or when the resistance starts increasing. Movements
+        are interrupted as soon as the resistance increases by more than
+        ``cell_R_increase``.
+
+        Parameters
+        ----------
+        R : float
+            The resistance in the bath.
+        before_step : function, optional
+            A function called before each step, returning ``True`` if the
+            pipette has been moved back to its initial position above the cell
+            (e.g. to follow a moving target).
+
+        Returns
+        -------
+        success : bool
+            Whether the cell has been detected. In this case, the pressure has
+            been released.
+        '''
+        monitor = self.amplifier.resistance_monitor
+        threshold = R * (1 + self.config.cell_R_increase)
+        distance = 0.
+        while distance < self.config.max_distance:
+            self.abort_if_requested()
+            if before_step is not None and before_step():
+                distance = 0.
+            # Large steps far from the cell, small steps near the cell
+            step = np.clip((self.config.cell_distance - distance) / 2.,
+                           self.config.approach_step_min,
+                           self.config.approach_step_max)
+            if self.resistance() > R * (1 + self.config.cell_R_increase / 3.):
+                # Resistance starts increasing
+                step = self.config.approach_step_min
+            step = min(step, self.config.max_distance - distance)
+            start = self.calibrated_unit.position(2)
+            increased = self._move_down(step, threshold)
+            # The movement stops early when the resistance increases
+            distance += abs(self.calibrated_unit.position(2) - start)
+            if not increased:
+                # Give the resistance measurement time to react
+                increased = monitor.wait_for_resistance(above=threshold,
+                                                        window=self.config.resistance_filter,
+                                                        timeout=self.config.approach_settle_time,
+                                                        controller=self)
+            Rnow = self.resistance()
+            self.info("Distance = {:.1f}um, R = {}".format(distance, Rnow/1e6))
+            if increased:  # R increases: near cell?
+                # Release pressure
+                self.info("Releasing pressure")
+                self.pressure.set_pressure(0)
+                self.wait_for_pressure(self.config.release_time)
+                # Check whether the resistance stays high
+                dropped = monitor.wait_for_resistance(below=threshold,
+                                                      window=self.config.resistance_filter,
+                                                      timeout=self.config.approach_settle_time,
+                                                      controller=self)
+                if not dropped:
+                    # Still higher, we are near the cell
+                    return True
+                self.debug("Resistance back to R = {}, continuing approach".format(self.resistance()/1e6))
+                self.pressure.set_pressure(self.config.pressure_near)
+        return False
+
+    def seal(self):
+        '''
+        Makes the seal (the pipette must be near the cell, see `approach`).
+        '''
+        self.debug("Sealing, R = " + str(self.resistance()/1e6))
+        self.pressure.set_pressure(self.config.pressure_sealing)
+        t0 = time.time()
+        t = t0
+        R = self.resistance()
+        while (R < self.config.gigaseal_R) | (t - t0 < self.config.seal_min_time):
+            # Wait at least 15s and until we get a Gigaseal
+            t = time.time()
+            if t - t0 < self.config.Vramp_duration:
+                # Ramp to -70 mV in 10 s (default)
+                self.amplifier.set_holding(self.config.Vramp_amplitude * (t - t0) / self.config.Vramp_duration)
+            if t - t0 >= self.config.seal_deadline:
+                # No seal in 90 s
+                self.amplifier.stop_patch()
+                raise AutopatchError("Seal unsuccessful")
+            self.wait_for_resistance_sample()
+            R = self.resistance()
 
     def patch(self, move_position=None):
         '''
         Runs the automatic patch-clamp algorithm, including manipulator movements.
         '''
+        monitor = self.amplifier.resistance_monitor
+        monitor.start(self.config.resistance_rate)
+        self.pressure.pressure_monitor.start()
         try:
             self.amplifier.start_patch()
 
             # Pressure level 1
             self.pressure.set_pressure(self.config.pressure_near)
+            self.wait_for_pressure(4.)
 
             # Check initial resistance
             #self.pressure.set_pressure(0)
             self.amplifier.auto_pipette_offset()
-            self.sleep(4.)
-            R = self.amplifier.resistance()
+            self.sleep(4.)  # let the offset and resistance stabilize
+            R = self.resistance()
             self.debug("Resistance:" + str(R/1e6))
             if R < self.config.min_R:
                 raise AutopatchError("Resistance is too low (broken tip?)")
@@ -84,7 +256,7 @@ class AutoPatcher(TaskController):
                 self.calibrated_unit.wait_until_still()
 
                 # Check resistance again
-                Rnow = self.amplifier.resistance()
+                Rnow = self.resistance()
                 if Rnow > R * (1 + self.config.cell_R_increase):
                     raise AutopatchError("Pipette is obstructed; R = " + str(Rnow/1e6))
 
@@ -94,53 +266,21 @@ class AutoPatcher(TaskController):
 
             # Approach and make the seal
             self.info("Approaching the cell")
-            success = False
-            oldR = R
-            for _ in range(self.config.max_distance):  # move 15 um down
-                # move by 1 um down
-                # Cleaner: use reference relative move
-                self.calibrated_unit.relative_move(1, axis=2)  # *calibrated_unit.up_position[2]
-                self.abort_if_requested()
-                self.calibrated_unit.wait_until_still(2)
-                self.sleep(1)
-                R = self.amplifier.resistance()
-                self.info("R = " + str(self.amplifier.resistance()/1e6))
-                if R > oldR * (1 + self.config.cell_R_increase):  # R increases: near cell?
-                    # Release pressure
-                    self.info("Releasing pressure")
-                    self.pressure.set_pressure(0)
-                    self.sleep(10)
-                    #oldR = self.initial_resistance
-                    if R > oldR * (1 + self.config.cell_R_increase):
-                        # Still higher, we are near the cell
-                        self.debug("Sealing, R = " + str(self.amplifier.resistance()/1e6))
-                        self.pressure.set_pressure(self.config.pressure_sealing)
-                        t0 = time.time()
-                        t = t0
-                        R = self.amplifier.resistance()
-                        while (R < self.config.gigaseal_R) | (t - t0 < self.config.seal_min_time):
-                            # Wait at least 15s and until we get a Gigaseal
-                            t = time.time()
-                            if t - t0 < self.config.Vramp_duration:
-                                # Ramp to -70 mV in 10 s (default)
-                                self.amplifier.set_holding(self.config.Vramp_amplitude * (t - t0) / self.config.Vramp_duration)
-                            if t - t0 >= self.config.seal_deadline:
-                                # No seal in 90 s
-                                self.amplifier.stop_patch()
-                                raise AutopatchError("Seal unsuccessful")
-                            R = self.amplifier.resistance()
-                        success = True
-                        break
+            success = self.approach(R)
+            if success:
+                self.seal()
             self.pressure.set_pressure(0)
             if not success:
                 raise AutopatchError("Seal unsuccessful")
 
-            self.info("Seal successful, R = " + str(self.amplifier.resistance()/1e6))
+            self.info("Seal successful, R = " + str(self.resistance()/1e6))
 
             # Go whole-cell
             self.break_in()
 
         finally:
+            monitor.stop()
+            self.pressure.pressure_monitor.stop()
             self.amplifier.stop_patch()
             self.pressure.set_pressure(self.config.pressure_near)
 
@@ -160,15 +300,10 @@ class AutoPatcher(TaskController):
             self.calibrated_unit.wait_until_still(1)
             self.calibrated_unit.absolute_move(self.cleaning_bath_position[2], 2)
             self.calibrated_unit.wait_until_still(2)
-            # Fill up with the Alconox
-            self.pressure.set_pressure(-600)
-            self.sleep(1)
-            # 5 cycles of tip cleaning
-            for i in range(1, 5):
-                self.pressure.set_pressure(-600)
-                self.sleep(0.625)
-                self.pressure.set_pressure(1000)
-                self.sleep(0.375)
+            # Fill up with the Alconox, then 4 cycles of tip cleaning
+            cleaning = (Waveform.constant(-600, 1) +
+                        Waveform.pulses(-600, 0.625, 1000, 0.375, cycles=4))
+            self.pressure.play(cleaning)
 
             # Step 2: Rinsing.
             # Move the pipette to the rinsing bath.
@@ -197,25 +332,37 @@ class AutoPatcher(TaskController):
             self.pressure.set_pressure(self.config.pressure_near)
 
     def sequential_patching(self):
-        from holypipette.gui import movingList
         if self.cleaning_bath_position is None:
             raise ValueError('Cleaning bath position has not been set')
         if self.rinsing_bath_position is None:
             raise ValueError('Rinsing bath position has not been set')
+        monitor = self.amplifier.resistance_monitor
+        monitor.start(self.config.resistance_rate)
+        self.pressure.pressure_monitor.start()
+        # Patch all currently tracked targets (targets left over from an
+        # aborted run may have been removed or renumbered since then)
+        self.target_queue.clear()
+        for key, position in enumerate(shared_state.targets.get()):
+            self.target_queue.add(key, position)
+        # Follow the movements of the targets to reorder them
+        shared_state.targets.subscribe(self._update_target_queue)
         try:
-            length = len(movingList.moveList)
-            for iteration in range (length):
+            while len(self.target_queue):
+                # Next target: highest priority, then shortest travel
+                target = self.target_queue.pop(self.calibrated_unit.reference_position())
+                iteration = target.key
+                self.debug('Patching target {} ({} remaining)'.format(iteration, len(self.target_queue)))
                 self.amplifier.start_patch()
                 # Pressure level 1
                 self.pressure.set_pressure(self.config.pressure_near)
                 # Move pipette to target
-                move_position = movingList.moveList[iteration]
+                move_position = target.position
                 currentPosition = move_position
                 self.calibrated_unit.safe_move(np.array([move_position[0], move_position[1],self.microscope.position()]) + self.microscope.up_direction * np.array([0, 0, 1.]) * self.config.cell_distance, recalibrate=True)
                 self.calibrated_unit.wait_until_still()
                 self.amplifier.auto_pipette_offset()
-                self.sleep(4.)
-                R = self.amplifier.resistance()
+                self.sleep(4.)  # let the offset and resistance stabilize
+                R = self.resistance()
                 self.debug("Resistance:" + str(R / 1e6))
                 if R < self.config.min_R:
                     raise AutopatchError("Resistance is too low (broken tip?)")
@@ -234,73 +381,66 @@ class AutoPatcher(TaskController):
 
                 # Approach and make the seal
                 self.info("Approaching the cell")
-                success = False
-                oldR = R
-                for _ in range(self.config.max_distance):  # move 15 um down
-                    # move by 1 um down
-                    # Cleaner: use reference relative move
-                    self.calibrated_unit.relative_move(1, axis=2)  # *calibrated_unit.up_position[2]
-                    self.abort_if_requested()
-                    self.calibrated_unit.wait_until_still(2)
-                    try:
-                        move_position = movingList.moveList[iteration]
-                    except:
-                        move_position = currentPosition
 
+                def follow_target():
+                    # Compensate for movements of the target
+                    snapshot = shared_state.targets.snapshot()
+                    if snapshot.version == follow_target.version:
+                        return False  # no new tracking result
+                    follow_target.version = snapshot.version
+                    if iteration < len(snapshot.value):
+                        move_position = snapshot.value[iteration]
+                    else:
+                        move_position = follow_target.position
                     # sum of variation in both x and y > 5 pixel --> compensation
-                    if (len(move_position)>0) & (abs(currentPosition.flatten().sum() - move_position.flatten().sum()) > 5):
-                        currentPosition = move_position
+                    if (len(move_position)>0) & (abs(follow_target.position.flatten().sum() - move_position.flatten().sum()) > 5):
+                        follow_target.position = move_position
                         self.calibrated_unit.safe_move(np.array([move_position[0], move_position[1],self.microscope.position()]) + self.microscope.up_direction * np.array([0, 0, 1.]) * self.config.cell_distance, recalibrate=True)
                         self.calibrated_unit.wait_until_still()
-
-                    self.sleep(1)
-                    R = self.amplifier.resistance()
-                    self.info("R = " + str(self.amplifier.resistance() / 1e6))
-                    if R > oldR * (1 + self.config.cell_R_increase):  # R increases: near cell?
-                        # Release pressure
-                        self.info("Releasing pressure")
-                        self.pressure.set_pressure(0)
-                        self.sleep(10)
-                        if R > oldR * (1 + self.config.cell_R_increase):
-                            # Still higher, we are near the cell
-                            self.debug("Sealing, R = " + str(self.amplifier.resistance() / 1e6))
-                            self.pressure.set_pressure(self.config.pressure_sealing)
-                            t0 = time.time()
-                            t = t0
-                            R = self.amplifier.resistance()
-                            while (R < self.config.gigaseal_R) | (t - t0 < self.config.seal_min_time):
-                                # Wait at least 15s and until we get a Gigaseal
-                                t = time.time()
-                                if t - t0 < self.config.Vramp_duration:
-                                    # Ramp to -70 mV in 10 s (default)
-                                    self.amplifier.set_holding(
-                                        self.config.Vramp_amplitude * (t - t0) / self.config.Vramp_duration)
-                                if t - t0 >= self.config.seal_deadline:
-                                    # No seal in 90 s
-                                    self.amplifier.stop_patch()
-                                    raise AutopatchError("Seal unsuccessful")
-                                R = self.amplifier.resistance()
-                            success = True
-                            break
+                        return True
+                    return False
+                follow_target.position = currentPosition
+                follow_target.version = None
+
+                success = self.approach(R, before_step=follow_target)
+                if success:
+                    self.seal()
                 self.pressure.set_pressure(0)
                 if not success:
                     raise AutopatchError("Seal unsuccessful")
-                self.info("Seal successful, R = " + str(self.amplifier.resistance() / 1e6))
+                self.info("Seal successful, R = " + str(self.resistance() / 1e6))
                 self.break_in()
                 self.amplifier.stop_patch()
                 self.pressure.set_pressure(self.config.pressure_near)
                 self.clean_pipette()
 
         finally:
+            shared_state.targets.unsubscribe(self._update_target_queue)
+            monitor.stop()
+            self.pressure.pressure_monitor.stop()
             self.pressure.set_pressure(self.config.pressure_near)
 
+    def _update_target_queue(self, snapshot):
+        self.target_queue.update_positions(snapshot.value)
+
     def contact_detection(self):
-        from holypipette.gui import movingList
-        try:
-            movingList.contact = False
-            while movingList.contact == False:
-                self.calibrated_unit.relative_move(1, axis=2)
-            self.contact_position = self.calibrated_unit.position()
-        finally:
-            print("Detection Finished")
-            movingList.contact = True
+        '''
+        Moves the pipette continuously until its tip touches the coverslip,
+        analyzing every camera frame during the movement.
+        '''
+        camera = self.calibrated_unit.camera
+        pixel_per_um = getattr(camera, 'pixel_per_um', None)
+        if pixel_per_um is None:
+            pixel_per_um = self.calibrated_unit.stage.pixel_per_um()[0]
+        # Region of interest = 30 x 30 um around the tip (center of the image)
+        size = 15*pixel_per_um
+        x, y = camera.width / 2, camera.height / 2
+        detector = OutlineContactDetector((x - size, y - size, x + size, y + size))
+        with FrameWatcher(camera, detector) as watcher:
+            contact = self.calibrated_unit.move_until(2, self.config.contact_velocity,
+                                                      self.config.contact_max_distance,
+                                                      watcher.detected)
+        if not contact:
+            raise AutopatchError("No contact detected")
+        self.contact_position = self.calibrated_unit.position()
+        self.info("Contact detected")
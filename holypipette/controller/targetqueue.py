@@ -0,0 +1,104 @@
+'''
+Queue of cells to patch, visited in an order minimizing the pipette travel.
+'''
+from __future__ import absolute_import
+import collections
+import threading
+
+import numpy as np
+
+from holypipette.geometry.route import plan_route
+
+__all__ = ['Target', 'TargetQueue']
+
+#: A cell to patch. The position is in the reference system (pixels)
+Target = collections.namedtuple('Target', ['key', 'position', 'priority'])
+
+
+class TargetQueue(object):
+    '''
+    Candidate cells with positions and priorities. Targets with a higher
+    priority are visited first; targets with the same priority are visited in
+    the order minimizing the travelled distance (see `.plan_route`). The order
+    is recomputed each time a target is taken from the queue, so that position
+    updates (e.g. from the tracker) are taken into account.
+    '''
+    def __init__(self):
+        self._targets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._targets)
+
+    def add(self, key, position, priority=0):
+        '''
+        Adds a target (or replaces the target with the same key).
+        '''
+        with self._lock:
+            self._targets[key] = Target(key, np.asarray(position, dtype=float),
+                                        priority)
+
+    def update(self, key, position):
+        '''
+        Updates the position of a target (ignored if the target is not in the
+        queue anymore).
+        '''
+        with self._lock:
+            if key in self._targets:
+                self._targets[key] = self._targets[key]._replace(position=np.asarray(position,
+                                                                                    dtype=float))
+
+    def update_positions(self, positions):
+        '''
+        Updates the positions of the targets whose keys are the indices in the
+        sequence ``positions`` (e.g. the tracked targets of
+        `.shared_state`).
+        '''
+        for key, position in enumerate(positions):
+            self.update(key, position)
+
+    def remove(self, key):
+        with self._lock:
+            self._targets.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._targets.clear()
+
+    def targets(self):
+        '''
+        The targets in the queue, in insertion order.
+        '''
+        with self._lock:
+            return list(self._targets.values())
+
+    def plan(self, start):
+        '''
+        The visiting order of the targets, starting from position ``start``.
+
+        Returns
+        -------
+        targets : list of `Target`
+        '''
+        by_priority = collections.defaultdict(list)
+        for target in self.targets():
+            by_priority[target.priority].append(target)
+        route = []
+        position = np.asarray(start, dtype=float)
+        for priority in sorted(by_priority, reverse=True):
+            targets = by_priority[priority]
+            order = plan_route([t.position[:2] for t in targets], position[:2])
+            route.extend(targets[i] for i in order)
+            position = route[-1].position
+        return route
+
+    def pop(self, start):
+        '''
+        Removes and returns the next target to visit from position ``start``
+        (``None`` if the queue is empty).
+        '''
+        route = self.plan(start)
+        if not route:
+            return None
+        self.remove(route[0].key)
+        return route[0]
@@ -1,4 +1,5 @@
 from holypipette.controller.base import TaskController
+from .resistancemonitor import ResistanceMonitor
 
 all = ['Amplifier',  'FakeAmplifier']
 
@@ -8,6 +9,20 @@ class Amplifier(TaskController):
     Base class for amplifiers.
     """
 
+    def resources(self, task=None):
+        return ('amplifier',)
+
+    @property
+    def resistance_monitor(self):
+        '''
+        The `.ResistanceMonitor` sampling the resistance of this amplifier.
+        '''
+        # Created on demand, since FakeAmplifier and MultiClampChannel do not
+        # call Amplifier.__init__
+        if getattr(self, '_resistance_monitor', None) is None:
+            self._resistance_monitor = ResistanceMonitor(self)
+        return self._resistance_monitor
+
     def start_patch(self, pulse_amplitude=1e-2,
                     pulse_frequency=1e-2):  # Not clear what the units are for frequency
         '''
@@ -21,6 +21,7 @@ import ctypes
 import functools
 import logging
 import os
+import threading
 import traceback
 
 from holypipette.devices.amplifier.amplifier import Amplifier
@@ -68,17 +69,24 @@ secondary_signal_IC_index = {'V' : 7,
 secondary_signal_index = {'V' : secondary_signal_VC_index,
                           'I': secondary_signal_IC_index}
 
+# Shared by all channels, since they use the same selection mechanism
+_device_lock = threading.RLock()
+
+
 def needs_select(func):
     """
     Decorator for all methods of `MultiClamp` that need to select the device
     first (only calls `Multiclamp.select_amplifier` if the respective device is
-    not already the selected device).
+    not already the selected device). The selection and the call are atomic,
+    since the resistance can be read from a monitoring thread (see
+    `.ResistanceMonitor`).
     """
     @functools.wraps(func)
     def wrapper(self, *args, **kwds):
-        if not MultiClampChannel.selected_device == self:
-            self.select_amplifier()
-        return func(self, *args, **kwds)
+        with _device_lock:
+            if not MultiClampChannel.selected_device == self:
+                self.select_amplifier()
+            return func(self, *args, **kwds)
     return wrapper
 
 
@@ -0,0 +1,129 @@
+'''
+Continuous monitoring of the pipette resistance.
+
+A background thread reads the resistance meter of an amplifier at a fixed rate
+and stores the timestamped values in a ring buffer. Tasks can then get
+filtered readings, or wait for events such as a relative increase of the
+resistance within a given time window, instead of sleeping and polling the
+amplifier.
+'''
+from __future__ import absolute_import
+
+import numpy as np
+
+from holypipette.utils.monitor import Monitor
+
+__all__ = ['ResistanceMonitor']
+
+
+class ResistanceMonitor(Monitor):
+    '''
+    Samples ``amplifier.resistance()`` in a background thread (see
+    `.Monitor`). When the monitor is not running, readings are taken directly
+    from the amplifier.
+
+    Parameters
+    ----------
+    amplifier : `.Amplifier`
+        The amplifier to monitor.
+    rate : float, optional
+        Sampling rate in Hz.
+    duration : float, optional
+        Duration (in s) of the history kept in the ring buffer.
+    '''
+    def __init__(self, amplifier, rate=50., duration=30.):
+        super(ResistanceMonitor, self).__init__(rate, duration)
+        self.amplifier = amplifier
+
+    def read(self):
+        R = self.amplifier.resistance()
+        if R is None:
+            return None
+        return (R,)
+
+    def samples(self, duration=None):
+        '''
+        The recorded samples, in chronological order.
+
+        Parameters
+        ----------
+        duration : float, optional
+            Only return the samples of the last ``duration`` seconds (all samples
+            in the buffer by default).
+
+        Returns
+        -------
+        times, values : `~numpy.ndarray`
+            The sampling times (as given by `time.time`) and the resistance
+            values.
+        '''
+        times, values = self.buffer.window(duration)
+        return times, values[:, 0]
+
+    def latest(self):
+        '''
+        The most recent sample as a ``(time, value)`` tuple, or ``(None, None)``
+        if no sample has been recorded.
+        '''
+        t, values = self.buffer.latest()
+        if t is None:
+            return None, None
+        return t, values[0]
+
+    def filtered(self, window=0.1):
+        '''
+        The median resistance over the last ``window`` seconds. If the monitor
+        is not running, the resistance is read from the amplifier.
+        '''
+        if not self.is_running or len(self.buffer) == 0:
+            return self.amplifier.resistance()
+        _, values = self.samples(window)
+        return np.median(values)
+
+    def relative_change(self, within=0.2, window=0.05):
+        '''
+        The relative change of the resistance during the last ``within``
+        seconds, comparing the median over the last ``window`` seconds to the
+        median over the ``window`` seconds preceding the interval. Returns
+        ``None`` if the history is not long enough.
+        '''
+        times, values = self.samples(within + window)
+        if len(times) < 2 or times[-1] - times[0] < within:
+            return None
+        current = np.median(values[times >= times[-1] - window])
+        reference = np.median(values[times <= times[0] + window])
+        return current / reference - 1
+
+    def slope(self, duration=1.):
+        '''
+        Slope of the resistance (in Ohm/s) over the last ``duration`` seconds,
+        estimated with a linear fit. Returns ``None`` if there are not enough
+        samples.
+        '''
+        times, values = self.samples(duration)
+        if len(times) < 3:
+            return None
+        return np.polyfit(times - times[-1], values, 1)[0]
+
+    def wait_for_increase(self, fraction, within=0.2, timeout=None,
+                          controller=None):
+        '''
+        Waits until the resistance has increased by more than ``fraction``
+        (e.g. 0.15 for 15%) within ``within`` seconds.
+        '''
+        def increased(monitor):
+            change = monitor.relative_change(within)
+            return change is not None and change > fraction
+        return self.wait_until(increased, timeout=timeout, controller=controller)
+
+    def wait_for_resistance(self, above=None, below=None, window=0.1,
+                            timeout=None, controller=None):
+        '''
+        Waits until the filtered resistance is above ``above`` and/or below
+        ``below``.
+        '''
+        def reached(monitor):
+            R = monitor.filtered(window)
+            return ((above is None or R > above) and
+                    (below is None or R < below))
+        return self.wait_until(reached, timeout=timeout, controller=controller)
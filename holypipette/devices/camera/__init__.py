@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 from .camera import *
+from .roistatistics import *
+from .framewatcher import *
 from .umanagercamera import *
 from .opencvcamera import *
 from .lucamcamera import *
@@ -24,6 +24,8 @@ except:
     warnings.warn('OpenCV not available')
 from PIL import Image
 
+from .roistatistics import ROIStatistics
+
 __all__ = ['Camera', 'FakeCamera', 'RecordedVideoCamera']
 
 
@@ -151,18 +153,23 @@ class Camera(object):
         self.width = 1000
         self.height = 1000
         self.flipped = False # Horizontal flip
+        self._roi_statistics = ROIStatistics(self)
 
     def start_acquisition(self):
-        self._acquisition_thread = AcquisitionThread(camera=self,
-                                                     queues=[self._last_frame_queue])
+        queues = [self._last_frame_queue, self._roi_statistics]
+        self._roi_statistics.attached = True
+        self._acquisition_thread = AcquisitionThread(camera=self, queues=queues)
         self._acquisition_thread.start()
     
     def stop_acquisition(self):
         self._acquisition_thread.running = False
+        # Computed on snapped images until the acquisition is restarted
+        self._roi_statistics.attached = False
 
     def start_recording(self, directory='', file_prefix='', skip_frames=0, queue_size=1000):
-        if len(self._acquisition_thread.queues) > 1:
-            del self._acquisition_thread.queues[1]
+        # Remove the queue of a previous recording
+        self._acquisition_thread.queues[:] = [queue for queue in self._acquisition_thread.queues
+                                              if queue is not self._file_queue]
         self._file_queue = collections.deque(maxlen=queue_size)
         self._acquisition_thread.queues.append(self._file_queue)
         self._file_thread = FileWriteThread(queue=self._file_queue,
@@ -179,6 +186,14 @@ class Camera(object):
     def flip(self):
         self.flipped = not self.flipped
 
+    @property
+    def roi_statistics(self):
+        '''
+        The `.ROIStatistics` computed for each frame of the acquisition thread
+        (attached to the thread by `start_acquisition`).
+        '''
+        return self._roi_statistics
+
     def preprocess(self, img):
         if self.flipped:
             if len(img.shape)==2:
@@ -0,0 +1,87 @@
+'''
+Analysis of every acquired frame by a detector, for tasks that have to react
+to what the camera sees with minimal latency.
+'''
+from __future__ import absolute_import
+import threading
+
+__all__ = ['FrameWatcher']
+
+
+class FrameWatcher(object):
+    '''
+    Calls a detector on each frame acquired by a camera (in the acquisition
+    thread), until the detector returns ``True``. The `detected` event is then
+    set, so that tasks waiting on it are woken up immediately.
+
+    For cameras without acquisition thread, frames are snapped from a
+    dedicated thread.
+
+    Parameters
+    ----------
+    camera : `.Camera`
+        The camera.
+    detector : function
+        Function called with each frame (as returned by `.Camera.snap`),
+        returning ``True`` when the event of interest has been detected.
+    '''
+    def __init__(self, camera, detector):
+        self.camera = camera
+        self.detector = detector
+        self.detected = threading.Event()
+        self.frame_number = None  # frame of the detection
+        self.frames = 0  # number of analyzed frames
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        acquisition_thread = getattr(self.camera, '_acquisition_thread', None)
+        if acquisition_thread is not None:
+            acquisition_thread.queues.append(self)
+        else:
+            self._thread = threading.Thread(target=self._snap_frames,
+                                            name='FrameWatcher')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        acquisition_thread = getattr(self.camera, '_acquisition_thread', None)
+        if acquisition_thread is not None:
+            acquisition_thread.queues[:] = [queue for queue in acquisition_thread.queues
+                                            if queue is not self]
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _analyze(self, frame_number, frame):
+        if self.detected.is_set():
+            return
+        self.frames += 1
+        if self.detector(frame):
+            self.frame_number = frame_number
+            self.detected.set()
+
+    def append(self, entry):
+        '''
+        Receives a new frame from the acquisition thread, as a
+        ``(frame_number, creation_time, elapsed_time, frame)`` tuple.
+        '''
+        frame_number, _, _, frame = entry
+        if frame_number is None or frame is None:  # end of acquisition
+            return
+        self._analyze(frame_number, self.camera.preprocess(frame))
+
+    def _snap_frames(self, interval=0.02):
+        frame_number = 0
+        while not self._stop_event.is_set() and not self.detected.is_set():
+            self._analyze(frame_number, self.camera.snap())
+            frame_number += 1
+            self._stop_event.wait(interval)
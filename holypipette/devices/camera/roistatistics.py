@@ -0,0 +1,213 @@
+'''
+Statistics (mean and variance) of regions of interest, computed for each frame
+of the acquisition pipeline.
+'''
+from __future__ import absolute_import
+import collections
+import itertools
+import threading
+import time
+
+import numpy as np
+
+__all__ = ['ROIStatistics', 'ROIStats']
+
+
+class ROIStats(collections.namedtuple('ROIStats', ['frame_number', 'time',
+                                                   'mean', 'var'])):
+    '''
+    Statistics of a region of interest for one frame.
+    '''
+    __slots__ = ()
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+def _integral_images(frame):
+    '''
+    Integral images of ``frame`` and ``frame**2``, with a leading row and
+    column of zeros.
+    '''
+    squares = np.square(frame)
+    integrals = []
+    for image in (frame, squares):
+        integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+        np.cumsum(np.cumsum(image, axis=0), axis=1, out=integral[1:, 1:])
+        integrals.append(integral)
+    return integrals
+
+
+def _box_sum(integral, y0, y1, x0, x1):
+    return (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] +
+            integral[y0, x0])
+
+
+class ROIStatistics(object):
+    '''
+    Computes the statistics of registered regions of interest for every frame
+    acquired by a camera, so that controllers can read them without snapping
+    and processing full frames themselves.
+
+    The object is fed by the camera's acquisition thread (it behaves as one of
+    its frame queues). For cameras without acquisition thread, statistics are
+    computed on demand from `.Camera.snap`.
+
+    Parameters
+    ----------
+    camera : `.Camera`
+        The camera.
+    '''
+    def __init__(self, camera):
+        self.camera = camera
+        self._rois = {}  # key -> (y0, y1, x0, x1, decimation)
+        self._results = {}  # key -> ROIStats
+        self._keys = itertools.count()
+        self._condition = threading.Condition()
+        self.attached = False
+
+    def add(self, roi=None, decimation=1):
+        '''
+        Registers a region of interest.
+
+        Parameters
+        ----------
+        roi : tuple, optional
+            The region ``(x0, y0, x1, y1)`` in pixels of the image returned by
+            `.Camera.snap`, i.e. ``image[y0:y1, x0:x1]`` (the full frame by
+            default). The region is clipped to the image.
+        decimation : int, optional
+            Only use every ``decimation``-th pixel in each dimension.
+
+        Returns
+        -------
+        key : int
+            The key of the region, used in `latest`, `next` and `remove`.
+        '''
+        if roi is not None:
+            x0, y0, x1, y1 = [int(v) for v in roi]
+            roi = (max(y0, 0), max(y1, 0), max(x0, 0), max(x1, 0))
+        with self._condition:
+            key = next(self._keys)
+            self._rois[key] = (roi, max(int(decimation), 1))
+        return key
+
+    def remove(self, key):
+        '''
+        Unregisters a region of interest.
+        '''
+        with self._condition:
+            self._rois.pop(key, None)
+            self._results.pop(key, None)
+
+    def _raw_region(self, roi, shape):
+        # Converts the region from snap coordinates to raw frame coordinates
+        height, width = shape[:2]
+        if roi is None:
+            return 0, height, 0, width
+        y0, y1, x0, x1 = [min(v, limit) for v, limit in zip(roi, (height, height,
+                                                                   width, width))]
+        if self.camera.flipped:
+            x0, x1 = width - x1, width - x0
+        return y0, y1, x0, x1
+
+    def compute(self, frame, rois=None):
+        '''
+        Computes the statistics of regions of interest on a raw frame.
+
+        Parameters
+        ----------
+        frame : `~numpy.ndarray`
+            The raw frame (color frames are averaged over channels).
+        rois : dict, optional
+            Dictionary mapping keys to ``(roi, decimation)`` tuples (by default,
+            the registered regions).
+
+        Returns
+        -------
+        statistics : dict
+            Dictionary mapping keys to ``(mean, var)`` tuples.
+        '''
+        if rois is None:
+            with self._condition:
+                rois = dict(self._rois)
+        if frame.ndim == 3:
+            frame = frame.mean(axis=2)
+        statistics = {}
+        by_decimation = collections.defaultdict(list)
+        for key, (roi, decimation) in rois.items():
+            by_decimation[decimation].append((key, roi))
+        for decimation, regions in by_decimation.items():
+            decimated = np.asarray(frame[::decimation, ::decimation], dtype=float)
+            # Integral images are only worth it for several regions
+            integrals = _integral_images(decimated) if len(regions) > 1 else None
+            for key, roi in regions:
+                y0, y1, x0, x1 = [int(np.ceil(v / float(decimation)))
+                                  for v in self._raw_region(roi, frame.shape)]
+                n = (y1 - y0) * (x1 - x0)
+                if n <= 0:
+                    statistics[key] = (np.nan, np.nan)
+                elif integrals is None:
+                    region = decimated[y0:y1, x0:x1]
+                    statistics[key] = (region.mean(), region.var())
+                else:
+                    mean = _box_sum(integrals[0], y0, y1, x0, x1) / n
+                    mean_square = _box_sum(integrals[1], y0, y1, x0, x1) / n
+                    statistics[key] = (mean, max(mean_square - mean**2, 0.))
+        return statistics
+
+    def append(self, entry):
+        '''
+        Receives a new frame from the acquisition thread, as a
+        ``(frame_number, creation_time, elapsed_time, frame)`` tuple.
+        '''
+        frame_number, _, _, frame = entry
+        if frame_number is None or frame is None:  # end of acquisition
+            return
+        with self._condition:
+            rois = dict(self._rois)
+        if not rois:
+            return
+        t = time.time()
+        statistics = self.compute(frame, rois)
+        with self._condition:
+            for key, (mean, var) in statistics.items():
+                if key in self._rois:
+                    self._results[key] = ROIStats(frame_number, t, mean, var)
+            self._condition.notify_all()
+
+    def latest(self, key):
+        '''
+        The statistics of the most recent frame (`ROIStats`), or ``None`` if no
+        frame has been processed since the region was registered.
+        '''
+        with self._condition:
+            return self._results.get(key)
+
+    def next(self, key, timeout=1.):
+        '''
+        Waits for the statistics of the next frame (acquired after the call).
+        If the camera has no acquisition thread, or if no frame arrives before
+        the timeout, the statistics are calculated on a snapped image.
+
+        Returns
+        -------
+        statistics : `ROIStats`
+        '''
+        start = time.time()
+        if self.attached:
+            with self._condition:
+                while True:
+                    result = self._results.get(key)
+                    if result is not None and result.time > start:
+                        return result
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+        with self._condition:
+            rois = {key: self._rois[key]}
+        # Statistics are computed on raw frame coordinates
+        mean, var = self.compute(self.camera.raw_snap(), rois)[key]
+        return ROIStats(None, time.time(), mean, var)
@@ -12,9 +12,12 @@ from __future__ import print_function
 from __future__ import absolute_import
 from .manipulatorunit import *
 from numpy import (array, zeros, dot, arange, vstack, sign, pi, arcsin,
-                   mean, std, isnan)
+                   mean, isnan, ceil)
 from numpy.linalg import inv, pinv, norm
 from holypipette.vision import *
+from .onlinecalibration import OnlineCalibration
+from .driftmonitor import DriftMonitor
+from .positionmonitor import PositionMonitor
 
 
 __all__ = ['CalibratedUnit', 'CalibrationError', 'CalibratedStage']
@@ -45,9 +48,33 @@ class CalibrationConfig(Config):
                                 bounds=(0, 2))
     stage_refine_steps = Number(2, doc='Number of refinement steps for stage calibration',
                                bounds=(0, 20))
+    online_calibration = Boolean(True, doc='Refine calibration at each pipette localization')
+    online_forgetting = Number(0.95, doc='Forgetting factor for online calibration',
+                               bounds=(0.5, 1))
+    online_offset_drift = NumberWithUnit(0.3, unit='px',
+                                         doc='Expected offset drift between localizations (online calibration)',
+                                         bounds=(0, 100))
+    online_max_residual = NumberWithUnit(50, unit='px',
+                                         doc='Maximum horizontal localization error for online calibration',
+                                         bounds=(0, 1000))
+    mosaic_overlap = Number(0.1, doc='Overlap between mosaic tiles (fraction of the field)',
+                            bounds=(0, 0.5))
+    mosaic_registration = Boolean(True, doc='Register mosaic tiles on their overlaps')
+    overview_width = NumberWithUnit(4000, unit='px', doc='Width of the overview mosaic',
+                                    bounds=(0, 100000))
+    drift_compensation = Boolean(False, doc='Compensate the drift of the preparation')
+    drift_interval = NumberWithUnit(5., unit='s', doc='Interval between drift estimations',
+                                    bounds=(0.5, 60))
+    overview_height = NumberWithUnit(4000, unit='px', doc='Height of the overview mosaic',
+                                     bounds=(0, 100000))
     categories = [('Calibration', ['sleep_time', 'position_tolerance',
                                    'stack_depth', 'calibration_moves', 'equalize_axes', 'pause_in_stack',
                                    'stage_refine_steps']),
+                  ('Online calibration', ['online_calibration', 'online_forgetting',
+                                          'online_offset_drift', 'online_max_residual']),
+                  ('Mosaic', ['mosaic_overlap', 'mosaic_registration',
+                              'overview_width', 'overview_height']),
+                  ('Drift compensation', ['drift_compensation', 'drift_interval']),
                   ('Display', ['position_update'])]
 
 
@@ -71,6 +98,12 @@ class CalibrationError(Exception):
 #         self.offset = offset
 
 class CalibratedUnit(ManipulatorUnit):
+    #: Tasks that only move the unit, and can therefore run while the stage or
+    #: the microscope are used by another task
+    unit_tasks = ('absolute_move', 'relative_move', 'reference_move',
+                  'reference_relative_move', 'reference_move_not_X',
+                  'reference_move_not_Z', 'withdraw')
+
     def __init__(self, unit, stage=None, microscope=None, camera=None,
                  config=None):
         '''
@@ -113,6 +146,9 @@ class CalibratedUnit(ManipulatorUnit):
         self.Minv = zeros((len(unit.axes),3)) # Inverse of M, when well defined (otherwise pseudoinverse? pinv)
         self.r0 = zeros(3) # Offset in reference system
 
+        # Online refinement of M and r0, started after each calibration
+        self.online_calibration = None
+
         # Dictionary of objectives and conditions (immersed/non immersed)
         #self.objective = dict()
 
@@ -137,6 +173,15 @@ class CalibratedUnit(ManipulatorUnit):
             self.microscope.recover_state()
         self.absolute_move(self.saved_state)
 
+    def resources(self, task=None):
+        unit = ManipulatorUnit.resources(self)
+        if task in self.unit_tasks:
+            return unit
+        elif task in ('safe_move', 'focus'):
+            return unit + ('microscope',)
+        else:  # e.g. calibration: the stage and the microscope are moved too
+            return unit + ('microscope', 'stage')
+
     def reference_position(self):
         '''
         Position in the reference camera system.
@@ -376,27 +421,32 @@ class CalibratedUnit(ManipulatorUnit):
         self.reference_move(array([0,0,self.microscope.position()])+ withdraw * self.M[:,0] * self.up_direction[0])
         self.wait_until_still()
 
-        # Take photos to analyze the mean contrast (not exactly)
-        images=[]
-        for _ in range(10):
-            images.append(std(self.camera.snap()))
-            self.sleep(0.1)
-        I0 = mean(images)
-        sigma = I0*.2 # allow for a 20% change
-        self.debug('Contrast: '+str(I0)+" +- "+str(sigma))
-
-        # Move by steps of 100 um until the contrast changes
-        found = False
-        for i in range(50): # 5 mm maximum
-            self.debug('Moving down, i='+str(i))
-            #self.relative_move(-50.*self.up_direction[0],0)
-            # absolute move just to ensure it's fast
-            self.absolute_move(self.position(0)-100. * self.up_direction[0], 0)
-            self.wait_until_still(0)
-            I = std(self.camera.snap())
-            if abs(I-I0)>sigma:
-                found = True
-                break
+        # Analyze the mean contrast (not exactly) on decimated frames
+        roi_statistics = self.camera.roi_statistics
+        roi = roi_statistics.add(decimation=2)
+        try:
+            images=[]
+            for _ in range(10):
+                images.append(roi_statistics.next(roi).std)
+                self.sleep(0.1)
+            I0 = mean(images)
+            sigma = I0*.2 # allow for a 20% change
+            self.debug('Contrast: '+str(I0)+" +- "+str(sigma))
+
+            # Move by steps of 100 um until the contrast changes
+            found = False
+            for i in range(50): # 5 mm maximum
+                self.debug('Moving down, i='+str(i))
+                #self.relative_move(-50.*self.up_direction[0],0)
+                # absolute move just to ensure it's fast
+                self.absolute_move(self.position(0)-100. * self.up_direction[0], 0)
+                self.wait_until_still(0)
+                I = roi_statistics.next(roi).std
+                if abs(I-I0)>sigma:
+                    found = True
+                    break
+        finally:
+            roi_statistics.remove(roi)
 
         if found:
             self.info('Pipette found! with change = '+str(abs(I-I0)/I0))
@@ -762,6 +812,7 @@ class CalibratedUnit(ManipulatorUnit):
             self.Minv = Minv
             self.r0 = r0
             self.calibrated = True
+            self.start_online_calibration()
         else:
             raise CalibrationError('Matrix contains NaN values')
 
@@ -888,6 +939,7 @@ class CalibratedUnit(ManipulatorUnit):
         self.r0 = array([x, y, z]) - dot(self.M, u0) - self.stage.reference_position()
 
         self.calibrated = True
+        self.start_online_calibration()
 
     def recalibrate(self, xy=(0,0)):
         '''
@@ -899,6 +951,7 @@ class CalibratedUnit(ManipulatorUnit):
         z0 = self.microscope.position()
         stager0 = self.stage.reference_position()
         x,y = xy
+        self.update_calibration(array([x, y, z0]), u0, stager0)
         r0 = array([x, y, z0]) - dot(self.M, u0) - stager0
         self.r0 = r0
 
@@ -935,6 +988,7 @@ class CalibratedUnit(ManipulatorUnit):
         self.Minv = Minv
         self.r0 = r0
         self.calibrated = True
+        self.start_online_calibration()
 
     def auto_recalibrate(self, center=True):
         '''
@@ -953,6 +1007,7 @@ class CalibratedUnit(ManipulatorUnit):
         u0 = self.position()
         stager0 = self.stage.reference_position()
 
+        self.update_calibration(array([x,y,z]), u0, stager0)
         # Offset is such that the position is (x,y,z) in the reference system
         self.r0 = array([x,y,z]) - dot(self.M, u0) - stager0
 
@@ -964,6 +1019,75 @@ class CalibratedUnit(ManipulatorUnit):
             self.stage.reference_relative_move(-array([x,y]))
         self.wait_until_still()
 
+    def start_online_calibration(self):
+        '''
+        (Re)starts the online refinement of the calibration from the current
+        matrix and offset.
+        '''
+        self.online_calibration = OnlineCalibration(self.M, self.r0, self.position(),
+                                                    forgetting=self.config.online_forgetting,
+                                                    offset_drift=self.config.online_offset_drift,
+                                                    max_residual=self.config.online_max_residual)
+
+    def update_calibration(self, r, u=None, rs=None):
+        '''
+        Refines the calibration matrix M with a new localization of the tip,
+        using recursive least squares (the estimator also tracks the offset,
+        but r0 is set from the observation by the callers). After a rejected
+        observation, or while online calibration is switched off, the
+        estimator is restarted from the current calibration at the next
+        localization.
+
+        Parameters
+        ----------
+        r : observed tip position in the reference system (XYZ vector)
+        u : unit position at the time of the observation (current position if None)
+        rs : reference position of the stage (current position if None)
+
+        Returns
+        -------
+        True if the calibration was updated, False if online calibration is
+        switched off or the observation was rejected as an outlier.
+        '''
+        if not self.calibrated:
+            return False
+        if not self.config.online_calibration:
+            # The offset changes without the estimator
+            self.online_calibration = None
+            return False
+        if u is None:
+            u = self.position()
+        if rs is None:
+            rs = self.stage.reference_position()
+        if self.online_calibration is None: # e.g. calibration loaded from file
+            self.start_online_calibration()
+        estimator = self.online_calibration
+        estimator.forgetting = self.config.online_forgetting
+        estimator.offset_drift = self.config.online_offset_drift
+        estimator.max_residual = self.config.online_max_residual
+        rejected = estimator.n_rejected
+        residual = estimator.update(u, rs, r)
+        self.debug('Localization error: {}'.format(list(residual)))
+        if estimator.n_rejected > rejected:
+            self.info('Localization error too large ({:.1f} px), calibration matrix '
+                      'not updated'.format(norm(residual[:2])))
+            # Restarted from the new offset at the next localization
+            self.online_calibration = None
+            return False
+        self.M = estimator.M
+        self.Minv = pinv(self.M)
+        return True
+
+    def calibration_drift(self):
+        '''
+        Statistics on the drift of the calibration since the last full
+        calibration (see `OnlineCalibration.statistics`), or None if no
+        localization has been made yet.
+        '''
+        if self.online_calibration is None:
+            return None
+        return self.online_calibration.statistics()
+
     def save_configuration(self):
         '''
         Outputs configuration in a dictionary.
@@ -991,6 +1115,7 @@ class CalibratedUnit(ManipulatorUnit):
             self.Minv = pinv(self.M)
             self.calibrated = True
         self.r0 = config.get('r0', self.r0)
+        self.online_calibration = None
         self.pipette_position = config.get('pipette_position', self.pipette_position)
         self.photos = config.get('photos', self.photos)
         self.photo_x0 = config.get('photo_x0', self.photo_x0)
@@ -1047,13 +1172,62 @@ class CalibratedStage(CalibratedUnit):
         # It should be an XY stage, ie, two axes
         if len(self.axes) != 2:
             raise CalibrationError('The unit should have exactly two axes for horizontal calibration.')
+        self._drift_monitor = DriftMonitor(self, interval=self.config.drift_interval)
+        self._position_monitor = PositionMonitor(self)
 
-    def reference_move(self, r):
+    def resources(self, task=None):
+        if task in self.unit_tasks:
+            return ('stage',)
+        else:
+            return ('stage', 'microscope')
+
+    @property
+    def drift_monitor(self):
+        '''
+        The `DriftMonitor` estimating the drift of the preparation.
+        '''
+        return self._drift_monitor
+
+    @property
+    def position_monitor(self):
+        '''
+        The `PositionMonitor` caching and predicting the stage position.
+        '''
+        return self._position_monitor
+
+    def drift(self):
+        '''
+        The estimated drift of the preparation in the reference system (zero if
+        drift compensation is disabled).
+        '''
+        if not self.config.drift_compensation:
+            return zeros(2)
+        return self.drift_monitor.drift()
+
+    def reference_position(self, compensate_drift=False):
+        '''
+        Position in the reference camera system.
+
+        Parameters
+        ----------
+        compensate_drift : bool, optional
+            Whether to add the estimated drift of the preparation, i.e. give
+            the position relative to the preparation rather than relative to
+            the stage.
+        '''
+        r = CalibratedUnit.reference_position(self)
+        if compensate_drift:
+            r[:2] += self.drift()
+        return r
+
+    def reference_move(self, r, compensate_drift=False):
         if len(r)==2: # Third coordinate is actually not useful
             r3D = zeros(3)
             r3D[:2] = r
         else:
-            r3D = r
+            r3D = array(r, dtype=float)
+        if compensate_drift:
+            r3D[:2] -= self.drift()
         CalibratedUnit.reference_move(self, r3D) # Third coordinate is ignored
 
     def reference_relative_move(self, r):
@@ -1062,6 +1236,8 @@ class CalibratedStage(CalibratedUnit):
             r3D[:2] = r
         else:
             r3D = r
+        if self.position_monitor.is_running:
+            self.position_monitor.expect(r3D)
         CalibratedUnit.reference_relative_move(self, r3D) # Third coordinate is ignored
 
     def equalize_matrix(self, M=None):
@@ -1246,53 +1422,117 @@ class CalibratedStage(CalibratedUnit):
             self.info('Error = {} pixels = {} %'.format(best_error**.5,
                                                         100*(best_error**.5)/max([width,height])))
 
-    def mosaic(self, width = None, height = None):
+    def mosaic(self, width = None, height = None, directory = None):
         '''
         Takes a photo mosaic. Current position corresponds to
         the top left corner of the collated image.
-        Stops when the unit's position is out of range, unless
-        width and height are specified.
+
+        Tiles overlap by a fraction ``config.mosaic_overlap`` of the field of
+        view. Their positions are refined by phase correlation on the
+        overlaps (if ``config.mosaic_registration`` is set), and they are
+        blended into an on-disk pyramid as they are acquired, so that the
+        memory use does not depend on the size of the mosaic.
 
         Parameters
         ----------
-        width : total width in pixel (optional)
-        height : total height in pixel (optional)
+        width : total width in pixel (optional, default: one field of view)
+        height : total height in pixel (optional, default: one field of view)
+        directory : directory where the mosaic is stored (optional, temporary
+                    directory by default)
 
         Returns
         -------
-        A large image of the mosaic.
+        The mosaic (`Mosaic`), with downsampled levels for display. Unless
+        ``directory`` is given, its files are deleted when it is closed (use
+        it in a ``with`` block, or call its ``close`` method).
         '''
         u0=self.position()
 
         dx, dy = self.camera.width, self.camera.height
-        # Number of moves in each direction
-        nx = 1+int(width/dx)
-        ny = 1+int(height/dy)
-        # Big image
-        big_image = zeros((ny*dy,nx*dx))
+        if width is None:
+            width = dx
+        if height is None:
+            height = dy
+        # Steps between tiles
+        sx = max(int(dx*(1-self.config.mosaic_overlap)), 1)
+        sy = max(int(dy*(1-self.config.mosaic_overlap)), 1)
+        # Number of tiles in each direction
+        nx = 1+int(ceil(max(width-dx, 0)/float(sx)))
+        ny = 1+int(ceil(max(height-dy, 0)/float(sy)))
+        mosaic = Mosaic(((ny-1)*sy+dy, (nx-1)*sx+dx), directory=directory,
+                        feather=max(dx-sx, dy-sy))
+        # Position error of the last tile, used as a prior for the next one
+        correction = zeros(2)
+
+        def add_tile(row, column):
+            img = self.camera.snap()
+            position = array([column*sx, row*sy]) + correction
+            if self.config.mosaic_registration:
+                position = array(mosaic.register(img, position, upsample_factor=10))
+            correction[:] = position - array([column*sx, row*sy])
+            mosaic.add_tile(img, position)
 
         column = 0
         xdirection = 1 # moving direction along x axis
 
         try:
             for row in range(ny):
-                img = self.camera.snap()
-                big_image[row*dy:(row+1)*dy, column*dx:(column+1)*dx] = img
+                add_tile(row, column)
                 for _ in range(1,nx):
                     column+=xdirection
-                    self.reference_relative_move([-dx*xdirection,0,0]) # sign: it's a compensatory move
+                    self.reference_relative_move([-sx*xdirection,0,0]) # sign: it's a compensatory move
                     self.wait_until_still()
                     self.sleep(0.1)
-                    img = self.camera.snap()
-                    big_image[row * dy:(row + 1) * dy, column * dx:(column + 1) * dx] = img
+                    add_tile(row, column)
                 if row<ny-1:
                     xdirection = -xdirection
-                    self.reference_relative_move([0,-dy,0])
+                    self.reference_relative_move([0,-sy,0])
                     self.wait_until_still()
+                    self.sleep(0.1)
         finally: # move back to initial position
             self.absolute_move(u0)
+            mosaic.flush()
 
-        return big_image
+        self.debug('Mosaic of {}x{} tiles, final correction: {} pixels'.format(nx, ny, correction))
+        return mosaic
+
+    def map_position(self, xy_position=(0, 0)):
+        '''
+        Position on the overview map (see `OverviewMap`) of a point in the
+        image, given relative to the image center (the image center by
+        default).
+        '''
+        return (array(xy_position[:2], dtype=float) -
+                self.reference_position(compensate_drift=True)[:2])
+
+    def move_to_map_position(self, map_position):
+        '''
+        Moves the stage so that a position of the overview map is at the
+        center of the image.
+        '''
+        self.reference_move(-array(map_position[:2], dtype=float), compensate_drift=True)
+        self.wait_until_still()
+
+    def add_to_overview(self, overview_map):
+        '''
+        Takes a mosaic of size ``config.overview_width`` x
+        ``config.overview_height`` centered on the current position, and adds
+        it to an overview map.
+        '''
+        width, height = self.config.overview_width, self.config.overview_height
+        dx, dy = self.camera.width, self.camera.height
+        # The mosaic starts at the top left corner
+        self.reference_relative_move([(width-dx)/2., (height-dy)/2., 0])
+        self.wait_until_still()
+        top_left = self.map_position((-dx/2., -dy/2.))
+        mosaic = self.mosaic(width, height)
+        try:
+            overview_map.add_mosaic(mosaic, top_left)
+        finally:
+            mosaic.close()
+            self.reference_relative_move([-(width-dx)/2., -(height-dy)/2., 0])
+            self.wait_until_still()
+        self.info('Added {:.0f}x{:.0f} pixels to the overview map'.format(width, height))
 
 class FixedStage(CalibratedUnit):
     '''
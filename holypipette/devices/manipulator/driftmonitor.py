@@ -0,0 +1,161 @@
+'''
+Estimation of the drift of the preparation relative to the stage, by
+registration of camera images against a reference image.
+'''
+from __future__ import absolute_import
+import numpy as np
+
+from holypipette.utils.monitor import Monitor
+from holypipette.utils.statestore import shared_state
+from holypipette.vision.phase_cross_correlation import RegistrationContext
+
+__all__ = ['DriftMonitor']
+
+
+class DriftMonitor(Monitor):
+    '''
+    Periodically registers the camera image (or a region of it) against a
+    reference image taken by `set_reference`, and records the drift of the
+    preparation in the reference system (see `.Monitor`).
+
+    The drift ``d`` is defined so that a point of the preparation that
+    appears at position ``p`` in the image is at position ``p - r_stage - d``
+    relative to the stage, where ``r_stage`` is the stage's position in the
+    reference system. Expected image shifts due to stage movements are taken
+    into account; when the stage has moved too far from the reference
+    position, or when the drift is too large, the reference image is renewed.
+
+    To leave the processing time to tracking, the estimation uses
+    downsampled images, runs at a low rate, and is skipped while a target is
+    tracked.
+
+    Parameters
+    ----------
+    stage : `.CalibratedStage`
+        The calibrated stage (with its camera).
+    interval : float, optional
+        Time (in s) between two estimations.
+    roi : tuple, optional
+        The region ``(x0, y0, x1, y1)`` of the image used for registration
+        (the full image by default), e.g. a textured region without moving
+        objects.
+    decimation : int, optional
+        Only use every ``decimation``-th pixel in each dimension.
+    upsample_factor : int, optional
+        Subpixel precision (see `.phase_cross_correlation`).
+    max_error : float, optional
+        Registrations with a larger error (see `.phase_cross_correlation`)
+        are discarded.
+    duration : float, optional
+        Duration (in s) of the drift history.
+    '''
+    def __init__(self, stage, interval=5., roi=None, decimation=2,
+                 upsample_factor=10, max_error=0.8, duration=3600.):
+        super(DriftMonitor, self).__init__(1. / interval, duration, channels=3)
+        self.stage = stage
+        self.roi = roi
+        self.decimation = int(decimation)
+        self.upsample_factor = upsample_factor
+        self.max_error = max_error
+        self._reference = None  # RegistrationContext of the reference image
+        self._reference_position = None  # stage position of the reference
+        self._offset = np.zeros(2)  # drift when the reference was taken
+        self._drift = np.zeros(2)
+
+    def _image(self):
+        image = self.stage.camera.snap()
+        if image.ndim == 3:
+            image = image.mean(axis=2)
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            image = image[y0:y1, x0:x1]
+        image = np.asarray(image[::self.decimation, ::self.decimation], dtype=float)
+        return image - image.mean()
+
+    def _snap(self):
+        # Image and stage position, or None if the stage moved during the snap
+        before = self.stage.reference_position()[:2]
+        image = self._image()
+        after = self.stage.reference_position()[:2]
+        if np.abs(after - before).max() > self.decimation:
+            return None, None
+        return image, after
+
+    def set_reference(self, reset=False):
+        '''
+        Takes a new reference image.
+
+        Parameters
+        ----------
+        reset : bool, optional
+            Whether to also reset the drift to zero (otherwise, the estimated
+            drift is kept and further drift adds to it).
+
+        Returns
+        -------
+        success : bool
+            ``False`` if the stage was moving.
+        '''
+        if reset:
+            self._drift = np.zeros(2)
+            self.buffer.clear()
+        return self._take_reference()
+
+    def _take_reference(self):
+        image, position = self._snap()
+        if image is None:
+            return False
+        # The spectrum of the reference is calculated once for all registrations
+        self._reference = RegistrationContext(image, upsample_factor=self.upsample_factor)
+        self._reference_position = position
+        self._offset = self._drift.copy()
+        return True
+
+    def read(self):
+        if shared_state.tracking.get():
+            return None  # Tracking has priority
+        if self._reference is None:
+            self._take_reference()
+            return None
+        image, position = self._snap()
+        if image is None or image.shape != self._reference.shape:
+            return None
+        # Expected shift of the image due to stage movements (in pixels of the
+        # decimated image)
+        expected = (position - self._reference_position) / self.decimation
+        limit = np.array(image.shape[::-1]) / 4.
+        if np.any(np.abs(expected) > limit):
+            # Too little overlap with the reference
+            self._take_reference()
+            return None
+        shifts, error, _ = self._reference.register(image)
+        if error > self.max_error:
+            self.debug('Drift estimation discarded (error = {:.2f})'.format(error))
+            return None
+        # The image content moved by -shifts (row, column)
+        displacement = -shifts[::-1]
+        self._drift = self._offset + (displacement - expected) * self.decimation
+        if np.any(np.abs(displacement) > limit):
+            self._take_reference()
+        return self._drift[0], self._drift[1], error
+
+    def drift(self):
+        '''
+        The most recent estimation of the drift (in the reference system), zero
+        if no estimation has been made.
+        '''
+        return self._drift.copy()
+
+    def history(self, duration=None):
+        '''
+        The estimated drift over time.
+
+        Returns
+        -------
+        times : `~numpy.ndarray`
+            The estimation times (as given by `time.time`).
+        drift : `~numpy.ndarray`
+            The drift (one row per estimation).
+        '''
+        times, values = self.buffer.window(duration)
+        return times, values[:, :2]
@@ -275,6 +275,7 @@ class LuigsNeumann_SM5(SerialDevice,Manipulator):
         """
         res = 1
         while res:
+            self.abort_if_requested()
             res = self.send_command('0120', axes, 7)
             res = int(binascii.hexlify(struct.unpack('s', res[6])[0])[1])
 
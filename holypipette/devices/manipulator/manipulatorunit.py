@@ -4,9 +4,12 @@ It is essentially a subset of a Manipulator
 """
 from __future__ import absolute_import
 
+import time
+
 from numpy import ones, arange
 
 from .manipulator import Manipulator
+from holypipette.controller.base import RequestedAbortException
 
 __all__ = ['ManipulatorUnit']
 
@@ -26,6 +29,10 @@ class ManipulatorUnit(Manipulator):
         self.min = -ones(len(axes))*1e6
         self.max = ones(len(axes))*1e6
 
+    def resources(self, task=None):
+        # Several units can share the same device
+        return (('unit', id(self.dev), tuple(self.axes)),)
+
     def position(self, axis = None):
         '''
         Current position along an axis.
@@ -92,6 +99,50 @@ class ManipulatorUnit(Manipulator):
         else:
             self.dev.stop(self.axes[axis])
 
+    def move_until(self, axis, velocity, max_distance, event, rate=20.):
+        """
+        Moves an axis continuously at a constant velocity, until ``event`` is
+        set or ``max_distance`` has been travelled. The movement is obtained by
+        sending intermediate targets at a fixed rate, each of them slightly
+        ahead of the current position, so that the axis stops quickly on any
+        device.
+
+        Parameters
+        ----------
+        axis : axis number starting at 0
+        velocity : velocity in um/s (the sign gives the direction)
+        max_distance : maximal distance in um
+        event : a `threading.Event` (e.g. set by a detector)
+        rate : number of targets sent per second
+
+        Returns
+        -------
+        True if the movement was stopped by the event.
+        """
+        start = self.position(axis)
+        direction = 1 if velocity > 0 else -1
+        period = 1. / rate
+        t0 = time.time()
+        finished = False  # whether the full distance has been travelled
+        try:
+            while not event.is_set():
+                # Target one period ahead of the expected position
+                distance = min(abs(velocity) * (time.time() - t0 + period), max_distance)
+                self.dev.absolute_move(start + direction * distance, self.axes[axis])
+                if distance >= max_distance:
+                    self.wait_until_still(axis)
+                    finished = True
+                    return event.is_set()
+                next_time = t0 + period * (int((time.time() - t0) / period) + 1)
+                event.wait(max(next_time - time.time(), 0))
+                self.abort_if_requested()
+        finally:
+            # Also stop on errors and abort requests, not only on the event
+            if not finished:
+                self.stop(axis)
+        self.debug('Movement stopped after {:.1f}um'.format(abs(self.position(axis) - start)))
+        return True
+
     def motor_ranges(self):
         """
         Runs the motors to calculate ranges of the motors.
@@ -120,16 +171,21 @@ class ManipulatorUnit(Manipulator):
 
     def wait_until_still(self, axes = None):
         """
-        Waits for the motors to stop.
+        Waits for the motors to stop. If an abort is requested while waiting,
+        the motors are stopped.
         """
         if axes is None: # all axes
             axes = arange(len(self.axes))
-        if hasattr(axes, '__len__'):  # is that useful?
-            for i in axes:
-                self.wait_until_still(i)
-        else:
-            self.dev.wait_until_still([self.axes[axes]])
-        self.sleep(.05)
+        try:
+            if hasattr(axes, '__len__'):  # is that useful?
+                for i in axes:
+                    self.wait_until_still(i)
+            else:
+                self.dev.wait_until_still([self.axes[axes]])
+            self.sleep(.05)
+        except RequestedAbortException:
+            self.stop()
+            raise
 
     def wait_until_reached(self, position, axes=None, precision=0.5, timeout=10):
         """
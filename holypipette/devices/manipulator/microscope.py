@@ -7,6 +7,7 @@ TODO:
 * steps for stack acquisition?
 '''
 from holypipette.devices.manipulator import *
+from holypipette.controller.base import RequestedAbortException
 import time
 import warnings
 try:
@@ -36,6 +37,9 @@ class Microscope(Manipulator):
         self.min = -1e6 # This could replace floor_Z
         self.max = 1e6
 
+    def resources(self, task=None):
+        return ('microscope',)
+
     def position(self):
         '''
         Current position
@@ -79,10 +83,15 @@ class Microscope(Manipulator):
 
     def wait_until_still(self):
         """
-        Waits for the motors to stop.
+        Waits for the motors to stop. If an abort is requested while waiting,
+        the motor is stopped.
         """
-        self.dev.wait_until_still([self.axis])
-        self.sleep(.05)
+        try:
+            self.dev.wait_until_still([self.axis])
+            self.sleep(.05)
+        except RequestedAbortException:
+            self.stop()
+            raise
 
     def stack(self, camera, z, preprocessing=lambda img:img, save = None, pause = 0.3):
         '''
@@ -0,0 +1,175 @@
+# coding=utf-8
+'''
+Online refinement of the calibration of a manipulator unit.
+
+Every time the pipette tip is located on screen (automatic recalibration,
+manual recalibration by clicking on the tip, etc.), we obtain a triple
+(unit position, stage position, tip position in the reference system).
+These observations are used to update the matrix ``M`` and the offset ``r0``
+with a recursive least squares (RLS) estimator, so that the calibration
+follows slow drifts without a full recalibration. The offset is modelled as
+a random walk (it drifts between observations), so that drifts are not
+mistaken for changes of the matrix.
+
+The model is the one of `.CalibratedUnit`::
+
+    r = M u + r0 + rs
+
+where ``r`` is the tip position in the reference system, ``u`` the unit
+position and ``rs`` the reference position of the stage. To keep the
+problem well conditioned, positions are taken relative to the unit position
+at the time the estimator was (re)started.
+'''
+from __future__ import absolute_import
+import collections
+import time
+
+from numpy import (array, zeros, dot, outer, diag, concatenate, trace, sqrt,
+                   mean)
+from numpy.linalg import norm
+
+__all__ = ['OnlineCalibration']
+
+
+class OnlineCalibration(object):
+    '''
+    Recursive least squares estimator of the calibration of a unit.
+
+    Parameters
+    ----------
+    M : initial unit to camera matrix (3 x number of axes)
+    r0 : initial offset in the reference system
+    u_ref : unit position used as the origin of the regression (usually the
+            current position)
+    forgetting : forgetting factor (1 means all observations have the same weight,
+                 lower values favor recent observations)
+    matrix_uncertainty : initial standard deviation of the matrix coefficients,
+                         relative to the measurement noise (in 1/um)
+    offset_uncertainty : initial standard deviation of the offset, relative to
+                         the measurement noise
+    offset_drift : standard deviation of the change of the offset between two
+                   observations (drift of the preparation or of the pipette),
+                   relative to the measurement noise
+    max_residual : observations with a horizontal (x, y) prediction error larger
+                   than this value (in pixels) are not used for the update (but
+                   are recorded)
+    history_size : number of observations kept for the drift statistics
+    '''
+    def __init__(self, M, r0, u_ref, forgetting=0.98,
+                 matrix_uncertainty=0.01, offset_uncertainty=10.,
+                 offset_drift=0.3, max_residual=None, history_size=100):
+        self.forgetting = forgetting
+        self.offset_drift = offset_drift
+        self.max_residual = max_residual
+        self.u_ref = array(u_ref, dtype=float)
+        self.M0 = array(M, dtype=float)
+        self.r00 = array(r0, dtype=float)
+        naxes = self.M0.shape[1]
+        # Parameters: one column per reference coordinate; the rows are the
+        # matrix coefficients for each axis and the offset (at u_ref)
+        self.theta = zeros((naxes+1, 3))
+        self.theta[:naxes, :] = self.M0.T
+        self.theta[naxes, :] = dot(self.M0, self.u_ref) + self.r00
+        # Covariance of the parameters (shared by the three coordinates)
+        self.P0 = diag(concatenate([[matrix_uncertainty**2]*naxes,
+                                    [offset_uncertainty**2]]))
+        self.P = self.P0.copy()
+        self.n_updates = 0
+        self.n_rejected = 0
+        # (time, residual vector, used for update)
+        self.history = collections.deque(maxlen=history_size)
+
+    @property
+    def M(self):
+        '''
+        Current estimate of the unit to camera matrix.
+        '''
+        return self.theta[:-1, :].T.copy()
+
+    @property
+    def r0(self):
+        '''
+        Current estimate of the offset in the reference system.
+        '''
+        return self.theta[-1, :] - dot(self.M, self.u_ref)
+
+    def predict(self, u, rs):
+        '''
+        Predicted tip position in the reference system.
+
+        Parameters
+        ----------
+        u : unit position
+        rs : reference position of the stage
+        '''
+        phi = self._regressor(u)
+        return dot(self.theta.T, phi) + rs
+
+    def _regressor(self, u):
+        return concatenate([array(u, dtype=float) - self.u_ref, [1.]])
+
+    def update(self, u, rs, r):
+        '''
+        Updates the estimate with a new observation.
+
+        Parameters
+        ----------
+        u : unit position
+        rs : reference position of the stage
+        r : observed tip position in the reference system
+
+        Returns
+        -------
+        The prediction error (observed - predicted position) before the update.
+        '''
+        phi = self._regressor(u)
+        residual = array(r, dtype=float) - array(rs, dtype=float) - dot(self.theta.T, phi)
+        if self.max_residual is not None and norm(residual[:2]) > self.max_residual:
+            self.n_rejected += 1
+            self.history.append((time.time(), residual, False))
+            return residual
+
+        # The offset follows a random walk: its uncertainty grows between
+        # observations, so that drifts are attributed to the offset, not to M
+        self.P[-1, -1] += self.offset_drift**2
+        Pphi = dot(self.P, phi)
+        gain = Pphi / (self.forgetting + dot(phi, Pphi))
+        self.theta += outer(gain, residual)
+        self.P -= outer(gain, Pphi)
+        # Do not let the covariance grow beyond its initial value when
+        # observations are not informative (e.g. the unit does not move),
+        # otherwise the forgetting factor makes the estimator unstable
+        if trace(self.P) < trace(self.P0):
+            self.P /= self.forgetting
+        self.n_updates += 1
+        self.history.append((time.time(), residual, True))
+        return residual
+
+    def statistics(self):
+        '''
+        Drift statistics.
+
+        Returns
+        -------
+        A dictionary with the following keys:
+        ``updates`` and ``rejected`` (number of observations used and rejected),
+        ``mean_residual`` (mean prediction error vector over the recent history),
+        ``rms_residual`` (root mean square norm of the recent prediction errors),
+        ``last_residual`` (most recent prediction error),
+        ``offset_drift`` (change of r0 since the start of the estimator),
+        ``matrix_drift`` (relative change of M since the start of the estimator).
+        '''
+        stats = {'updates': self.n_updates,
+                 'rejected': self.n_rejected,
+                 'offset_drift': self.r0 - self.r00,
+                 'matrix_drift': norm(self.M - self.M0)/norm(self.M0)}
+        if len(self.history):
+            residuals = array([residual for _, residual, _ in self.history])
+            stats['mean_residual'] = mean(residuals, axis=0)
+            stats['rms_residual'] = sqrt(mean((residuals**2).sum(axis=1)))
+            stats['last_residual'] = residuals[-1]
+        else:
+            stats['mean_residual'] = zeros(3)
+            stats['rms_residual'] = 0.
+            stats['last_residual'] = zeros(3)
+        return stats
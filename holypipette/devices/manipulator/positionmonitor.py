@@ -0,0 +1,94 @@
+'''
+Cached and predicted positions of a calibrated unit (typically the stage).
+'''
+from __future__ import absolute_import
+import threading
+import time
+
+import numpy as np
+
+from holypipette.utils.monitor import Monitor
+
+__all__ = ['PositionMonitor']
+
+
+class PositionMonitor(Monitor):
+    '''
+    Samples the horizontal position of a unit in the reference system (see
+    `.Monitor`), so that image processing code can get the position at any
+    time without querying the device. Between and after samples, the position
+    is interpolated or extrapolated from the recent velocity; extrapolation
+    stops at the destination of the last commanded move (see `expect`).
+
+    Parameters
+    ----------
+    unit : `.CalibratedUnit`
+        The unit, e.g. a `.CalibratedStage`.
+    rate : float, optional
+        Sampling rate in Hz.
+    duration : float, optional
+        Duration (in s) of the position history.
+    velocity_window : float, optional
+        Duration (in s) of the history used to estimate the velocity.
+    max_extrapolation : float, optional
+        Maximum duration (in s) of extrapolation after the last sample.
+    '''
+    def __init__(self, unit, rate=20., duration=10., velocity_window=0.2,
+                 max_extrapolation=0.5):
+        super(PositionMonitor, self).__init__(rate, duration, channels=2)
+        self.unit = unit
+        self.velocity_window = velocity_window
+        self.max_extrapolation = max_extrapolation
+        self._destination = None
+        self._destination_lock = threading.Lock()
+
+    def read(self):
+        return self.unit.reference_position()[:2]
+
+    def expect(self, displacement):
+        '''
+        Tells the monitor that the unit has been commanded to move by
+        ``displacement`` (in the reference system), from its last known
+        position.
+        '''
+        _, position = self.buffer.latest()
+        if position is None:
+            return
+        with self._destination_lock:
+            self._destination = position + np.asarray(displacement[:2], dtype=float)
+
+    def velocity(self):
+        '''
+        The current velocity (in pixels/s), estimated by linear regression over
+        the recent samples.
+        '''
+        times, positions = self.buffer.window(self.velocity_window)
+        if len(times) < 2 or times[-1] == times[0]:
+            return np.zeros(2)
+        times = times - times.mean()
+        return np.dot(times, positions - positions.mean(axis=0)) / np.dot(times, times)
+
+    def position_at(self, t=None):
+        '''
+        The position (in the reference system) at time ``t`` (by default, now),
+        or ``None`` if no position has been sampled.
+        '''
+        if t is None:
+            t = time.time()
+        times, positions = self.buffer.window()
+        if not len(times):
+            return None
+        if t < times[-1]:
+            return np.array([np.interp(t, times, positions[:, i]) for i in range(2)])
+        position = positions[-1]
+        delay = min(t - times[-1], self.max_extrapolation)
+        predicted = position + self.velocity() * delay
+        with self._destination_lock:
+            destination = self._destination
+        if destination is not None:
+            remaining = destination - position
+            distance = np.sqrt(np.sum(remaining**2))
+            # Do not overshoot the destination (ignored once it is reached)
+            if distance > 1 and np.dot(predicted - position, remaining) > distance**2:
+                predicted = destination
+        return predicted
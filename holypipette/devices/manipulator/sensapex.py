@@ -244,7 +244,7 @@ class UMP(Manipulator):
             if self.lib.ump_is_busy_status(status) == 1:
                 break
         while(bool(self.lib.ump_is_busy_status(status))):
-            time.sleep(0.05)
+            self.sleep(0.05)
             for dev in devids:
                 status = self.call('get_status_ext', ctypes.c_int(dev))
                 if self.lib.ump_is_busy_status(status) == 1:
@@ -1,3 +1,5 @@
 from __future__ import absolute_import
 from .pressurecontroller import *
+from .waveform import *
+from .pressuremonitor import *
 from .ob1 import *
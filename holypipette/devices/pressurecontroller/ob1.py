@@ -7,6 +7,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 import os
 import sys
+import threading
 from ctypes import *
 import warnings
 from .pressurecontroller import *
@@ -22,6 +23,11 @@ except ImportError:
 
 __all__ = ['OB1']
 
+# Calls to the SDK are serialized, since the pressure can be measured from a
+# monitoring thread (see `.PressureMonitor`) while it is set by a task or a
+# waveform player
+_device_lock = threading.RLock()
+
 def _check_error(task, error):
     if error != 0:
         raise RuntimeError('{} failed with error code {}'.format(task, error))
@@ -60,7 +66,8 @@ class OB1(PressureController):
         '''
         set_channel = c_int32(port)  # convert to c_int32
         get_pressure = c_double()
-        error =  OB1_Get_Sens_Data(self.instr_ID.value, set_channel, 1, byref(get_pressure))  # Acquire_data =1 -> Read all the analog value
+        with _device_lock:
+            error =  OB1_Get_Sens_Data(self.instr_ID.value, set_channel, 1, byref(get_pressure))  # Acquire_data =1 -> Read all the analog value
         _check_error('Getting data from flow sensor', error)
         return get_pressure.value
 
@@ -70,9 +77,17 @@ class OB1(PressureController):
         '''
         set_channel = c_int32(port)  # convert to c_int32
         set_pressure = c_double(pressure)  # convert to c_double
-        error = OB1_Set_Press(self.instr_ID.value, set_channel, set_pressure, byref(self.calib), 1000)
-        _check_error('Setting pressure', error)
-        super(OB1, self).set_pressure(pressure, port=port)
+        with _device_lock:
+            error = OB1_Set_Press(self.instr_ID.value, set_channel, set_pressure, byref(self.calib), 1000)
+            _check_error('Setting pressure', error)
+            super(OB1, self).set_pressure(pressure, port=port)
+
+    def get_pressure(self, port=0):
+        '''
+        Gets the pressure on the designated port, as set via `.set_pressure`.
+        '''
+        with _device_lock:
+            return super(OB1, self).get_pressure(port=port)
 
 if __name__ == '__main__':
     ob1 = OB1(calibrate = True)
@@ -2,17 +2,29 @@
 A general pressure controller class
 '''
 import collections
-from time import time
 
-from holypipette.controller.base import TaskController
+from holypipette.controller.base import TaskController, RequestedAbortException
+from .waveform import Waveform, WaveformPlayer
+from .pressuremonitor import PressureMonitor
 
 all = ['PressureController',  'FakePressureController']
 
 
 class PressureController(TaskController):
+    #: Update rate (in Hz) of pressure commands when playing waveforms
+    update_rate = 50.
+    #: Pressure changes (in mbar) below this value are not sent when playing
+    #: waveforms
+    resolution = 0.1
+
     def __init__(self):
         super(PressureController, self).__init__()
         self._pressure = collections.defaultdict(int)
+        self._waveform_players = {}
+        self._pressure_monitor = PressureMonitor(self)
+
+    def resources(self, task=None):
+        return ('pressure',)
 
     def measure(self, port = 0):
         '''
@@ -34,16 +46,54 @@ class PressureController(TaskController):
         '''
         return self._pressure[port]
 
+    @property
+    def pressure_monitor(self):
+        '''
+        The `.PressureMonitor` sampling the measured and commanded pressure of
+        this controller.
+        '''
+        return self._pressure_monitor
+
+    def waveform_player(self, port=0):
+        '''
+        The `.WaveformPlayer` for the designated port.
+        '''
+        if port not in self._waveform_players:
+            self._waveform_players[port] = WaveformPlayer(self, port,
+                                                          resolution=self.resolution)
+        return self._waveform_players[port]
+
+    def play(self, waveform, port=0, final=None, wait=True):
+        '''
+        Plays a pressure waveform on designated port.
+
+        Parameters
+        ----------
+        waveform : `.Waveform`
+            The waveform (resampled to `update_rate` if necessary).
+        port : int, optional
+            The port of the controller.
+        final : float, optional
+            A pressure to set at the end of the waveform.
+        wait : bool, optional
+            Whether to wait for the end of the waveform (the default). An
+            abort request stops the waveform.
+        '''
+        player = self.waveform_player(port)
+        player.start(waveform.resampled(self.update_rate), final=final)
+        if wait:
+            try:
+                self.wait_for(player.is_done)
+            except RequestedAbortException:
+                player.stop()
+                raise
+
     def ramp(self,amplitude = -230., duration = 1.5, port = 0):
         '''
         Makes a ramp of pressure
         '''
-        t0 = time()
-        t = t0
-        while t-t0<duration:
-            self.set_pressure(amplitude*(t-t0)/duration,port)
-            t = time()
-        self.set_pressure(0., port)
+        self.play(Waveform.ramp(0., amplitude, duration, rate=self.update_rate),
+                  port=port, final=0.)
 
 
 class FakePressureController(PressureController):
@@ -0,0 +1,155 @@
+'''
+Continuous monitoring of the measured and commanded pressure.
+'''
+from __future__ import absolute_import
+import time
+
+import numpy as np
+
+from holypipette.utils.monitor import Monitor
+
+__all__ = ['PressureMonitor']
+
+
+class PressureMonitor(Monitor):
+    '''
+    Samples the measured pressure (`.PressureController.measure`) and the
+    commanded pressure (`.PressureController.get_pressure`) of each port in a
+    background thread (see `.Monitor`).
+
+    Parameters
+    ----------
+    controller : `.PressureController`
+        The pressure controller to monitor.
+    ports : sequence of int, optional
+        The ports to monitor.
+    rate : float, optional
+        Sampling rate in Hz.
+    duration : float, optional
+        Duration (in s) of the history kept in the ring buffer.
+    '''
+    def __init__(self, controller, ports=(0,), rate=20., duration=60.):
+        super(PressureMonitor, self).__init__(rate, duration,
+                                              channels=2*len(ports))
+        self.controller = controller
+        self.ports = list(ports)
+
+    def read(self):
+        values = []
+        for port in self.ports:
+            measured = self.controller.measure(port)
+            if measured is None:  # controller without pressure sensor
+                measured = np.nan
+            values.extend([measured, self.controller.get_pressure(port)])
+        return values
+
+    def samples(self, port=0, duration=None):
+        '''
+        The recorded samples for a port, in chronological order.
+
+        Parameters
+        ----------
+        port : int, optional
+            The port of the controller.
+        duration : float, optional
+            Only return the samples of the last ``duration`` seconds (all samples
+            in the buffer by default).
+
+        Returns
+        -------
+        times, measured, commanded : `~numpy.ndarray`
+            The sampling times (as given by `time.time`), the measured and the
+            commanded pressures.
+        '''
+        index = 2*self.ports.index(port)
+        times, values = self.buffer.window(duration)
+        return times, values[:, index], values[:, index + 1]
+
+    def latest(self, port=0):
+        '''
+        The most recent sample for a port, as a ``(time, measured, commanded)``
+        tuple (``(None, None, None)`` if no sample has been recorded).
+        '''
+        t, values = self.buffer.latest()
+        if t is None:
+            return None, None, None
+        index = 2*self.ports.index(port)
+        return t, values[index], values[index + 1]
+
+    def error(self, port=0, window=0.2):
+        '''
+        The mean difference between measured and commanded pressure over the
+        last ``window`` seconds (``None`` if not available).
+        '''
+        _, measured, commanded = self.samples(port, window)
+        if len(measured) == 0 or np.isnan(measured).all():
+            return None
+        return np.nanmean(measured - commanded)
+
+    def is_settled(self, port=0, tolerance=5., duration=0.2, target=None):
+        '''
+        Whether the measured pressure has stayed within ``tolerance`` of the
+        commanded pressure during the last ``duration`` seconds.
+
+        Parameters
+        ----------
+        port : int, optional
+            The port of the controller.
+        tolerance : float, optional
+            Maximal difference (in mbar) between measured and commanded
+            pressure.
+        duration : float, optional
+            Time (in s) during which the pressure has to stay within the
+            tolerance.
+        target : float, optional
+            The expected commanded pressure (by default, the current command).
+
+        Returns
+        -------
+        settled : bool or None
+            Whether the pressure is settled, ``None`` if the controller does not
+            measure pressure.
+        '''
+        if target is None:
+            target = self.controller.get_pressure(port)
+        times, measured, commanded = self.samples(port, duration)
+        if len(times) and np.isnan(measured).all():
+            return None
+        if len(times) < 2 or times[-1] - times[0] < duration * 0.9:
+            return False
+        return bool(np.all(commanded == target) and
+                    np.all(np.abs(measured - commanded) <= tolerance))
+
+    def wait_until_settled(self, port=0, tolerance=5., duration=0.2,
+                           timeout=10., controller=None):
+        '''
+        Waits until the pressure has settled (see `is_settled`). If the
+        controller does not measure pressure, waits for ``timeout`` seconds.
+
+        Returns
+        -------
+        settled : bool
+            ``False`` if the timeout was reached.
+        '''
+        target = self.controller.get_pressure(port)
+        t0 = time.time()
+        with self.running():
+            settled = self.wait_until(lambda m: m.is_settled(port, tolerance, duration,
+                                                             target) is not False,
+                                      timeout=timeout, controller=controller)
+            if settled and self.is_settled(port, tolerance, duration, target) is None:
+                # No pressure sensor: wait for the full time
+                remaining = timeout - (time.time() - t0)
+                if remaining > 0:
+                    if controller is not None:
+                        controller.sleep(remaining)
+                    else:
+                        time.sleep(remaining)
+                return True
+        if settled:
+            self.debug('Pressure settled at {} mbar in {:.2f}s'.format(target, time.time() - t0))
+        else:
+            _, measured, commanded = self.latest(port)
+            self.debug('Pressure not settled after {:.2f}s: measured {}, '
+                       'commanded {} mbar'.format(timeout, measured, commanded))
+        return settled
@@ -0,0 +1,175 @@
+'''
+Pressure waveforms (ramps, pulses, etc.), played by a dedicated thread at a
+fixed update rate.
+'''
+from __future__ import absolute_import
+import threading
+import time
+
+import numpy as np
+
+__all__ = ['Waveform', 'WaveformPlayer']
+
+
+class Waveform(object):
+    '''
+    A pressure waveform, sampled at a fixed rate. Waveforms can be
+    concatenated with ``+`` and repeated with ``*``.
+
+    Parameters
+    ----------
+    values : array-like
+        The pressure values (in mbar).
+    rate : float, optional
+        The sampling rate (in Hz).
+    '''
+    def __init__(self, values, rate=50.):
+        self.values = np.asarray(values, dtype=float)
+        self.rate = float(rate)
+
+    @property
+    def duration(self):
+        return len(self.values) / self.rate
+
+    def resampled(self, rate):
+        '''
+        The same waveform, sampled at ``rate``.
+        '''
+        if rate == self.rate:
+            return self
+        n = int(round(self.duration * rate))
+        indices = (np.arange(n) * self.rate / rate).astype(int)
+        return Waveform(self.values[indices], rate)
+
+    def __add__(self, other):
+        other = other.resampled(self.rate)
+        return Waveform(np.concatenate([self.values, other.values]), self.rate)
+
+    def __mul__(self, repetitions):
+        return Waveform(np.tile(self.values, repetitions), self.rate)
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return '<Waveform: {} samples at {:g} Hz>'.format(len(self.values),
+                                                          self.rate)
+
+    @classmethod
+    def constant(cls, value, duration, rate=50.):
+        '''
+        A constant pressure during ``duration`` seconds.
+        '''
+        return cls(np.full(int(round(duration * rate)), value), rate)
+
+    @classmethod
+    def ramp(cls, start, end, duration, rate=50.):
+        '''
+        A linear ramp from ``start`` to ``end`` (excluded) in ``duration``
+        seconds.
+        '''
+        n = int(round(duration * rate))
+        return cls(start + (end - start) * np.arange(n) / float(n), rate)
+
+    @classmethod
+    def pulses(cls, low, low_duration, high, high_duration, cycles,
+               rate=50.):
+        '''
+        Cycles of a pressure ``low`` during ``low_duration`` seconds followed
+        by a pressure ``high`` during ``high_duration`` seconds.
+        '''
+        cycle = (cls.constant(low, low_duration, rate) +
+                 cls.constant(high, high_duration, rate))
+        return cycle * cycles
+
+
+class WaveformPlayer(object):
+    '''
+    Plays waveforms on one port of a `.PressureController` from a dedicated
+    thread.
+
+    The samples are sent according to a fixed schedule (if the thread is
+    late, the samples that should already have been played are skipped
+    rather than sent in a burst), and a command is only sent if it differs
+    from the current pressure by at least ``resolution``.
+
+    Parameters
+    ----------
+    controller : `.PressureController`
+        The pressure controller.
+    port : int, optional
+        The port of the controller.
+    resolution : float, optional
+        The minimal pressure change (in mbar) that is sent to the controller.
+    '''
+    def __init__(self, controller, port=0, resolution=0.1):
+        self.controller = controller
+        self.port = port
+        self.resolution = resolution
+        self.commands = 0  # Number of commands sent (for diagnostics)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._done = threading.Event()
+        self._done.set()
+
+    def start(self, waveform, final=None):
+        '''
+        Starts playing ``waveform`` (a waveform currently playing is
+        stopped). The pressure ``final`` is set at the end of the waveform,
+        if provided.
+        '''
+        self.stop()
+        self._stop_event = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._play,
+                                        args=(waveform, final,
+                                              self._stop_event, self._done),
+                                        name='WaveformPlayer-{}'.format(self.port))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the current waveform (the pressure stays at its last value).
+        '''
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def is_done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the end of the waveform. Returns ``False`` on timeout.
+        '''
+        return self._done.wait(timeout)
+
+    def _send(self, value, force=False):
+        if (not force and
+                abs(value - self.controller.get_pressure(self.port)) < self.resolution):
+            return
+        self.controller.set_pressure(float(value), port=self.port)
+        self.commands += 1
+
+    def _play(self, waveform, final, stop_event, done):
+        try:
+            values, rate = waveform.values, waveform.rate
+            t0 = time.time()
+            index = 0
+            while index < len(values):
+                self._send(values[index])
+                index += 1
+                delay = t0 + index / rate - time.time()
+                if delay > 0:
+                    if stop_event.wait(delay):
+                        return
+                elif stop_event.is_set():
+                    return
+                else:
+                    # Late: skip the samples that should have been played
+                    index = max(index, int((time.time() - t0) * rate))
+            if final is not None:
+                self._send(final, force=True)
+        finally:
+            done.set()
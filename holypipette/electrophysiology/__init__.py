@@ -0,0 +1,5 @@
+'''
+Analysis of electrophysiological recordings
+'''
+from __future__ import absolute_import
+from .pulses import *
@@ -0,0 +1,162 @@
+'''
+Analysis of current pulses injected through a double-barrelled electrode
+(two voltage recordings ``V1`` and ``V2``, injected current ``Ic2``): resting
+potential, membrane resistance and electrode resistance.
+
+All functions work on several sweeps at once (one sweep per row).
+'''
+from __future__ import absolute_import
+import collections
+
+import numpy as np
+
+__all__ = ['pulse_analysis_dtype', 'analyze_pulses', 'PulseAnalyzer']
+
+#: Fields of the structured arrays returned by `analyze_pulses`
+pulse_analysis_dtype = np.dtype([('V0', float),  # Resting potential (V)
+                                 ('R', float),  # Membrane resistance (Ohm)
+                                 ('Re', float),  # Electrode resistance (Ohm)
+                                 ('I0', float),  # Stimulus amplitude (A)
+                                 ('onset', int),  # Stimulus onset (index)
+                                 ('offset', int)])  # Stimulus offset (index)
+
+
+def _window_means(cumulative, start, end):
+    '''
+    Means of each row between ``start`` and ``end`` (one index per row), from
+    the cumulative sums of the rows (with a leading zero).
+    '''
+    rows = np.arange(cumulative.shape[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((cumulative[rows, end] - cumulative[rows, start]) /
+                (end - start))
+
+
+def analyze_pulses(V1, V2, I, threshold=1e-12):
+    '''
+    Analyzes sweeps containing a single current pulse.
+
+    The stimulus is where the absolute current is above ``threshold``. The
+    resting potential is the mean of ``V1`` before the stimulus, the
+    resistances are calculated on the last third of the stimulus. The lower of
+    the two resistances is the membrane resistance, the difference is the
+    electrode resistance.
+
+    Parameters
+    ----------
+    V1, V2, I : `~numpy.ndarray`
+        The two voltage recordings and the injected current, either a single
+        sweep (1D arrays) or several sweeps (2D arrays, one sweep per row).
+    threshold : float, optional
+        The current threshold for stimulus detection.
+
+    Returns
+    -------
+    results : `~numpy.ndarray`
+        A structured array (see `pulse_analysis_dtype`) with one element per
+        sweep (a single element for 1D input). The values are NaN for sweeps
+        without stimulus.
+    '''
+    single = np.ndim(I) == 1
+    V1, V2, I = [np.atleast_2d(np.asarray(x, dtype=float)) for x in (V1, V2, I)]
+    n_sweeps, n_samples = I.shape
+
+    stimulus = np.abs(I) > threshold
+    count = stimulus.sum(axis=1)
+    onset = np.argmax(stimulus, axis=1)
+    offset = onset + count
+    I0 = np.where(stimulus, I, 0).sum(axis=1) / np.maximum(count, 1)
+    steady = onset + (2 * count) // 3  # Start of the last third
+
+    zeros = np.zeros((n_sweeps, 1))
+    start = np.zeros(n_sweeps, dtype=int)
+    resistances = []
+    baselines = []
+    for V in (V1, V2):
+        cumulative = np.hstack([zeros, np.cumsum(V, axis=1)])
+        baseline = _window_means(cumulative, start, onset)
+        peak = _window_means(cumulative, steady, offset)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resistances.append((peak - baseline) / I0)
+        baselines.append(baseline)
+    R1, R2 = resistances
+
+    results = np.empty(n_sweeps, dtype=pulse_analysis_dtype)
+    results['V0'] = baselines[0]
+    results['R'] = np.minimum(R1, R2)
+    results['Re'] = np.abs(R1 - R2)
+    results['I0'] = I0
+    results['onset'] = onset
+    results['offset'] = offset
+    no_stimulus = count == 0
+    for name in ('V0', 'R', 'Re', 'I0'):
+        results[name][no_stimulus] = np.nan
+    return results[0] if single else results
+
+
+class PulseAnalyzer(object):
+    '''
+    Incremental analysis of a stream of sweeps (e.g. received from a
+    `.DataChannel`), with averaging over the most recent sweeps.
+
+    Parameters
+    ----------
+    averaging : int, optional
+        The number of sweeps to average in `averaged`.
+    threshold : float, optional
+        The current threshold for stimulus detection (see `analyze_pulses`).
+    history : int, optional
+        The number of sweep analyses kept in `results`.
+    '''
+    def __init__(self, averaging=1, threshold=1e-12, history=1000):
+        self.threshold = threshold
+        self._sweeps = collections.deque(maxlen=int(averaging))
+        self._results = collections.deque(maxlen=int(history))
+
+    @property
+    def averaging(self):
+        return self._sweeps.maxlen
+
+    @averaging.setter
+    def averaging(self, value):
+        self._sweeps = collections.deque(self._sweeps, maxlen=int(value))
+
+    def __len__(self):
+        return len(self._sweeps)
+
+    def add(self, signals):
+        '''
+        Analyzes a new sweep, given as a dictionary with the ``V1``, ``V2`` and
+        ``Ic2`` signals. Returns the analysis of this sweep.
+        '''
+        sweep = (signals['V1'], signals['V2'], signals['Ic2'])
+        if self._sweeps and len(sweep[2]) != len(self._sweeps[-1][2]):
+            self._sweeps.clear()  # The protocol has changed
+        self._sweeps.append(sweep)
+        result = analyze_pulses(*sweep, threshold=self.threshold)
+        self._results.append(result)
+        return result
+
+    def reset(self):
+        '''
+        Forgets the sweeps used for averaging (e.g. after moving the
+        electrode). The results of previous sweeps are kept.
+        '''
+        self._sweeps.clear()
+
+    @property
+    def results(self):
+        '''
+        The analysis of the last ``history`` sweeps (a structured array).
+        '''
+        return np.array(self._results, dtype=pulse_analysis_dtype)
+
+    def averaged(self):
+        '''
+        Analysis of the average of the last `averaging` sweeps (`None` if no
+        sweep has been added since the last `reset`).
+        '''
+        if not self._sweeps:
+            return None
+        V1, V2, I = [np.mean(x, axis=0) for x in zip(*self._sweeps)]
+        return analyze_pulses(V1, V2, I, threshold=self.threshold)
@@ -1,2 +1,4 @@
 from __future__ import absolute_import
 from .planes import *
+from .route import *
+from .gridindex import *
@@ -0,0 +1,93 @@
+'''
+Spatial index of rectangles on a regular grid
+'''
+from __future__ import absolute_import
+import collections
+
+import numpy as np
+
+__all__ = ['GridIndex']
+
+
+class GridIndex(object):
+    '''
+    Indexes axis-aligned rectangles by the grid cells they cover, so that the
+    rectangles containing a point (or intersecting a region) are found
+    without going through all of them.
+
+    Parameters
+    ----------
+    cell_size : float
+        The size of the grid cells, typically the size of the rectangles.
+    '''
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self._cells = collections.defaultdict(list)  # cell -> keys
+        self._bounds = collections.OrderedDict()  # key -> (x0, y0, x1, y1)
+        self._serial = {}  # key -> insertion number
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __contains__(self, key):
+        return key in self._bounds
+
+    def _cell_range(self, x0, y0, x1, y1):
+        i0, j0 = int(np.floor(x0 / self.cell_size)), int(np.floor(y0 / self.cell_size))
+        i1, j1 = int(np.floor(x1 / self.cell_size)), int(np.floor(y1 / self.cell_size))
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def insert(self, key, bounds):
+        '''
+        Adds (or replaces) a rectangle ``bounds = (x0, y0, x1, y1)``.
+        '''
+        if key in self._bounds:
+            self.remove(key)
+        bounds = tuple(float(b) for b in bounds)
+        self._bounds[key] = bounds
+        self._serial[key] = self._counter
+        self._counter += 1
+        for cell in self._cell_range(*bounds):
+            self._cells[cell].append(key)
+
+    def remove(self, key):
+        bounds = self._bounds.pop(key)
+        del self._serial[key]
+        for cell in self._cell_range(*bounds):
+            keys = self._cells[cell]
+            keys.remove(key)
+            if not keys:
+                del self._cells[cell]
+
+    def bounds(self, key):
+        return self._bounds[key]
+
+    def keys(self):
+        '''
+        All keys, in insertion order.
+        '''
+        return list(self._bounds)
+
+    def query_rect(self, x0, y0, x1, y1):
+        '''
+        The keys of the rectangles intersecting a region, in insertion order.
+        '''
+        found = set()
+        for cell in self._cell_range(x0, y0, x1, y1):
+            for key in self._cells.get(cell, ()):
+                bx0, by0, bx1, by1 = self._bounds[key]
+                if bx0 < x1 and bx1 > x0 and by0 < y1 and by1 > y0:
+                    found.add(key)
+        return sorted(found, key=self._serial.get)
+
+    def query_point(self, x, y):
+        '''
+        The keys of the rectangles containing a point, in insertion order.
+        '''
+        cell = (int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size)))
+        keys = [key for key in self._cells.get(cell, ())
+                if (self._bounds[key][0] <= x < self._bounds[key][2] and
+                    self._bounds[key][1] <= y < self._bounds[key][3])]
+        keys.sort(key=self._serial.get)
+        return keys
@@ -0,0 +1,82 @@
+'''
+Ordering of positions to visit, minimizing the travelled distance
+'''
+from __future__ import absolute_import
+import numpy as np
+
+__all__ = ['plan_route', 'route_length']
+
+
+def route_length(points, order, start=None):
+    '''
+    Length of the open path visiting ``points`` in the given order (starting
+    from ``start``, if provided).
+    '''
+    path = np.asarray(points, dtype=float)[list(order)]
+    if start is not None:
+        path = np.vstack([np.asarray(start, dtype=float)[:path.shape[1]], path])
+    return np.sqrt(np.sum(np.diff(path, axis=0)**2, axis=1)).sum()
+
+
+def plan_route(points, start=None, max_iterations=100):
+    '''
+    Orders positions to minimize the length of an open path visiting all of
+    them, with a nearest-neighbour heuristic improved by 2-opt moves.
+
+    Parameters
+    ----------
+    points : array-like
+        The positions (one per row).
+    start : array-like, optional
+        The starting position (by default, the path starts at the first
+        point).
+    max_iterations : int, optional
+        Maximal number of 2-opt improvement passes.
+
+    Returns
+    -------
+    order : list
+        The indices of the points, in visiting order.
+    '''
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    n = len(points)
+    if n == 0:
+        return []
+    if start is not None:
+        points = np.vstack([np.asarray(start, dtype=float)[:points.shape[1]],
+                            points])
+    distances = np.sqrt(np.sum((points[:, None, :] - points[None, :, :])**2,
+                               axis=2))
+
+    # Nearest neighbour, from node 0 (the start or the first point)
+    route = [0]
+    remaining = np.ones(len(points), dtype=bool)
+    remaining[0] = False
+    for _ in range(len(points) - 1):
+        candidates = np.where(remaining, distances[route[-1]], np.inf)
+        route.append(int(np.argmin(candidates)))
+        remaining[route[-1]] = False
+
+    # 2-opt: reverse route[i:j+1] if it shortens the path (the first node is
+    # fixed, the last one is free since the path is open)
+    route = np.array(route)
+    for _ in range(max_iterations):
+        improved = False
+        for i in range(1, len(route) - 1):
+            a, b = route[i - 1], route[i]
+            # Gain for all j > i at once
+            c = route[i + 1:]
+            d = np.append(route[i + 2:], -1)
+            old = distances[a, b] + np.where(d >= 0, distances[c, d], 0)
+            new = distances[a, c] + np.where(d >= 0, distances[b, d], 0)
+            gain = old - new
+            j = int(np.argmax(gain))
+            if gain[j] > 1e-9:
+                route[i:i + j + 2] = route[i:i + j + 2][::-1]
+                improved = True
+        if not improved:
+            break
+
+    if start is not None:
+        return [int(k) - 1 for k in route[1:]]
+    return [int(k) for k in route]
@@ -507,8 +507,8 @@ class CameraGui(QtWidgets.QMainWindow):
         self.log_window.setFocusPolicy(Qt.NoFocus)
         self.log_window.close_signal.connect(
             lambda: self.log_button.setChecked(False))
-        self.running_task = None
-        self.running_task_interface = None
+        # Blocking tasks that are currently running (one per interface)
+        self.running_tasks = collections.OrderedDict()
         self.config_button = None  # see initialize
         self.setWindowTitle("Camera GUI")
 
@@ -691,8 +691,9 @@ class CameraGui(QtWidgets.QMainWindow):
             command = self.mouse_actions.get((event.button(), None), None)
 
         if command is not None:
-            if self.running_task:
-                # Another task is running, ignore the mouse click
+            if command.__self__ in self.running_tasks:
+                # Another task of this interface is running, ignore the mouse
+                # click
                 return
             # Mouse commands do not have custom arguments, they always get
             # the position in the image (rescaled, i.e. independent of the
@@ -772,36 +773,43 @@ class CameraGui(QtWidgets.QMainWindow):
 
     def start_task(self, task_name, interface):
         self.status_bar.clearMessage()
-        self.task_progress_text.setText(task_name + '…')
+        self.running_tasks[interface] = task_name
+        self.task_progress_text.setText(' / '.join(self.running_tasks.values()) + '…')
         self.task_progress.setVisible(True)
         self.task_abort_button.setEnabled(True)
         self.task_abort_button.setVisible(True)
-        self.running_task = task_name
-        self.running_task_interface = interface
 
     def abort_task(self):
         self.task_abort_button.setEnabled(False)
-        self.running_task_interface.abort_task()
+        for interface in self.running_tasks:
+            interface.abort_task()
 
     @QtCore.pyqtSlot(int, object)
     def task_finished(self, exit_reason, controller_or_message):
-        if self.running_task is None:
-            # This might be a success message for a non-blocking command
-            if isinstance(controller_or_message, str):
-                self.status_bar.setStyleSheet('QStatusBar{color: black;}')
-                self.status_bar.showMessage(controller_or_message, 1000)
+        interface = self.sender()
+        if isinstance(controller_or_message, str):
+            # This is a success message for a non-blocking command
+            self.status_bar.setStyleSheet('QStatusBar{color: black;}')
+            self.status_bar.showMessage(controller_or_message, 1000)
+            return
+        if interface not in self.running_tasks:
             return  # Nothing else to do
 
-        self.task_progress.setVisible(False)
-        self.task_abort_button.setVisible(False)
+        task_name = self.running_tasks.pop(interface)
+        if self.running_tasks:
+            self.task_progress_text.setText(' / '.join(self.running_tasks.values()) + '…')
+            self.task_abort_button.setEnabled(True)
+        else:
+            self.task_progress.setVisible(False)
+            self.task_abort_button.setVisible(False)
         # 0: correct execution (no need to show a message)
         if exit_reason == 0:
-            text = "Task '{}' finished successfully.".format(self.running_task)
+            text = "Task '{}' finished successfully.".format(task_name)
             self.status_bar.setStyleSheet('QStatusBar{color: black;}')
             self.status_bar.showMessage(text, 5000)
         # 1: an error occurred (error will be displayed via `error_status`)
         elif exit_reason == 2:
-            text = "Task '{}' aborted.".format(self.running_task)
+            text = "Task '{}' aborted.".format(task_name)
             self.status_bar.setStyleSheet('QStatusBar{color: black;}')
             self.status_bar.showMessage(text, 5000)
 
@@ -816,12 +824,9 @@ class CameraGui(QtWidgets.QMainWindow):
                                                    QtWidgets.QMessageBox.Yes |
                                                    QtWidgets.QMessageBox.No)
             if reply == QtWidgets.QMessageBox.Yes:
-                _, reset_signal = self.interface_signals[self.running_task_interface]
+                _, reset_signal = self.interface_signals[interface]
                 reset_signal.emit(controller_or_message)
 
-        self.running_task = None
-        self.running_task_interface = None
-
     def keyPressEvent(self, event):
         # We remove the keypad modifier, since we do not want to make a
         # difference between key presses as part of the keypad or on the main
@@ -838,8 +843,9 @@ class CameraGui(QtWidgets.QMainWindow):
 
         if description is not None:
             command, argument = description
-            if self.running_task and not command.category == 'General':
-                # Another task is running, ignore the key press
+            if (command.__self__ in self.running_tasks and
+                    not command.category == 'General'):
+                # Another task of this interface is running, ignore the key press
                 # (we allow the "General" category to still allow to see the
                 # help, etc.)
                 return
@@ -11,6 +11,7 @@ from holypipette.controller import TaskController
 from holypipette.gui import CameraGui
 from holypipette.interface import command, blocking_command
 from holypipette.devices.manipulator.calibratedunit import CalibrationError
+from .overview import OverviewMapWindow
 import datetime
 
 class ManipulatorGui(CameraGui):
@@ -46,6 +47,9 @@ class ManipulatorGui(CameraGui):
         self._last_stage_measurement = None
         self._stage_position = (None, None, None)
 
+        # Overview map (created when first shown)
+        self.overview_window = None
+
     @command(category='Manipulators',
              description='Measure manipulator ranges')
     def measure_ranges(self):
@@ -62,6 +66,24 @@ class ManipulatorGui(CameraGui):
             # Check whether all positions have been updated
             self.interface.check_ranges()
 
+    @command(category='Stage',
+             description='Show/hide the overview map')
+    def toggle_overview(self):
+        if self.overview_window is None:
+            self.overview_window = OverviewMapWindow(self.interface,
+                                                     self.move_stage_to_map_position,
+                                                     parent=self)
+        self.overview_window.setVisible(not self.overview_window.isVisible())
+        # We need to keep the focus
+        self.setFocus()
+
+    def move_stage_to_map_position(self, map_position):
+        command = self.interface.move_stage_to_map_position
+        if self.interface in self.running_tasks:
+            return  # Another task of this interface is running
+        self.start_task(command.task_description, self.interface)
+        self.pipette_command_signal.emit(command, map_position)
+
     def display_manipulator(self, pixmap):
         '''
         Displays the number of the selected manipulator.
@@ -112,7 +134,7 @@ class ManipulatorGui(CameraGui):
                              int(c_x + round(length_in_um*scaled_length)), c_y)
             if text:
                 painter.drawText(c_x, c_y - 10, '{}µm'.format(length_in_um))
-            if position and not self.running_task:
+            if position and not self.running_tasks:
                 # Only ask for positions if last measurement has been made a
                 # sufficiently long time ago
                 update_time = self.interface.calibration_config.position_update/1000.
@@ -201,6 +223,8 @@ class ManipulatorGui(CameraGui):
                                  self.interface.calibrate_manipulator2)
         self.register_key_action(Qt.Key_R, Qt.NoModifier,
                                  self.interface.recalibrate_manipulator)
+        self.register_key_action(Qt.Key_R, Qt.ControlModifier,
+                                 self.interface.display_calibration_drift)
         self.register_mouse_action(Qt.RightButton, Qt.NoModifier,
                                    self.interface.recalibrate_manipulator_on_click)
         self.register_key_action(Qt.Key_M, Qt.NoModifier,
@@ -228,6 +252,24 @@ class ManipulatorGui(CameraGui):
         self.register_mouse_action(Qt.RightButton, Qt.ShiftModifier,
                                    self.interface.move_stage)
 
+        # Overview map
+        self.register_key_action(Qt.Key_M, Qt.ControlModifier,
+                                 self.toggle_overview)
+        self.register_key_action(Qt.Key_M, Qt.AltModifier,
+                                 self.interface.acquire_overview)
+        self.register_key_action(Qt.Key_M, Qt.ShiftModifier,
+                                 self.interface.add_view_to_overview)
+        self.register_mouse_action(Qt.RightButton, Qt.AltModifier,
+                                   self.interface.remember_position)
+
+        # Drift of the preparation
+        self.register_key_action(Qt.Key_D, Qt.ControlModifier,
+                                 self.interface.toggle_drift_estimation)
+        self.register_key_action(Qt.Key_X, Qt.ControlModifier,
+                                 self.interface.reset_drift)
+        self.register_key_action(Qt.Key_X, Qt.NoModifier,
+                                 self.interface.display_drift)
+
         # Microscope control
         self.register_key_action(Qt.Key_PageUp, None,
                                  self.interface.move_microscope,
@@ -1,11 +0,0 @@
-# What is this doing here?
-import collections
-
-moveList = []
-position_history = collections.deque(maxlen = 50)
-tracking = False
-paramecium_stop = False
-contact = True
-black_area = []
-paramecium_z = None
-template = []
\ No newline at end of file
@@ -0,0 +1,167 @@
+# coding=utf-8
+from __future__ import absolute_import
+import traceback
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from holypipette.devices.manipulator.calibratedunit import CalibrationError
+
+__all__ = ['OverviewMapView', 'OverviewMapWindow']
+
+
+class OverviewMapView(QtWidgets.QLabel):
+    '''
+    Displays the region of an `.OverviewMap` around the current stage position,
+    with the current field of view and the remembered positions. The wheel
+    zooms in and out, a click calls ``navigate`` with the clicked map position.
+    '''
+    def __init__(self, interface, navigate, parent=None):
+        super(OverviewMapView, self).__init__(parent=parent)
+        self.interface = interface
+        self.navigate = navigate
+        self.map_per_pixel = 8.  # zoom: map pixels per displayed pixel
+        self.center = None  # map position at the center of the view
+        self.follow_stage = True
+        self.setMinimumSize(400, 400)
+        self.setAlignment(Qt.AlignCenter)
+        self._image = None  # keeps the data of the displayed QImage alive
+
+        timer = QtCore.QTimer(self)
+        timer.timeout.connect(self.update_view)
+        timer.start(500)
+
+    def region(self):
+        width, height = self.size().width(), self.size().height()
+        half_width = width * self.map_per_pixel / 2.
+        half_height = height * self.map_per_pixel / 2.
+        x, y = self.center
+        return (x - half_width, y - half_height, x + half_width, y + half_height)
+
+    def to_map(self, x, y):
+        x0, y0, _, _ = self.region()
+        return x0 + x * self.map_per_pixel, y0 + y * self.map_per_pixel
+
+    def to_view(self, x, y):
+        x0, y0, _, _ = self.region()
+        return (x - x0) / self.map_per_pixel, (y - y0) / self.map_per_pixel
+
+    def wheelEvent(self, event):
+        if event.angleDelta().y() > 0:
+            self.map_per_pixel = max(self.map_per_pixel / 1.5, 0.25)
+        else:
+            self.map_per_pixel = min(self.map_per_pixel * 1.5, 256.)
+        self.update_view()
+
+    def mousePressEvent(self, event):
+        if self.center is None:
+            return
+        if event.button() == Qt.LeftButton:
+            self.navigate(self.to_map(event.x(), event.y()))
+
+    @QtCore.pyqtSlot()
+    def update_view(self):
+        try:
+            stage = self.interface.calibrated_stage
+            try:
+                stage_position = stage.map_position()
+            except CalibrationError:
+                stage_position = None
+            if stage_position is not None and (self.follow_stage or self.center is None):
+                self.center = tuple(stage_position)
+            if self.center is None:
+                bounds = self.interface.overview_map.bounds()
+                if bounds is None:
+                    return
+                self.center = ((bounds[0] + bounds[2]) / 2., (bounds[1] + bounds[3]) / 2.)
+            width, height = self.size().width(), self.size().height()
+            rendered = self.interface.overview_map.render(self.region(), (height, width))
+            valid = ~np.isnan(rendered)
+            image = np.zeros((height, width), dtype=np.uint8)
+            if valid.any():
+                low, high = np.percentile(rendered[valid], [1, 99])
+                scaled = (rendered[valid] - low) * 255. / max(high - low, 1e-6)
+                image[valid] = np.clip(scaled, 0, 255).astype(np.uint8)
+            self._image = np.ascontiguousarray(image)
+            q_image = QtGui.QImage(self._image.data, width, height, width,
+                                   QtGui.QImage.Format_Grayscale8)
+            pixmap = QtGui.QPixmap.fromImage(q_image)
+            self.draw_overlay(pixmap, stage_position)
+            self.setPixmap(pixmap)
+        except Exception:
+            print(traceback.format_exc())
+
+    def draw_overlay(self, pixmap, stage_position):
+        painter = QtGui.QPainter(pixmap)
+        camera = self.interface.camera
+        if stage_position is not None:
+            # Current field of view
+            pen = QtGui.QPen(QtGui.QColor(200, 0, 0, 200))
+            pen.setWidth(2)
+            painter.setPen(pen)
+            x, y = self.to_view(stage_position[0] - camera.width / 2.,
+                                stage_position[1] - camera.height / 2.)
+            painter.drawRect(int(x), int(y), int(camera.width / self.map_per_pixel),
+                             int(camera.height / self.map_per_pixel))
+        # Remembered positions
+        pen = QtGui.QPen(QtGui.QColor(0, 150, 255, 200))
+        pen.setWidth(2)
+        painter.setPen(pen)
+        for name, position in self.interface.overview_map.marks.items():
+            x, y = self.to_view(*position)
+            painter.drawEllipse(QtCore.QPointF(x, y), 5, 5)
+            painter.drawText(int(x) + 7, int(y) - 7, name)
+        painter.end()
+
+
+class OverviewMapWindow(QtWidgets.QMainWindow):
+    '''
+    Window with the overview map and the list of remembered positions. A click
+    on the map or on a position in the list moves the stage there.
+    '''
+    close_signal = QtCore.pyqtSignal()
+
+    def __init__(self, interface, navigate, parent=None):
+        super(OverviewMapWindow, self).__init__(parent=parent)
+        self.setWindowTitle('Overview map')
+        self.setAttribute(Qt.WA_ShowWithoutActivating)
+        self.interface = interface
+        self.navigate = navigate
+        self.view = OverviewMapView(interface, navigate)
+        self.marks = QtWidgets.QListWidget()
+        self.marks.itemClicked.connect(self.mark_clicked)
+        self.follow = QtWidgets.QCheckBox('Follow stage')
+        self.follow.setChecked(True)
+        self.follow.toggled.connect(self.follow_toggled)
+        side = QtWidgets.QVBoxLayout()
+        side.addWidget(self.follow)
+        side.addWidget(self.marks)
+        side_widget = QtWidgets.QWidget()
+        side_widget.setLayout(side)
+        splitter = QtWidgets.QSplitter()
+        splitter.addWidget(self.view)
+        splitter.addWidget(side_widget)
+        splitter.setSizes([3, 1])
+        self.setCentralWidget(splitter)
+        timer = QtCore.QTimer(self)
+        timer.timeout.connect(self.update_marks)
+        timer.start(1000)
+
+    def follow_toggled(self, checked):
+        self.view.follow_stage = checked
+
+    def update_marks(self):
+        names = list(self.interface.overview_map.marks)
+        if names != [self.marks.item(i).text() for i in range(self.marks.count())]:
+            self.marks.clear()
+            self.marks.addItems(names)
+
+    def mark_clicked(self, item):
+        position = self.interface.overview_map.marks.get(item.text())
+        if position is not None:
+            self.navigate(position)
+
+    def closeEvent(self, event):
+        self.close_signal.emit()
+        super(OverviewMapWindow, self).closeEvent(event)
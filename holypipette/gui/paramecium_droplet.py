@@ -74,7 +74,9 @@ class ParameciumDropletGui(ManipulatorGui):
         self.paramecium_interface = ParameciumDropletInterface(pipette_interface,
                                                         camera)
         self.image_edit_funcs.append(self.track_paramecium)
+        self.image_edit_funcs.append(self.track_droplet)
         self.display_edit_funcs.append(self.show_paramecium)
+        self.display_edit_funcs.append(self.show_droplet)
         self.display_edit_funcs.append(self.display_timer)
         # show_tip seems to interfere with movements
         #self.display_edit_funcs.append(self.show_tip)
@@ -102,6 +104,14 @@ class ParameciumDropletGui(ManipulatorGui):
                                  self.paramecium_interface.toggle_tracking)
         self.register_key_action(Qt.Key_Return, None,
                                  self.paramecium_interface.toggle_following)
+        self.register_key_action(Qt.Key_J, None,
+                                 self.paramecium_interface.toggle_droplet_tracking)
+        self.register_key_action(Qt.Key_Y, Qt.NoModifier,
+                                 self.paramecium_interface.next_paramecium_detector)
+        self.register_key_action(Qt.Key_Y, Qt.ShiftModifier,
+                                 self.paramecium_interface.toggle_detector_comparison)
+        self.register_key_action(Qt.Key_Y, Qt.ControlModifier,
+                                 self.paramecium_interface.display_detector_metrics)
         self.register_key_action(Qt.Key_P, None,
                                  self.paramecium_interface.display_z_manipulator)
         self.register_key_action(Qt.Key_K, None,
@@ -121,6 +131,21 @@ class ParameciumDropletGui(ManipulatorGui):
         self.paramecium_interface.track_paramecium(frame)
         return frame
 
+    def track_droplet(self, frame):
+        self.paramecium_interface.track_droplet(frame)
+        return frame
+
+    def show_droplet(self, pixmap):
+        interface = self.paramecium_interface
+        if (not interface.droplet_tracking or
+                any(p is None for p in interface.droplet_position)):
+            return
+        scale = 1.0 * self.camera.width / pixmap.size().width()
+        painter = create_painter(pixmap, color=(0, 200, 0, 125), width=2)
+        x, y, r = interface.droplet_position
+        painter.drawEllipse(QtCore.QPointF(x / scale, y / scale), r / scale, r / scale)
+        painter.end()
+
     def show_paramecium(self, pixmap):
         interface = self.paramecium_interface
         if (not interface.tracking or
@@ -138,13 +163,13 @@ class ParameciumDropletGui(ManipulatorGui):
 
         if interface.config.draw_fitted_ellipses:
             painter = create_painter(pixmap, color=(0, 200, 200, 125), width=2)
-            for ellipse in interface.paramecium_info['all_ellipses']:
+            for ellipse in interface.paramecium_info.get('all_ellipses', ()):
                 x, y, width, height, angle = ellipse
                 draw_ellipse(painter, x, y, width, height, angle, pixel_per_um,
                              scale)
             painter.end()
             painter = create_painter(pixmap, color=(200, 0, 200, 125), width=2)
-            for ellipse in interface.paramecium_info['good_ellipses']:
+            for ellipse in interface.paramecium_info.get('good_ellipses', ()):
                 x, y, width, height, angle = ellipse
                 draw_ellipse(painter, x, y, width, height, angle, pixel_per_um,
                              scale)
@@ -153,18 +178,18 @@ class ParameciumDropletGui(ManipulatorGui):
         if interface.config.draw_contours:
             # Draw all contours
             painter = create_painter(pixmap, color=(200, 200, 0, 125))
-            for contour in interface.paramecium_info['all_contours']:
+            for contour in interface.paramecium_info.get('all_contours', ()):
                 draw_contour(contour, painter, scale)
             painter.end()
 
             # Draw unused contours that were long enough/had enough points
             painter = create_painter(pixmap, color=(200, 0, 0, 125))
-            for contour in interface.paramecium_info['valid_contours']:
+            for contour in interface.paramecium_info.get('valid_contours', ()):
                 draw_contour(contour, painter, scale)
             painter.end()
 
             # Draw best contour
-            contour = interface.paramecium_info['best_contour']
+            contour = interface.paramecium_info.get('best_contour')
             if contour is not None:
                 painter = create_painter(pixmap, color=(0, 200, 0, 125),
                                          width=2)
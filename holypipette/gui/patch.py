@@ -58,6 +58,7 @@ class TrackingPatchGui(PatchGui):
         super(TrackingPatchGui, self).__init__(camera, pipette_interface,
                                                patch_interface,
                                                with_tracking=True)
+        self.camera_interface.stage = pipette_interface.calibrated_stage
         self.setWindowTitle("Patch GUI with tracking")
 
     def register_commands(self):
@@ -68,3 +69,5 @@ class TrackingPatchGui(PatchGui):
                                  self.patch_interface.contact_detection)
         self.register_mouse_action(Qt.RightButton, None,
                                    self.camera_interface.track_object)
+        self.register_key_action(Qt.Key_F6, None,
+                                 self.camera_interface.clear_tracked_objects)
@@ -11,6 +11,7 @@ from PyQt5 import QtCore
 
 from holypipette.controller import TaskController, RequestedAbortException
 from holypipette.log_utils import LoggingObject
+from .executor import ResourceLocks, TaskExecutor
 
 
 def command(category, description, default_arg=None, success_message=None):
@@ -183,14 +184,31 @@ class TaskInterface(QtCore.QObject, LoggingObject):
     * To correctly interact with the GUI for blocking commands (show that task
       is running, show error message if task fails, etc.), the method needs to
       call the `~.TaskInterface.execute` function to execute the command.
+
+    Blocking commands are run by a pool of worker threads (`executor`), shared
+    by all interfaces. Each task holds the hardware resources declared by its
+    `.TaskController` (see `.TaskController.resources`) while it runs, so that
+    tasks using different devices (e.g. following a cell with the stage while
+    moving a pipette) run in parallel, whereas conflicting tasks wait for each
+    other. Waiting tasks are not queued: whichever finds its resources free
+    first gets them, so the order in which they were requested is not
+    guaranteed. A waiting task also occupies its worker thread, so when all
+    `~.TaskExecutor.workers` wait for the same resource (e.g. several stage
+    commands queued behind a long stage movement), commands for other devices
+    only start once one of them has finished.
     """
     #: Signals the end of a task with an "error code":
     #: 0: successful execution; 1: error during execution; 2: aborted
     task_finished = QtCore.pyqtSignal(int, object)
 
+    #: Worker threads executing the blocking commands of all interfaces
+    executor = TaskExecutor()
+    #: Locks on the hardware resources, shared by all interfaces
+    resource_locks = ResourceLocks()
+
     def __init__(self):
         super(TaskInterface, self).__init__()
-        self._current_controller = None
+        self._current_controllers = set()
 
     @QtCore.pyqtSlot(MethodType, object)
     def command_received(self, command, argument):
@@ -201,6 +219,8 @@ class TaskInterface(QtCore.QObject, LoggingObject):
         arguments), an error is logged and the `.task_finished` signal is
         emitted. Note that the handling of errors *within* the command, as well
         as the handling of abort requests is performed in the `.execute` method.
+        Blocking commands are queued for execution in a worker thread (see
+        `.TaskExecutor`).
 
         Parameters
         ----------
@@ -209,6 +229,12 @@ class TaskInterface(QtCore.QObject, LoggingObject):
         argument : object
             The argument of the requested command (possibly ``None``).
         """
+        if getattr(command, 'is_blocking', False):
+            self.executor.submit(self._run_command, command, argument)
+        else:
+            self._run_command(command, argument)
+
+    def _run_command(self, command, argument):
         try:
             if argument is None:
                 command()
@@ -221,13 +247,13 @@ class TaskInterface(QtCore.QObject, LoggingObject):
     def _execute_single_task(self, controller, func, argument):
         controller.save_state()
 
-        self._current_controller = controller
-        controller.abort_requested = False
         try:
-            if argument is not None:
-                func(argument)
-            else:
-                func()
+            # All controllers used by the task share the abort request
+            with controller.abort_scope():
+                if argument is not None:
+                    func(argument)
+                else:
+                    func()
         # We send a reference to the "controller" with the task_finished signal,
         # this can be used to ask the user for a state reset after a failed
         # command (e.g. move back the pipette to its start position in case a
@@ -235,17 +261,14 @@ class TaskInterface(QtCore.QObject, LoggingObject):
         except RequestedAbortException:
             self.info('Task "{}" aborted'.format(func.__name__))
             self.task_finished.emit(2, controller)
-            self._current_controller = None
             return False
         except Exception:
             self.exception('Task "{}" failed'.format(func.__name__))
             self.task_finished.emit(1, controller)
-            self._current_controller = None
             return False
 
         # Task finished successfully
         controller.delete_state()
-        self._current_controller = None
         return True
 
     def execute(self, task, argument=None):
@@ -280,17 +303,44 @@ class TaskInterface(QtCore.QObject, LoggingObject):
         if argument is None:
             argument = [None]
 
-        for one_task, one_argument in zip(task, argument):
+        controllers = []
+        resources = set()
+        for one_task in task:
             controller = one_task.__self__
             if not isinstance(controller, TaskController):
                 raise TypeError('Can only execute methods of TaskController'
                                 'objects, but object for method {} is of type '
                                 '{}'.format(one_task.__name__, type(controller)))
-            success = self._execute_single_task(controller, one_task,
-                                                one_argument)
-            if not success:
-                return
+            controllers.append(controller)
+            resources.update(controller.resources(one_task.__name__))
+
+        # Abort requests are accepted while waiting for the resources
+        for controller in controllers:
+            controller.abort_requested = False
+            self._current_controllers.add(controller)
+        try:
+            busy = self.resource_locks.busy(resources)
+            if busy:
+                self.debug('Waiting for {}'.format(', '.join(str(r) for r in busy)))
+            cancelled = lambda: any(c.abort_event.is_set() for c in controllers)
+            if not self.resource_locks.acquire(resources, cancelled=cancelled):
+                self.info('Task "{}" aborted'.format(task[0].__name__))
+                self.task_finished.emit(2, None)
+                return False
+            try:
+                for one_task, controller, one_argument in zip(task, controllers,
+                                                              argument):
+                    success = self._execute_single_task(controller, one_task,
+                                                        one_argument)
+                    if not success:
+                        return False
+            finally:
+                self.resource_locks.release(resources)
+        finally:
+            for controller in controllers:
+                self._current_controllers.discard(controller)
         self.task_finished.emit(0, controller)
+        return True
 
     @QtCore.pyqtSlot(TaskController)
     def reset_requested(self, controller):
@@ -316,15 +366,18 @@ class TaskInterface(QtCore.QObject, LoggingObject):
     def abort_task(self):
         """
         The user asked for an abort of the currently running (blocking) command.
-        We transmit this information to all executing objects (for simplicity,
-        only one should be running) by setting the
+        We transmit this information to all executing objects (including tasks
+        of this interface that wait for their resources) by setting the
         `TaskController.abort_requested` attribute. The object runs in a separate
         thread, but will finish its operation as soon as it checks for this
         attribute (either by explicitly checking with
         `.TaskController.abort_if_requested`, or by using
-        `.TaskController.sleep` or one of the logging methods).
+        `.TaskController.sleep` or one of the logging methods). Since
+        `.TaskController.sleep` waits on an event, waiting tasks (including
+        waits for manipulators) are interrupted immediately.
         """
-        self._current_controller.abort_requested = True
+        for controller in list(self._current_controllers):
+            controller.abort_requested = True
 
     # This function will be automatically called by the main GUI and can be
     # overwritten to connect signals in this class to the main GUI (e.g. to
@@ -9,22 +9,29 @@ except:
 from numpy import *
 from holypipette.interface import TaskInterface, command, blocking_command
 from holypipette.vision import *
+from holypipette.utils.statestore import shared_state, set_tracking
 
 
 
 class CameraInterface(TaskInterface):
     updated_exposure = QtCore.pyqtSignal('QString', 'QString')
+    #: Number of recent paramecium positions used to detect that it stopped
+    position_history_length = 50
 
     def __init__(self, camera, with_tracking=False):
         super(CameraInterface, self).__init__()
         self.camera = camera
         self.with_tracking = with_tracking
         if with_tracking:
-            self.multitracker = cv2.MultiTracker_create()
+            self.multitracker = CorrelationMultiTracker()
             self.movingList = []
         else:
             self.multitracker = None
             self.movingList = []
+        # Calibrated stage, to follow the tracked objects when the stage moves
+        self.stage = None
+        self._monitoring_stage = False
+        self.paramecium_tracker = None  # created on first use
 
     def connect(self, main_gui):
         self.updated_exposure.connect(main_gui.set_status_message)
@@ -81,48 +88,69 @@ class CameraInterface(TaskInterface):
                 self.exception('Saving image as "%s" failed.' % fname)
 
 
+    def _stage_position(self):
+        # Cached and predicted stage position (the stage is not queried on
+        # each frame), monitored while objects are tracked
+        monitor = getattr(self.stage, 'position_monitor', None)
+        if monitor is None:
+            return None
+        tracking = len(self.multitracker) > 0
+        if tracking and not self._monitoring_stage:
+            monitor.start()
+            self._monitoring_stage = True
+        elif not tracking and self._monitoring_stage:
+            monitor.stop()
+            self._monitoring_stage = False
+        if not self._monitoring_stage:
+            return None
+        return monitor.position_at()
+
     def show_tracked_objects(self, img):
-        from holypipette.gui.movingList import moveList
-        del moveList[:]
-        ok, boxes = self.multitracker.update(img)
-        for newbox in boxes:
+        targets = []
+        set_tracking(self, len(self.multitracker) > 0)
+        stage_position = self._stage_position()
+        ok, boxes = self.multitracker.update(img, stage_position)
+        for newbox, found in zip(boxes, self.multitracker.found):
             p1 = (int(newbox[0]), int(newbox[1]))
             p2 = (int(newbox[0] + newbox[2]), int(newbox[1] + newbox[3]))
-            cv2.rectangle(img, p1, p2, (255, 255, 255), 2)
+            # Lost objects (at their last known position) with a thin line
+            cv2.rectangle(img, p1, p2, (255, 255, 255), 2 if found else 1)
             x = int(newbox[0] + 0.5 * newbox[2])
             y = int(newbox[1] + 0.5 * newbox[3])
             xs = x - self.camera.width / 2
             ys = y - self.camera.height / 2
-            moveList.append(np.array([xs, ys]))
+            targets.append(np.array([xs, ys]))
+        shared_state.targets.set(tuple(targets))
 
         return img
 
     def show_tracked_paramecium(self, img):
         pixel_per_um = 1.5
-        from holypipette.gui import movingList
+        if self.paramecium_tracker is None:
+            self.paramecium_tracker = BackprojectionTracker()
         x,y,norm = where_is_paramecium2(img, pixel_per_um = pixel_per_um, background = None, debug = True,
-                                  previous_x = None, previous_y = None, max_dist = 1e6)
+                                  previous_x = None, previous_y = None, max_dist = 1e6,
+                                  tracker = self.paramecium_tracker)
         if x is not None:
-            if movingList.tracking == False:
-                pass
             # Calculate variance of position
-            if len(movingList.position_history) == movingList.position_history.maxlen:
-                xpos, ypos = zip(*movingList.position_history)
+            position_history = shared_state.position_history.get()
+            if len(position_history) == self.position_history_length:
+                xpos, ypos = zip(*position_history)
                 movement = (var(xpos) + var(ypos)) ** .5
                 if movement < 1:  # 1 pixel
-                    print
-                    "Paramecium has stopped!"
-                    movingList.paramecium_stop = True
+                    print("Paramecium has stopped!")
+                    shared_state.paramecium_stop.set(True)
                 else:
-                    movingList.position_history.clear()
-            if (movingList.tracking == True)and(movingList.paramecium_stop == False):
+                    shared_state.position_history.set(())
+            if shared_state.tracking.get() and not shared_state.paramecium_stop.get():
                 xs = x - self.camera.width / 2
                 ys = y - self.camera.height / 2
-                movingList.position_history.append((xs, ys))
+                # Keep the recent positions
+                length = self.position_history_length
+                shared_state.position_history.update(lambda history: (history + ((xs, ys),))[-length:])
         return img
 
     def pipette_contact_detection(self, img):
-        from holypipette.gui import movingList
         height, width = img.shape[:2]
         pixel_per_um = 1.5
         x = width / 2
@@ -136,8 +164,8 @@ class CameraInterface(TaskInterface):
         _, contours, _ = cv2.findContours(thresh, 1, 2)
         cnt = contours[0]
         x, y, w, h = cv2.boundingRect(cnt)
-        if (w >= 1.8 * size) and (movingList.contact == False):
-            movingList.contact = True
+        if (w >= 1.8 * size) and not shared_state.contact.get():
+            shared_state.contact.set(True)
             print("Contact")
         return img
 
@@ -151,6 +179,14 @@ class CameraInterface(TaskInterface):
         while True:
             cv2.imshow('target cell selection', img)
             bbox1 = cv2.selectROI('target cell selection', img)
-            self.multitracker.add(cv2.TrackerKCF_create(), img, bbox1)
+            self.multitracker.add(img, bbox1)
+            # Background tasks using the camera yield to tracking
+            set_tracking(self, True)
             cv2.destroyWindow('target cell selection')
             break
+
+    @command(category='Camera',
+             description='Stop tracking all selected objects')
+    def clear_tracked_objects(self):
+        self.multitracker.clear()
+        set_tracking(self, False)
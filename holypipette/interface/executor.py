@@ -0,0 +1,152 @@
+"""
+Execution of blocking commands on a pool of worker threads, with exclusive
+access to the hardware resources (stage, microscope, manipulator units,
+pressure controller, amplifier) used by each task.
+"""
+import threading
+import time
+try:
+    import queue  # Python 3
+except ImportError:
+    import Queue as queue  # Python 2
+
+from holypipette.log_utils import LoggingObject
+
+__all__ = ['ResourceLocks', 'TaskExecutor']
+
+
+class ResourceLocks(object):
+    '''
+    Exclusive locks for hardware resources (see `.TaskController.resources`).
+
+    All the resources needed by a task are acquired at once or not at all,
+    therefore two tasks needing overlapping sets of resources cannot deadlock.
+    Locks are re-entrant: a thread can acquire resources it already holds
+    (e.g. a blocking command executing several tasks one after the other).
+    Waiting threads poll the locks and are not queued, i.e. they are not
+    served in first-come, first-served order.
+    '''
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._owners = {}  # resource -> [thread, count]
+
+    def _available(self, resources, thread):
+        return all(self._owners.get(resource, [thread])[0] is thread
+                   for resource in resources)
+
+    def acquire(self, resources, blocking=True, cancelled=None,
+                interval=0.1):
+        '''
+        Acquire all the given resources.
+
+        Parameters
+        ----------
+        resources : iterable
+            The resources to acquire.
+        blocking : bool, optional
+            Whether to wait until the resources are available (the default).
+            Otherwise, return immediately if one of them is busy.
+        cancelled : function, optional
+            Function without arguments, checked every ``interval`` seconds
+            while waiting; the wait is given up if it returns ``True``.
+        interval : float, optional
+            Time between two checks of ``cancelled``.
+
+        Returns
+        -------
+        success : bool
+            Whether the resources have been acquired.
+        '''
+        resources = set(resources)
+        thread = threading.current_thread()
+        with self._condition:
+            while not self._available(resources, thread):
+                if not blocking or (cancelled is not None and cancelled()):
+                    return False
+                self._condition.wait(interval)
+            for resource in resources:
+                if resource in self._owners:
+                    self._owners[resource][1] += 1
+                else:
+                    self._owners[resource] = [thread, 1]
+        return True
+
+    def release(self, resources):
+        '''
+        Release resources previously acquired by the current thread.
+        '''
+        with self._condition:
+            for resource in set(resources):
+                owner = self._owners[resource]
+                owner[1] -= 1
+                if owner[1] == 0:
+                    del self._owners[resource]
+            self._condition.notify_all()
+
+    def busy(self, resources):
+        '''
+        The subset of ``resources`` held by other threads.
+        '''
+        thread = threading.current_thread()
+        with self._condition:
+            return [resource for resource in resources
+                    if self._owners.get(resource, [thread])[0] is not thread]
+
+
+class TaskExecutor(LoggingObject):
+    '''
+    A pool of worker threads executing queued commands in order of
+    submission. Commands needing the same resources are serialized by the
+    `ResourceLocks` (see `.TaskInterface.execute`), other commands run in
+    parallel. A command waiting for its resources keeps its worker thread,
+    so at most ``workers`` commands (running or waiting) are handled at a
+    time.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Maximal number of worker threads (started on demand).
+    '''
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        '''
+        Queue ``func(*args)`` for execution in a worker thread. Exceptions
+        have to be handled by ``func``, they are only logged here.
+        '''
+        with self._lock:
+            self._queue.put((func, args, time.time()))
+            if (self._idle < self._queue.qsize() and
+                    len(self._threads) < self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name='TaskWorker-{}'.format(len(self._threads)))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+
+    def pending(self):
+        '''
+        Number of commands that have been queued but not started yet.
+        '''
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            func, args, submitted = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            delay = time.time() - submitted
+            if delay > 0.5:
+                self.debug('"{}" waited {:.1f}s for a worker'.format(getattr(func, '__name__', func),
+                                                                    delay))
+            try:
+                func(*args)
+            except Exception:
+                self.exception('Command "{}" failed'.format(getattr(func, '__name__', func)))
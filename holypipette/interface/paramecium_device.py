@@ -3,7 +3,6 @@ from holypipette.config import Config, NumberWithUnit, Number, Boolean
 from holypipette.interface import TaskInterface, command, blocking_command, PipetteInterface
 from holypipette.vision import cardinal_points
 from holypipette.controller.paramecium_device import ParameciumDeviceController
-import os
 
 import numpy as np
 import time
@@ -19,12 +18,25 @@ class ParameciumDeviceConfig(Config):
 
     impalement_step = NumberWithUnit(5, bounds=(1, 10), doc='Step size for impalement', unit='µm')
     pause_between_steps = NumberWithUnit(.5, bounds=(0, 2), doc='Pause between impalement steps', unit='s')
+    averaged_sweeps = Number(1, bounds=(1, 20), doc='Number of averaged sweeps for each impalement step')
+    pipelined_impalement = Boolean(False, doc='Move to the next impalement step during the analysis')
 
-    oscilloscope_filename = os.path.expanduser('~/holypipette/oscilloscope.txt')
+    autocenter_step = NumberWithUnit(250, bounds=(10, 2000), doc='Initial step for autocentering', unit='µm')
+    autocenter_max_distance = NumberWithUnit(15000, bounds=(1000, 50000), doc='Maximal distance for autocentering', unit='µm')
+    autocenter_precision = NumberWithUnit(20, bounds=(1, 500), doc='Precision of the edge detection for autocentering', unit='µm')
+    continuous_autocenter = Boolean(False, doc='Move the stage continuously while searching for edges')
+    autocenter_scan_interval = NumberWithUnit(.05, bounds=(0.01, 1), doc='Sampling interval during continuous autocentering', unit='s')
+
+    # Local port receiving the recordings (V1, V2, Ic2, t) of the acquisition
+    # program, see holypipette.utils.datachannel
+    oscilloscope_port = 5050
 
     categories = [('Manipulation', ['working_level', 'calibration_level', 'impalement_level', 'withdraw_distance', 'pipette_distance',
                                     'short_withdraw_distance']),
-                  ('Automation', ['impalement_step', 'pause_between_steps'])]
+                  ('Automation', ['impalement_step', 'pause_between_steps', 'averaged_sweeps',
+                                  'pipelined_impalement']),
+                  ('Autocenter', ['autocenter_step', 'autocenter_max_distance', 'autocenter_precision',
+                                  'continuous_autocenter', 'autocenter_scan_interval'])]
 
 
 class CalibratedUnitProxy(object):
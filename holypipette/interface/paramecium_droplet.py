@@ -1,8 +1,12 @@
 # coding=utf-8
 from holypipette.config import Config, NumberWithUnit, Number, Boolean
 from holypipette.controller.paramecium_droplet import ParameciumDropletController
+from holypipette.controller.follow import StageFollower
 from holypipette.interface import TaskInterface, command, blocking_command
-from holypipette.vision.paramecium_tracking import ParameciumTracker
+from holypipette.vision.droplet import DropletTracker
+from holypipette.vision.detectors import (DetectorRegistry, ContourDetector,
+                                          BackprojectionDetector)
+from holypipette.utils.statestore import set_tracking
 from holypipette.vision import cardinal_points
 
 import numpy as np
@@ -21,17 +25,28 @@ class ParameciumDropletConfig(Config):
     min_width = NumberWithUnit(30, bounds=(0, 1000), doc='Minimum width for ellipsis', unit='µm')
     max_width = NumberWithUnit(60, bounds=(0, 1000), doc='Maximum width for ellipsis', unit='µm')
     max_displacement = NumberWithUnit(50, bounds=(0, 1000), doc='Maximum displacement over one frame', unit='µm')
+    motion_compensation = Boolean(True, doc='Compensate stage movements when tracking?')
     autofocus_size = NumberWithUnit(150, bounds=(0, 1000),
                                     doc='Size of bounding box for autofocus',
                                     unit='µm')
     autofocus_sleep = NumberWithUnit(0.5, bounds=(0, 1),
                                      doc='Sleep time autofocus', unit='s')
+    contact_velocity = NumberWithUnit(25, bounds=(1, 200), doc='Pipette velocity for contact detection', unit='µm/s')
+    contact_max_distance = NumberWithUnit(100, bounds=(0, 1000), doc='Maximal distance for contact detection', unit='µm')
 
     # Automatic experiment
     minimum_stop_time = NumberWithUnit(0, bounds=(0, 5000), doc='Time before starting automation', unit='s')
     stop_duration= NumberWithUnit(50, bounds=(0, 1000), doc='Stopping duration before detection', unit='frames')
     stop_amplitude = NumberWithUnit(5, bounds=(0, 1000), doc='Movement threshold for detecting stop', unit='µm')
 
+    # Following with the stage
+    follow_rate = NumberWithUnit(5, bounds=(0.5, 50), doc='Rate of stage following', unit='Hz')
+    follow_gain = Number(0.5, bounds=(0, 2), doc='Proportional gain of stage following')
+    follow_integral_gain = NumberWithUnit(0, bounds=(0, 10), doc='Integral gain of stage following', unit='1/s')
+    follow_derivative_gain = NumberWithUnit(0, bounds=(0, 1), doc='Derivative gain of stage following', unit='s')
+    follow_deadband = NumberWithUnit(5, bounds=(0, 100), doc='Tolerated error of stage following', unit='µm')
+    follow_max_step = NumberWithUnit(500, bounds=(0, 5000), doc='Maximum stage move in following', unit='µm')
+
     # Vertical distance of pipettes above the coverslip
     working_distance = NumberWithUnit(200, bounds=(0, 1000), doc='Working distance for pipettes', unit='µm')
 
@@ -40,8 +55,12 @@ class ParameciumDropletConfig(Config):
     draw_fitted_ellipses = Boolean(False, doc='Draw fitted ellipses?')
 
     categories = [('Tracking', ['target_pixelperum','min_gradient', 'max_gradient', 'blur_size', 'minimum_contour',
-                                'min_length', 'max_length', 'min_width', 'max_width', 'max_displacement']),
-                  ('Manipulation', ['working_distance','autofocus_size','autofocus_sleep']),
+                                'min_length', 'max_length', 'min_width', 'max_width', 'max_displacement',
+                                'motion_compensation']),
+                  ('Manipulation', ['working_distance','autofocus_size','autofocus_sleep',
+                                    'contact_velocity', 'contact_max_distance']),
+                  ('Following', ['follow_rate', 'follow_gain', 'follow_integral_gain',
+                                 'follow_derivative_gain', 'follow_deadband', 'follow_max_step']),
                   ('Automation', ['stop_duration', 'stop_amplitude', 'minimum_stop_time']),
                   ('Debugging', ['draw_contours', 'draw_fitted_ellipses'])]
 
@@ -79,10 +98,42 @@ class ParameciumDropletInterface(TaskInterface):
         self.tracking = False
         self.follow_paramecium = False
         self.automate = False
-        self.paramecium_tracker = ParameciumTracker(self.config)
+        # Interchangeable paramecium detectors, switched at runtime
+        self.paramecium_detectors = DetectorRegistry()
+        self.paramecium_detectors.register('contours',
+                                           lambda: ContourDetector(self.config))
+        self.paramecium_detectors.register('backprojection',
+                                           lambda: BackprojectionDetector(self.config))
+        self.stage_follower = None  # created on first use
+        self._stage_position = None  # stage position at the previous frame
+        self._monitoring_stage = False
+        self.droplet_tracking = False
+        self.droplet_position = (None, None, None)
+        self.droplet_tracker = DropletTracker()
         self.previous_shift_click = None
         self.shift_click_time = time.time()-1e6 # a long time ago
 
+    @property
+    def tracking(self):
+        '''
+        Whether the paramecium is tracked. The state is shared (see
+        `.set_tracking`), so that background tasks using the camera
+        (e.g. drift estimation) leave the processing time to tracking.
+        '''
+        return getattr(self, '_tracking', False)
+
+    @tracking.setter
+    def tracking(self, value):
+        self._tracking = bool(value)
+        set_tracking(self, self._tracking)
+
+    @property
+    def paramecium_tracker(self):
+        '''
+        The tracker of the active paramecium detector.
+        '''
+        return self.paramecium_detectors.get().tracker
+
     @blocking_command(category='Paramecium',
                      description='Move pipettes to Paramecium',
                      task_description='Moving pipettes to Paramecium')
@@ -244,16 +295,75 @@ class ParameciumDropletInterface(TaskInterface):
         self.tracking = not self.tracking
         if self.tracking:
             self.paramecium_position = (None, None, None, None, None, None)
-            self.paramecium_tracker.clear()
+            self.paramecium_detectors.clear()
 
     @command(category='Paramecium',
              description='Toggle paramecium following')
     def toggle_following(self):
+        stage = self.controller.calibrated_stage
+        if not self.follow_paramecium and not hasattr(stage, 'position_monitor'):
+            self.error('Following needs a motorized stage')
+            return
         self.follow_paramecium = not self.follow_paramecium
         self.debug('Following Paramecium = {}'.format(self.follow_paramecium))
+        if self.follow_paramecium:
+            if self.stage_follower is None:
+                self.stage_follower = StageFollower(stage,
+                                                    resource_locks=self.resource_locks)
+            self.stage_follower.reset()
+            self.stage_follower.start(self.config.follow_rate)
+        else:
+            self.stage_follower.stop()
         if self.follow_paramecium and not self.tracking:
             self.tracking = True
-            self.paramecium_tracker.clear()
+            self.paramecium_detectors.clear()
+
+    def abort_task(self):
+        '''
+        Also stops following the paramecium, interrupting the current move of
+        the stage.
+        '''
+        super(ParameciumDropletInterface, self).abort_task()
+        if self.follow_paramecium:
+            self.follow_paramecium = False
+            self.stage_follower.stop()
+            self.debug('Following Paramecium = False')
+
+    @command(category='Paramecium',
+             description='Switch to the next paramecium detector')
+    def next_paramecium_detector(self):
+        name = self.paramecium_detectors.select_next()
+        self.paramecium_detectors.get().clear()
+        self.paramecium_position = (None, None, None, None, None, None)
+        self.info('Paramecium detector: {}'.format(name))
+
+    @command(category='Paramecium',
+             description='Toggle the comparison of all paramecium detectors')
+    def toggle_detector_comparison(self):
+        detectors = self.paramecium_detectors
+        detectors.compare = not detectors.compare
+        if detectors.compare:
+            detectors.metrics.reset()
+        self.info('Comparing paramecium detectors = {}'.format(detectors.compare))
+
+    @command(category='Paramecium',
+             description='Display the performance of the paramecium detectors')
+    def display_detector_metrics(self):
+        self.info('Paramecium detectors (active: {}):\n{}'.format(
+            self.paramecium_detectors.active, self.paramecium_detectors.metrics.report()))
+
+    @command(category='Paramecium',
+             description='Toggle droplet tracking')
+    def toggle_droplet_tracking(self):
+        self.droplet_tracking = not self.droplet_tracking
+        self.droplet_position = (None, None, None)
+        # The stage position is cached while droplets are tracked
+        monitor = getattr(self.controller.calibrated_stage, 'position_monitor', None)
+        if monitor is not None:
+            if self.droplet_tracking:
+                monitor.start()
+            else:
+                monitor.stop()
 
     @command(category='Paramecium',
              description='Display z position of manipulator relative to floor')
@@ -271,7 +381,50 @@ class ParameciumDropletInterface(TaskInterface):
         '''
         self.execute(self.controller.contact_detection)
 
+    def track_droplet(self, frame):
+        if not self.droplet_tracking:
+            return
+        pixel_per_um = getattr(self.camera, 'pixel_per_um', None)
+        if pixel_per_um is None:
+            pixel_per_um = self.calibrated_unit.stage.pixel_per_um()[0]
+        self.droplet_tracker.pixel_per_um = pixel_per_um
+        # Known droplets are stored relative to the stage (cached position,
+        # the stage is not queried on each frame)
+        monitor = getattr(self.controller.calibrated_stage, 'position_monitor', None)
+        stage_position = None
+        if monitor is not None:
+            stage_position = monitor.position_at()
+            if stage_position is None:
+                # No position sampled yet: droplets would be stored in screen
+                # coordinates
+                return
+        self.droplet_position = self.droplet_tracker.locate(frame, stage_position)
+
+    def _stage_displacement(self):
+        # Movement of the image since the previous frame, from the cached and
+        # predicted stage positions
+        monitor = getattr(self.controller.calibrated_stage, 'position_monitor', None)
+        if monitor is None:
+            return None
+        if not self._monitoring_stage:
+            monitor.start()
+            self._monitoring_stage = True
+        position = monitor.position_at()
+        previous, self._stage_position = self._stage_position, position
+        if position is None or previous is None:
+            return None
+        # Objects fixed relative to the stage move with it on screen
+        return position - previous
+
+    def _stop_stage_monitoring(self):
+        if self._monitoring_stage:
+            self.controller.calibrated_stage.position_monitor.stop()
+            self._monitoring_stage = False
+        self._stage_position = None
+
     def track_paramecium(self, frame):
+        if not self.tracking or not self.config.motion_compensation:
+            self._stop_stage_monitoring()
         if not self.tracking:
             return
         # Use the size information stored in the camera, in case it exists
@@ -279,14 +432,18 @@ class ParameciumDropletInterface(TaskInterface):
         pixel_per_um = getattr(self.camera, 'pixel_per_um', None)
         if pixel_per_um is None:
             pixel_per_um = self.calibrated_unit.stage.pixel_per_um()[0]
-        result = self.paramecium_tracker.locate(frame, pixel_per_um=pixel_per_um)
-        if result[0] is not None:
+        state = {'pixel_per_um': pixel_per_um}
+        if self.config.motion_compensation:
+            state['displacement'] = self._stage_displacement()
+        result = self.paramecium_detectors.process(frame, state=state)
+        info = result.info
+        if result.x is not None:
             # Center position
-            self.paramecium_position = (result.x, result.y, result.MA, result.ma, result.angle)
+            self.paramecium_position = (result.x, result.y, info['MA'], info['ma'], info['angle'])
             # Position of second electrode
-            self.paramecium_tip2_position = (result.x+cos(result.angle)*result.MA*.15,
-                                             result.y+sin(result.angle)*result.MA*.15)
-        self.paramecium_info = result.info
+            self.paramecium_tip2_position = (result.x+cos(info['angle'])*info['MA']*.15,
+                                             result.y+sin(info['angle'])*info['MA']*.15)
+        self.paramecium_info = info
 
         # Detect if it stops (TODO: analyze angle)
         # TODO: display median shape attributes (or even distribution)
@@ -300,12 +457,16 @@ class ParameciumDropletInterface(TaskInterface):
                 self.tracking = False
 
         # Follow with the stage
-        if self.follow_paramecium and result[0] is not None:
-            position = np.array(result[:2])
+        # (the stage follower moves the stage in its own control loop)
+        if self.follow_paramecium and result.x is not None:
+            follower = self.stage_follower
+            follower.gain = self.config.follow_gain
+            follower.integral_gain = self.config.follow_integral_gain
+            follower.derivative_gain = self.config.follow_derivative_gain
+            follower.deadband = self.config.follow_deadband * pixel_per_um
+            follower.max_step = self.config.follow_max_step * pixel_per_um
             w,h = self.camera.width, self.camera.height
-            move = np.zeros(3)
-            move[:2] = .5*(position - np.array([w/2,h/2]))
-            self.execute(self.controller.calibrated_stage.reference_relative_move, argument=-move)
+            follower.set_target((result.x - w/2, result.y - h/2))
 
     '''
     @command(category='Paramecium',
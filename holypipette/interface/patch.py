@@ -30,6 +30,10 @@ class PatchConfig(Config):
     max_cell_R = NumberWithUnit(300e6, bounds=(0, 1000e6), doc='Maximum cell resistance', unit='MΩ', magnitude=1e6)
     cell_distance = NumberWithUnit(10, bounds=(0, 100), doc='Initial distance above target cell', unit='μm')
     max_distance = NumberWithUnit(20, bounds=(0, 100), doc='Maximum movement during approach', unit='μm')
+    approach_step_min = NumberWithUnit(1, bounds=(0.1, 10), doc='Step size near the cell', unit='μm')
+    approach_step_max = NumberWithUnit(4, bounds=(0.1, 20), doc='Step size far from the cell', unit='μm')
+    approach_settle_time = NumberWithUnit(0.3, bounds=(0, 5), doc='Resistance measurement time after each step', unit='s')
+    release_time = NumberWithUnit(10, bounds=(0, 60), doc='Maximal waiting time for the pressure release near the cell', unit='s')
 
     max_R_increase = NumberWithUnit(1e6, bounds=(0, 100e6), doc='Increase in resistance indicating obstruction', unit='MΩ', magnitude=1e6)
     cell_R_increase = Number(.15, bounds=(0, 1), doc='Proportional increase in resistance indicating cell presence')
@@ -43,9 +47,22 @@ class PatchConfig(Config):
 
     zap = Boolean(False, doc='Zap the cell to break the seal')
 
-    categories = [('Approach', ['min_R', 'max_R', 'pressure_near', 'cell_distance', 'max_distance', 'cell_R_increase']),
+    resistance_rate = NumberWithUnit(50, bounds=(1, 500), doc='Resistance sampling rate', unit='Hz')
+    resistance_filter = NumberWithUnit(100e-3, bounds=(0, 2), doc='Resistance filtering window', unit='ms', magnitude=1e-3)
+
+    pressure_tolerance = NumberWithUnit(5, bounds=(0, 100), doc='Maximal difference between measured and commanded pressure', unit='mbar')
+    pressure_settle_time = NumberWithUnit(200e-3, bounds=(0, 2), doc='Duration of a settled pressure measurement', unit='ms', magnitude=1e-3)
+
+    contact_velocity = NumberWithUnit(10, bounds=(1, 100), doc='Pipette velocity for contact detection', unit='µm/s')
+    contact_max_distance = NumberWithUnit(500, bounds=(0, 5000), doc='Maximal distance for contact detection', unit='µm')
+
+    categories = [('Approach', ['min_R', 'max_R', 'pressure_near', 'cell_distance', 'max_distance', 'cell_R_increase',
+                                'approach_step_min', 'approach_step_max', 'approach_settle_time', 'release_time']),
                   ('Sealing', ['pressure_sealing', 'gigaseal_R', 'Vramp_duration', 'Vramp_amplitude', 'seal_min_time', 'seal_deadline']),
-                  ('Break-in', ['zap', 'pressure_ramp_increment', 'pressure_ramp_max', 'pressure_ramp_duration', 'max_cell_R'])]
+                  ('Break-in', ['zap', 'pressure_ramp_increment', 'pressure_ramp_max', 'pressure_ramp_duration', 'max_cell_R']),
+                  ('Resistance monitoring', ['resistance_rate', 'resistance_filter']),
+                  ('Pressure monitoring', ['pressure_tolerance', 'pressure_settle_time']),
+                  ('Contact detection', ['contact_velocity', 'contact_max_distance'])]
 
 
 class AutoPatchInterface(TaskInterface):
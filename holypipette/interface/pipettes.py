@@ -3,10 +3,12 @@ import pickle
 import os
 
 import numpy as np
+from numpy.linalg import norm
 from PyQt5 import QtCore
 
 from holypipette.interface import TaskInterface, command, blocking_command
 from holypipette.devices.manipulator.calibratedunit import CalibratedUnit, CalibratedStage, CalibrationConfig
+from holypipette.vision.overviewmap import OverviewMap
 import time
 
 class PipetteInterface(TaskInterface):
@@ -41,6 +43,7 @@ class PipetteInterface(TaskInterface):
         config_filename = os.path.join(config_folder,config_filename)
 
         self.config_filename = config_filename
+        self.overview_directory = os.path.join(config_folder, 'overview')
         self.current_unit = 0
         self.calibrated_unit = None
         self.cleaning_bath_position = None
@@ -200,6 +203,20 @@ class PipetteInterface(TaskInterface):
         self.debug('asking for recalibration at {}'.format(xy_position))
         self.execute(self.calibrated_unit.recalibrate, argument=xy_position)
 
+    @command(category='Manipulators',
+             description='Display calibration drift statistics')
+    def display_calibration_drift(self):
+        stats = self.calibrated_unit.calibration_drift()
+        if stats is None:
+            self.info('No pipette localization since last calibration')
+            return
+        self.info('Calibration drift after {} localizations ({} rejected): '
+                  'offset drift = {}, matrix drift = {:.1f}%, '
+                  'RMS error = {:.1f}'.format(stats['updates'], stats['rejected'],
+                                              list(stats['offset_drift']),
+                                              100*stats['matrix_drift'],
+                                              stats['rms_residual']))
+
     @blocking_command(category='Manipulators',
                      description='Move pipette to position',
                      task_description='Moving to position with safe approach')
@@ -218,6 +235,86 @@ class PipetteInterface(TaskInterface):
         self.debug('asking for reference move to {}'.format(position))
         self.execute(self.calibrated_stage.reference_relative_move, argument=-position) # compensatory move
 
+    @property
+    def overview_map(self):
+        '''
+        The overview map of the preparation (loaded from disk when first
+        accessed).
+        '''
+        # Created on demand, since loading the map can take some time
+        if getattr(self, '_overview_map', None) is None:
+            self._overview_map = OverviewMap(self.overview_directory,
+                                             cell_size=max(self.camera.width,
+                                                           self.camera.height))
+        return self._overview_map
+
+    @blocking_command(category='Stage',
+                      description='Add a mosaic around the current position to the overview map',
+                      task_description='Taking a mosaic for the overview map')
+    def acquire_overview(self):
+        self.execute(self.calibrated_stage.add_to_overview,
+                     argument=self.overview_map)
+
+    @command(category='Stage',
+             description='Add the current image to the overview map')
+    def add_view_to_overview(self):
+        image = self.camera.snap()
+        height, width = image.shape[:2]
+        top_left = self.calibrated_stage.map_position((-width/2., -height/2.))
+        self.overview_map.add_image(image, top_left)
+
+    @command(category='Stage',
+             description='Remember the position on the overview map')
+    def remember_position(self, xy_position):
+        map_position = self.calibrated_stage.map_position(xy_position)
+        name = self.overview_map.mark(map_position)
+        self.info('Position {} stored as "{}"'.format(list(map_position), name))
+
+    @command(category='Stage',
+             description='Clear the overview map',
+             success_message='Overview map cleared')
+    def clear_overview(self):
+        self.overview_map.clear()
+
+    @blocking_command(category='Stage',
+                      description='Move stage to a position of the overview map',
+                      task_description='Moving stage to overview map position')
+    def move_stage_to_map_position(self, map_position):
+        self.debug('asking for move to map position {}'.format(map_position))
+        self.execute(self.calibrated_stage.move_to_map_position,
+                     argument=map_position)
+
+    @command(category='Stage',
+             description='Start/stop the estimation of the preparation drift')
+    def toggle_drift_estimation(self):
+        monitor = self.calibrated_stage.drift_monitor
+        if monitor.is_running:
+            monitor.stop()
+            self.info('Stopped drift estimation')
+        else:
+            monitor.start(rate=1./self.calibration_config.drift_interval)
+            self.info('Started drift estimation')
+
+    @command(category='Stage',
+             description='Take a new reference image for drift estimation',
+             success_message='Drift reset')
+    def reset_drift(self):
+        self.calibrated_stage.drift_monitor.set_reference(reset=True)
+
+    @command(category='Stage',
+             description='Display the estimated drift of the preparation')
+    def display_drift(self):
+        times, drift = self.calibrated_stage.drift_monitor.history()
+        if not len(times):
+            self.info('No drift estimation yet')
+            return
+        rate = 0.
+        if times[-1] > times[0]:
+            rate = norm(drift[-1] - drift[0]) / (times[-1] - times[0]) * 60
+        self.info('Drift = {} pixels ({:.1f} pixels/min over {:.0f} s), '
+                  'compensation {}'.format(list(drift[-1]), rate, times[-1] - times[0],
+                                           'on' if self.calibration_config.drift_compensation else 'off'))
+
     @blocking_command(category='Microscope',
                       description='Go to the floor (cover slip)',
                       task_description='Go to the floor (cover slip)')
@@ -0,0 +1,245 @@
+'''
+A streaming data channel over a local socket, used to receive recordings (e.g.
+from the acquisition program controlling the oscilloscope) as binary arrays.
+
+Each message ("frame") contains several named signals of the same length:
+
+* a header: the magic bytes ``HPDC``, the number of signals and the number of
+  samples (little-endian unsigned 32 bit integers),
+* for each signal, the length of its name (unsigned 16 bit integer) followed by
+  the name (UTF-8),
+* the values, as little-endian 64 bit floats (one signal after the other).
+
+The acquisition program sends frames with `DataChannelClient` (or any
+implementation of the format above); `DataChannel` receives them in a
+background thread and notifies the threads waiting for new data.
+'''
+from __future__ import absolute_import
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from holypipette.log_utils import LoggingObject
+
+__all__ = ['DataChannel', 'DataChannelClient', 'encode_frame']
+
+_MAGIC = b'HPDC'
+_HEADER = struct.Struct('<4sII')
+_NAME_LENGTH = struct.Struct('<H')
+
+
+def encode_frame(signals):
+    '''
+    Encodes a dictionary of signals (1D arrays of the same length) as a frame.
+    '''
+    names = list(signals)
+    values = [np.asarray(signals[name], dtype='<f8') for name in names]
+    n_samples = len(values[0]) if values else 0
+    if any(len(v) != n_samples for v in values):
+        raise ValueError('All signals need to have the same length')
+    parts = [_HEADER.pack(_MAGIC, len(names), n_samples)]
+    for name in names:
+        encoded = name.encode('utf-8')
+        parts.append(_NAME_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    parts.extend(v.tobytes() for v in values)
+    return b''.join(parts)
+
+
+def _receive_exactly(connection, size):
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _receive_frame(connection):
+    magic, n_signals, n_samples = _HEADER.unpack(_receive_exactly(connection,
+                                                                  _HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError('Invalid frame header')
+    names = []
+    for _ in range(n_signals):
+        length, = _NAME_LENGTH.unpack(_receive_exactly(connection,
+                                                       _NAME_LENGTH.size))
+        names.append(_receive_exactly(connection, length).decode('utf-8'))
+    data = np.frombuffer(_receive_exactly(connection, 8 * n_signals * n_samples),
+                         dtype='<f8').reshape((n_signals, n_samples))
+    return dict(zip(names, data))
+
+
+class DataChannelClient(object):
+    '''
+    Sends frames to a `DataChannel` (to be used in the acquisition program).
+
+    Parameters
+    ----------
+    port : int
+        The port the `DataChannel` listens on.
+    host : str, optional
+        The host of the `DataChannel`.
+    '''
+    def __init__(self, port, host='127.0.0.1'):
+        self.address = (host, port)
+        self._socket = None
+
+    def send(self, **signals):
+        '''
+        Sends signals, given as keyword arguments (e.g. ``V1=..., t=...``).
+        The connection is (re-)established if needed.
+        '''
+        frame = encode_frame(signals)
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self._socket.sendall(frame)
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class DataChannel(LoggingObject):
+    '''
+    Receives frames sent by `DataChannelClient` in a background thread. Only
+    the most recent frame is kept.
+
+    Parameters
+    ----------
+    port : int
+        The port to listen on (0 to choose a free port, see `address`).
+    host : str, optional
+        The interface to listen on (only local connections by default).
+    '''
+    def __init__(self, port, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0  # Number of frames received
+        self._consumed = 0  # Sequence number of the last frame returned by receive
+        self._server = None
+
+    @property
+    def address(self):
+        '''
+        The address the channel listens on (starts the channel if needed).
+        '''
+        self.start()
+        return self._server.getsockname()
+
+    def start(self):
+        '''
+        Starts listening for connections (if not already done).
+        '''
+        with self._condition:
+            if self._server is not None:
+                return
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            server.listen(1)
+            self._server = server
+        thread = threading.Thread(target=self._accept, args=(server,),
+                                  name='DataChannel-{}'.format(self.port))
+        thread.daemon = True
+        thread.start()
+        self.debug('Listening for data on {}:{}'.format(*server.getsockname()))
+
+    def _accept(self, server):
+        while True:
+            try:
+                connection, address = server.accept()
+            except socket.error:
+                return  # server closed
+            self.debug('Data connection from {}:{}'.format(*address))
+            thread = threading.Thread(target=self._read, args=(connection,),
+                                      name='DataChannelReader')
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, connection):
+        try:
+            while True:
+                frame = _receive_frame(connection)
+                with self._condition:
+                    self._frame = frame
+                    self._sequence += 1
+                    self._condition.notify_all()
+        except EOFError:
+            self.debug('Data connection closed')
+        except (socket.error, ValueError, struct.error):
+            self.exception('Invalid data received, closing connection')
+        finally:
+            connection.close()
+
+    def latest(self):
+        '''
+        The most recent frame (a dictionary of signals), or ``None``.
+        '''
+        with self._condition:
+            return self._frame
+
+    def discard(self):
+        '''
+        Marks all frames received so far as already returned by `receive`.
+        '''
+        with self._condition:
+            self._consumed = self._sequence
+
+    def receive(self, timeout=None, controller=None):
+        '''
+        Waits for a frame that has not been returned by a previous call, and
+        returns it. If several frames have been received in the meantime, only
+        the most recent one is returned.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum waiting time in seconds (no maximum by default).
+        controller : `.TaskController`, optional
+            If provided, the wait is interrupted when an abort is requested.
+
+        Returns
+        -------
+        signals : dict or None
+            The signals, or ``None`` if the timeout was reached.
+        '''
+        self.start()
+        t0 = time.time()
+        with self._condition:
+            while self._sequence == self._consumed:
+                remaining = None if timeout is None else timeout - (time.time() - t0)
+                if remaining is not None and remaining <= 0:
+                    return None
+                # Wake up regularly to check for abort requests
+                self._condition.wait(0.1 if remaining is None else min(remaining, 0.1))
+                if controller is not None:
+                    controller.abort_if_requested()
+            self._consumed = self._sequence
+            return self._frame
+
+    def close(self):
+        '''
+        Stops listening for connections.
+        '''
+        with self._condition:
+            server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.shutdown(socket.SHUT_RDWR)  # wakes up the accepting thread
+            except socket.error:
+                pass
+            server.close()
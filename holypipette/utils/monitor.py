@@ -0,0 +1,268 @@
+'''
+Background sampling of device measurements into a ring buffer.
+'''
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+from holypipette.log_utils import LoggingObject
+
+__all__ = ['RingBuffer', 'Monitor']
+
+
+class RingBuffer(object):
+    '''
+    Stores the last ``size`` samples of one or several signals, together with
+    their time stamps. Samples are written by one thread (e.g. a device
+    monitor) and can be read from other threads.
+
+    Parameters
+    ----------
+    size : int
+        The maximal number of samples.
+    channels : int, optional
+        The number of values per sample.
+    '''
+    def __init__(self, size, channels=1):
+        self.size = size
+        self.channels = channels
+        self._times = np.zeros(size)
+        self._values = np.zeros((size, channels))
+        self._count = 0  # Total number of samples (index in the buffer is _count % size)
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    @property
+    def count(self):
+        '''
+        Total number of samples written since the creation of the buffer.
+        '''
+        return self._count
+
+    def clear(self):
+        with self._condition:
+            self._count = 0
+
+    def append(self, t, *values):
+        '''
+        Stores a sample taken at time ``t`` and notifies waiting threads.
+        '''
+        with self._condition:
+            index = self._count % self.size
+            self._times[index] = t
+            self._values[index] = values
+            self._count += 1
+            self._condition.notify_all()
+
+    def window(self, duration=None):
+        '''
+        The samples in chronological order.
+
+        Parameters
+        ----------
+        duration : float, optional
+            Only return the samples of the last ``duration`` seconds (all samples
+            in the buffer by default).
+
+        Returns
+        -------
+        times : `~numpy.ndarray`
+            The time stamps.
+        values : `~numpy.ndarray`
+            The values, with one column per channel.
+        '''
+        with self._condition:
+            n = min(self._count, self.size)
+            indices = np.arange(self._count - n, self._count) % self.size
+            times = self._times[indices]
+            values = self._values[indices]
+        if duration is not None and n:
+            keep = times >= times[-1] - duration
+            times, values = times[keep], values[keep]
+        return times, values
+
+    def latest(self):
+        '''
+        The most recent sample as a ``(time, values)`` tuple, or
+        ``(None, None)`` if the buffer is empty.
+        '''
+        with self._condition:
+            if self._count == 0:
+                return None, None
+            index = (self._count - 1) % self.size
+            return self._times[index], self._values[index].copy()
+
+    def wait_for_sample(self, timeout=None):
+        '''
+        Waits for the next sample. Returns ``False`` on timeout.
+        '''
+        with self._condition:
+            count = self._count
+            self._condition.wait(timeout)
+            return self._count > count
+
+
+class Monitor(LoggingObject):
+    '''
+    Base class for objects sampling a device in a background thread at a
+    fixed rate, and storing the measurements in a `RingBuffer`. Subclasses
+    have to implement `read`.
+
+    The sampling thread runs between calls to `start` and `stop` (these calls
+    can be nested, the thread stops with the last call to `stop`).
+
+    Parameters
+    ----------
+    rate : float
+        Sampling rate in Hz.
+    duration : float
+        Duration (in s) of the history kept in the ring buffer.
+    channels : int
+        The number of values returned by `read`.
+    '''
+    def __init__(self, rate, duration, channels=1):
+        self.rate = rate
+        self.duration = duration
+        self.channels = channels
+        self.buffer = RingBuffer(int(duration * rate), channels)
+        self._lock = threading.Lock()
+        self._users = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def read(self):
+        '''
+        Reads the device. Returns a tuple of values (one per channel), or
+        ``None`` if no measurement is available.
+        '''
+        raise NotImplementedError()
+
+    def start(self, rate=None):
+        '''
+        Start sampling (if not already running).
+
+        Parameters
+        ----------
+        rate : float, optional
+            A new sampling rate in Hz (only used if the monitor is not running).
+        '''
+        with self._lock:
+            self._users += 1
+            if self._thread is not None:
+                return
+            if rate is not None and rate != self.rate:
+                self.rate = rate
+                self.buffer = RingBuffer(int(self.duration * rate), self.channels)
+            self.buffer.clear()
+            # A new event, since a thread stopped without waiting may still
+            # be running
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._sample,
+                                            args=(self._stop_event, ),
+                                            name=self.__class__.__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, wait=True):
+        '''
+        Stop sampling, unless other users still need the monitor.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Whether to wait for the end of the sampling thread (the default).
+            Otherwise, the thread ends after its current `read`, without
+            recording it.
+        '''
+        with self._lock:
+            self._users = max(self._users - 1, 0)
+            if self._users > 0 or self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+            self._stop_event.set()
+        if wait:
+            thread.join()
+
+    @contextlib.contextmanager
+    def running(self, rate=None):
+        '''
+        Context manager running the monitor during a block of code.
+        '''
+        self.start(rate)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    def _sample(self, stop_event):
+        period = 1. / self.rate
+        next_time = time.time()
+        failed = False
+        while not stop_event.is_set():
+            try:
+                values = self.read()
+            except Exception:
+                if not failed:  # only log the first error
+                    self.exception('{} could not read the device'.format(self.__class__.__name__))
+                failed = True
+                values = None
+            if values is not None and not stop_event.is_set():
+                self.buffer.append(time.time(), *values)
+            next_time += period
+            delay = next_time - time.time()
+            if delay < 0:  # sampling is too slow, do not try to catch up
+                next_time = time.time()
+            else:
+                stop_event.wait(delay)
+
+    def wait_for_sample(self, timeout=None):
+        '''
+        Waits for the next sample.
+
+        Returns
+        -------
+        success : bool
+            ``False`` if no sample was recorded before the timeout.
+        '''
+        return self.buffer.wait_for_sample(timeout)
+
+    def wait_until(self, condition, timeout=None, controller=None):
+        '''
+        Waits until ``condition(monitor)`` is ``True``, checking it after each
+        new sample.
+
+        Parameters
+        ----------
+        condition : function
+            Function called with the monitor as its argument.
+        timeout : float, optional
+            Maximum waiting time in seconds (no maximum by default).
+        controller : `.TaskController`, optional
+            If provided, the wait is interrupted when an abort is requested.
+
+        Returns
+        -------
+        success : bool
+            ``False`` if the timeout was reached.
+        '''
+        t0 = time.time()
+        while not condition(self):
+            if controller is not None:
+                controller.abort_if_requested()
+            remaining = None if timeout is None else timeout - (time.time() - t0)
+            if remaining is not None and remaining <= 0:
+                return False
+            interval = 0.1 if remaining is None else min(remaining, 0.1)
+            if self.is_running:
+                self.wait_for_sample(interval)
+            else:
+                time.sleep(interval)
+        return True
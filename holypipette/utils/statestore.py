@@ -0,0 +1,176 @@
+'''
+Thread-safe state shared between the GUI (e.g. image processing on each
+displayed frame) and the tasks running in worker threads.
+'''
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from holypipette.log_utils import LoggingObject
+
+__all__ = ['Snapshot', 'SharedValue', 'StateStore', 'shared_state', 'set_tracking']
+
+
+#: A value together with its version (number of updates) and update time
+Snapshot = collections.namedtuple('Snapshot', ['version', 'time', 'value'])
+
+
+class SharedValue(LoggingObject):
+    '''
+    A value shared between threads. Values are replaced as a whole (use
+    immutable values such as tuples, so that readers never see a partially
+    updated value), each update increments the version number and notifies
+    waiting threads and subscribers.
+
+    Parameters
+    ----------
+    name : str
+        The name of the value (for error messages).
+    value_type : type or tuple of types
+        The allowed type(s) for the value.
+    default : object
+        The initial value.
+    '''
+    def __init__(self, name, value_type, default):
+        self.name = name
+        self.value_type = value_type
+        self._condition = threading.Condition()
+        self._subscribers = []
+        self._snapshot = Snapshot(0, time.time(), self._check(default))
+
+    def _check(self, value):
+        if not isinstance(value, self.value_type):
+            raise TypeError('"{}" has to be of type {}, not {}'.format(self.name,
+                                                                    self.value_type,
+                                                                    type(value)))
+        return value
+
+    def get(self):
+        '''
+        The current value.
+        '''
+        return self._snapshot.value
+
+    def snapshot(self):
+        '''
+        The current value, with its version and update time (`Snapshot`).
+        '''
+        return self._snapshot
+
+    def set(self, value):
+        '''
+        Replaces the value, and notifies waiting threads and subscribers.
+        '''
+        return self.update(lambda _: value)
+
+    def update(self, function):
+        '''
+        Atomically replaces the value by ``function(value)``.
+
+        Returns
+        -------
+        snapshot : `Snapshot`
+            The new snapshot.
+        '''
+        with self._condition:
+            value = self._check(function(self._snapshot.value))
+            snapshot = Snapshot(self._snapshot.version + 1, time.time(), value)
+            self._snapshot = snapshot
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception:
+                self.exception('Subscriber of "{}" failed'.format(self.name))
+        return snapshot
+
+    def wait_for_change(self, version, timeout=None):
+        '''
+        Waits for a version newer than ``version``.
+
+        Returns
+        -------
+        snapshot : `Snapshot` or None
+            The new snapshot, or ``None`` if the timeout was reached.
+        '''
+        with self._condition:
+            if self._snapshot.version <= version:
+                self._condition.wait(timeout)
+            if self._snapshot.version <= version:
+                return None
+            return self._snapshot
+
+    def subscribe(self, callback):
+        '''
+        Calls ``callback(snapshot)`` after each update (in the updating
+        thread).
+        '''
+        with self._condition:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            self._subscribers.remove(callback)
+
+
+class StateStore(object):
+    '''
+    A collection of named `SharedValue` objects, accessible as attributes.
+
+    Parameters
+    ----------
+    fields : dict
+        Mapping from names to ``(type, default)`` tuples.
+    '''
+    def __init__(self, **fields):
+        self._values = collections.OrderedDict(
+            (name, SharedValue(name, value_type, default))
+            for name, (value_type, default) in sorted(fields.items()))
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_values'][name]
+        except KeyError:
+            raise AttributeError('No shared value "{}"'.format(name))
+
+    def __dir__(self):
+        return list(self._values)
+
+    def snapshot(self):
+        '''
+        The current snapshots of all values, as a dictionary.
+        '''
+        return {name: value.snapshot() for name, value in self._values.items()}
+
+
+#: State shared between the GUI and the tasks
+shared_state = StateStore(
+    # Positions of the tracked targets (relative to the image center)
+    targets=(tuple, ()),
+    # Recent positions of the tracked paramecium
+    position_history=(tuple, ()),
+    tracking=(bool, False),
+    paramecium_stop=(bool, False),
+    # Contact of the pipette detected on the image
+    contact=(bool, True))
+
+
+_tracking_sources = set()
+_tracking_lock = threading.Lock()
+
+
+def set_tracking(source, active):
+    '''
+    Declares whether ``source`` (e.g. an interface) is tracking objects.
+    ``shared_state.tracking`` is ``True`` while at least one source tracks.
+    '''
+    with _tracking_lock:
+        if active:
+            _tracking_sources.add(source)
+        else:
+            _tracking_sources.discard(source)
+        tracking = len(_tracking_sources) > 0
+        if shared_state.tracking.get() != tracking:
+            shared_state.tracking.set(tracking)
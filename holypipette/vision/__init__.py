@@ -6,3 +6,9 @@ from .templatematching import *
 from .findpipette import *
 from .crop import *
 from .paramecium_tracking import *
+from .contact import *
+from .mosaic import *
+from .overviewmap import *
+from .droplet import *
+from .detectors import *
+from .multitracker import *
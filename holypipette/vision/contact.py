@@ -0,0 +1,98 @@
+'''
+Detection of the contact of the pipette with a surface (water meniscus,
+coverslip) on camera images. The detectors are called on successive frames
+(see `.FrameWatcher`).
+'''
+from __future__ import absolute_import
+import warnings
+
+import numpy as np
+try:
+    import cv2
+except ImportError:
+    warnings.warn('OpenCV not available')
+
+__all__ = ['ContrastContactDetector', 'OutlineContactDetector']
+
+
+def _crop(image, roi):
+    x0, y0, x1, y1 = [max(int(v), 0) for v in roi]
+    frame = image[y0:y1, x0:x1]
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    return frame
+
+
+class ContrastContactDetector(object):
+    '''
+    Detects an increase of the contrast (standard deviation of the intensity)
+    in a region of interest, relative to its value on the first frames.
+
+    Parameters
+    ----------
+    roi : tuple
+        The region ``(x0, y0, x1, y1)`` in pixels, i.e. ``image[y0:y1, x0:x1]``.
+    ratio : float, optional
+        The relative increase of the contrast indicating contact.
+    baseline_frames : int, optional
+        The number of frames used to measure the initial contrast.
+    '''
+    def __init__(self, roi, ratio=1.3, baseline_frames=3):
+        self.roi = roi
+        self.ratio = ratio
+        self.baseline_frames = baseline_frames
+        self._baseline = []
+        self.std = None  # contrast in the last frame
+
+    @property
+    def ready(self):
+        '''
+        Whether the initial contrast has been measured.
+        '''
+        return len(self._baseline) >= self.baseline_frames
+
+    @property
+    def baseline(self):
+        return np.mean(self._baseline) if self._baseline else None
+
+    def __call__(self, image):
+        self.std = _crop(image, self.roi).std()
+        if not self.ready:
+            self._baseline.append(self.std)
+            return False
+        return self.std > self.ratio * self.baseline
+
+
+class OutlineContactDetector(object):
+    '''
+    Detects the contact of the pipette tip with the coverslip: the dark
+    outline of the tip, segmented with Otsu's method, widens to span most of
+    the region of interest.
+
+    Parameters
+    ----------
+    roi : tuple
+        The region ``(x0, y0, x1, y1)`` around the tip, in pixels.
+    ratio : float, optional
+        The width of the outline, relative to the width of the region,
+        indicating contact.
+    '''
+    def __init__(self, roi, ratio=0.9):
+        self.roi = roi
+        self.ratio = ratio
+
+    def __call__(self, image):
+        framelet = _crop(image, self.roi)
+        if framelet.size == 0:
+            return False
+        framelet = cv2.normalize(framelet.astype(np.float32), None, 0, 255,
+                                 cv2.NORM_MINMAX).astype(np.uint8)
+        _, thresh = cv2.threshold(framelet, 0, 255,
+                                  cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        # The number of return values depends on the OpenCV version
+        contours = cv2.findContours(thresh, cv2.RETR_LIST,
+                                    cv2.CHAIN_APPROX_SIMPLE)[-2]
+        if not contours:
+            return False
+        _, _, w, _ = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        return w >= self.ratio * framelet.shape[1]
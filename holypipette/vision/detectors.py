@@ -0,0 +1,391 @@
+'''
+Detector backends with a common interface, a registry to switch between them
+at runtime, and a collector of per-call timing metrics to compare them.
+
+All backends implement ``process(frame, roi=None, state=None)``, returning a
+`Detection` in the coordinates of the full frame. ``state`` is a dictionary
+of hints shared with the caller (e.g. ``pixel_per_um``, ``stage_position``,
+or ``displacement``, the movement of the image since the previous frame); the
+state specific to each backend (templates, previous positions) is kept in the
+backend object.
+'''
+from __future__ import absolute_import
+import collections
+import threading
+import time
+import warnings
+
+import numpy as np
+try:
+    import cv2
+except ImportError:
+    warnings.warn('OpenCV not available')
+
+from .paramecium_tracking import ParameciumTracker, BackprojectionTracker
+from .droplet import DropletTracker
+from .templatematching import templatematching, MatchingError
+
+__all__ = ['Detection', 'Detector', 'ContourDetector', 'BackprojectionDetector',
+           'DropletDetector', 'TemplateDetector', 'OpenCVTrackerDetector',
+           'DetectorMetrics', 'DetectorRegistry']
+
+#: The result of a detector: position in the frame (``None`` if nothing was
+#: found) and backend-specific information (e.g. the size of the object)
+Detection = collections.namedtuple('Detection', ['x', 'y', 'info'])
+
+
+class Detector(object):
+    '''
+    Base class for detector backends. Subclasses implement `detect`, on the
+    region of interest only.
+    '''
+    def process(self, frame, roi=None, state=None):
+        '''
+        Detects the object in a frame.
+
+        Parameters
+        ----------
+        frame : `~numpy.ndarray`
+            The image.
+        roi : tuple, optional
+            The region ``(x0, y0, x1, y1)`` to search in, i.e.
+            ``frame[y0:y1, x0:x1]`` (the full frame by default).
+        state : dict, optional
+            Hints shared with the caller (see the module documentation).
+
+        Returns
+        -------
+        detection : `Detection`
+            The detection, in the coordinates of the full frame.
+        '''
+        if state is None:
+            state = {}
+        if roi is None:
+            return self.detect(frame, state)
+        x0, y0, x1, y1 = [max(int(v), 0) for v in roi]
+        detection = self.detect(frame[y0:y1, x0:x1], state)
+        if detection.x is None:
+            return detection
+        return Detection(detection.x + x0, detection.y + y0, detection.info)
+
+    def detect(self, frame, state):
+        raise NotImplementedError()
+
+    def clear(self):
+        '''
+        Forgets the state of the backend (e.g. the previous positions).
+        '''
+        pass
+
+
+def _pixel_per_um(state, default=1.):
+    return state.get('pixel_per_um', default)
+
+
+class ContourDetector(Detector):
+    '''
+    Paramecium detection by ellipse fitting on contours (`.ParameciumTracker`).
+    '''
+    def __init__(self, config=None):
+        self.tracker = ParameciumTracker(config)
+
+    def detect(self, frame, state):
+        displacement = state.get('displacement')
+        if displacement is not None:
+            self.tracker.shift(displacement)
+        result = self.tracker.locate(frame, pixel_per_um=_pixel_per_um(state))
+        info = dict(result.info, MA=result.MA, ma=result.ma, angle=result.angle)
+        return Detection(result.x, result.y, info)
+
+    def clear(self):
+        self.tracker.clear()
+
+
+class BackprojectionDetector(ContourDetector):
+    '''
+    Paramecium detection by background backprojection and shape matching
+    (`.BackprojectionTracker`).
+    '''
+    def __init__(self, config=None, **kwds):
+        self.tracker = BackprojectionTracker(config, **kwds)
+
+
+class DropletDetector(Detector):
+    '''
+    Droplet detection (`.DropletTracker`). The radius is ``info['r']``.
+    '''
+    def __init__(self, **kwds):
+        self.tracker = DropletTracker(**kwds)
+
+    def detect(self, frame, state):
+        self.tracker.pixel_per_um = _pixel_per_um(state, self.tracker.pixel_per_um)
+        x, y, r = self.tracker.locate(frame, state.get('stage_position'))
+        return Detection(x, y, {'r': r})
+
+    def clear(self):
+        self.tracker.clear()
+
+
+class TemplateDetector(Detector):
+    '''
+    Template matching (`.templatematching`). The template is given at
+    creation or as ``state['template']``; the position is the center of the
+    matched template, and the matching value is ``info['value']``.
+    '''
+    def __init__(self, template=None, threshold=0):
+        self.template = template
+        self.threshold = threshold
+
+    def detect(self, frame, state):
+        template = state.get('template', self.template)
+        if template is None:
+            return Detection(None, None, {})
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        try:
+            x, y, value = templatematching(frame, template, self.threshold)
+        except MatchingError as ex:
+            return Detection(None, None, {'value': ex.value})
+        height, width = template.shape[:2]
+        return Detection(x + width / 2., y + height / 2., {'value': value})
+
+
+class OpenCVTrackerDetector(Detector):
+    '''
+    Tracking of an object with an OpenCV tracker (KCF by default, or MIL if
+    KCF is not available, as in OpenCV builds without contrib modules). The
+    tracker starts on the bounding box ``state['bbox']`` (``x, y, width,
+    height``), which is then removed from the state; the box is
+    ``info['bbox']``.
+    '''
+    def __init__(self, create=None):
+        if create is None:
+            create = getattr(cv2, 'TrackerKCF_create', None) or cv2.TrackerMIL_create
+        self.create = create
+        self.tracker = None
+
+    def detect(self, frame, state):
+        bbox = state.pop('bbox', None)
+        if bbox is not None:
+            self.tracker = self.create()
+            self.tracker.init(frame, tuple(int(v) for v in bbox))
+            return Detection(bbox[0] + bbox[2] / 2., bbox[1] + bbox[3] / 2.,
+                             {'bbox': tuple(bbox)})
+        if self.tracker is None:
+            return Detection(None, None, {})
+        ok, bbox = self.tracker.update(frame)
+        if not ok:
+            return Detection(None, None, {})
+        return Detection(bbox[0] + bbox[2] / 2., bbox[1] + bbox[3] / 2.,
+                         {'bbox': tuple(bbox)})
+
+    def clear(self):
+        self.tracker = None
+
+
+class DetectorMetrics(object):
+    '''
+    Collects the processing time of each call of each backend, the fraction
+    of frames where the object was found, and the distance between the
+    positions found by a backend and by the reference (active) backend, when
+    backends are compared on the same frames.
+
+    Parameters
+    ----------
+    window : int, optional
+        The number of recent calls used for the time statistics.
+    '''
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._count = collections.Counter()
+            self._found = collections.Counter()
+            self._times = collections.defaultdict(
+                lambda: collections.deque(maxlen=self.window))
+            self._deviations = collections.defaultdict(
+                lambda: collections.deque(maxlen=self.window))
+
+    def record(self, name, duration, found, deviation=None):
+        '''
+        Records a call of a backend.
+
+        Parameters
+        ----------
+        name : str
+            The name of the backend.
+        duration : float
+            The processing time in s.
+        found : bool
+            Whether the object was found.
+        deviation : float, optional
+            The distance (in pixels) to the position found by the reference
+            backend.
+        '''
+        with self._lock:
+            self._count[name] += 1
+            if found:
+                self._found[name] += 1
+            self._times[name].append(duration)
+            if deviation is not None:
+                self._deviations[name].append(deviation)
+
+    def summary(self):
+        '''
+        The statistics of each backend, as a dictionary with the number of
+        calls (``count``), the fraction of calls where the object was found
+        (``found``), the mean, median and maximal processing time in s over
+        recent calls (``mean_time``, ``median_time``, ``max_time``), and the
+        median deviation from the reference backend (``deviation``, ``None``
+        if not compared).
+        '''
+        with self._lock:
+            summary = collections.OrderedDict()
+            for name in sorted(self._count):
+                times = np.array(self._times[name])
+                deviations = self._deviations[name]
+                summary[name] = {'count': self._count[name],
+                                 'found': self._found[name] / float(self._count[name]),
+                                 'mean_time': times.mean(),
+                                 'median_time': np.median(times),
+                                 'max_time': times.max(),
+                                 'deviation': np.median(deviations) if deviations else None}
+            return summary
+
+    def report(self):
+        '''
+        The statistics as a human-readable table.
+        '''
+        lines = []
+        for name, stats in self.summary().items():
+            deviation = stats['deviation']
+            lines.append('{}: {} calls, found {:.0%}, {:.1f} ms (median {:.1f} ms, '
+                         'max {:.1f} ms){}'.format(name, stats['count'], stats['found'],
+                                                   stats['mean_time'] * 1000,
+                                                   stats['median_time'] * 1000,
+                                                   stats['max_time'] * 1000,
+                                                   '' if deviation is None else
+                                                   ', deviation {:.1f} px'.format(deviation)))
+        return '\n'.join(lines)
+
+
+class DetectorRegistry(object):
+    '''
+    A set of interchangeable detector backends, one of which is active.
+    Backends are registered with a factory and created on first use; every
+    call is timed and recorded in `metrics`.
+
+    When ``compare`` is set, each frame is also processed by all other
+    backends, to compare them under the same load; only
+    the result of the active backend is returned.
+
+    Parameters
+    ----------
+    metrics : `DetectorMetrics`, optional
+        The metrics collector (by default, a new one).
+    '''
+    def __init__(self, metrics=None):
+        if metrics is None:
+            metrics = DetectorMetrics()
+        self.metrics = metrics
+        self.compare = False
+        self.active = None
+        self._factories = collections.OrderedDict()
+        self._detectors = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, select=False):
+        '''
+        Registers a backend.
+
+        Parameters
+        ----------
+        name : str
+            The name of the backend.
+        factory : callable
+            Creates the `Detector` (called without arguments).
+        select : bool, optional
+            Whether to make it the active backend (the first registered backend
+            is active by default).
+        '''
+        with self._lock:
+            self._factories[name] = factory
+            self._detectors.pop(name, None)
+            if select or self.active is None:
+                self.active = name
+
+    def names(self):
+        return list(self._factories)
+
+    def get(self, name=None):
+        '''
+        The backend with the given name (the active one by default).
+        '''
+        with self._lock:
+            if name is None:
+                name = self.active
+            if name not in self._detectors:
+                self._detectors[name] = self._factories[name]()
+            return self._detectors[name]
+
+    def select(self, name):
+        '''
+        Makes a backend active (and creates it).
+        '''
+        with self._lock:
+            if name not in self._factories:
+                raise KeyError('No detector backend "{}"'.format(name))
+            self.active = name
+            self.get(name)
+
+    def select_next(self):
+        '''
+        Makes the next registered backend active.
+
+        Returns
+        -------
+        name : str
+            The name of the new active backend.
+        '''
+        with self._lock:
+            names = self.names()
+            self.select(names[(names.index(self.active) + 1) % len(names)])
+            return self.active
+
+    def clear(self):
+        '''
+        Clears the state of all backends.
+        '''
+        with self._lock:
+            for detector in self._detectors.values():
+                detector.clear()
+
+    def _timed_process(self, name, frame, roi, state):
+        start = time.time()
+        detection = self.get(name).process(frame, roi, state)
+        return detection, time.time() - start
+
+    def process(self, frame, roi=None, state=None):
+        '''
+        Processes a frame with the active backend (see `Detector.process`).
+        '''
+        if state is None:
+            state = {}
+        with self._lock:
+            name = self.active
+            detection, duration = self._timed_process(name, frame, roi, state)
+            self.metrics.record(name, duration, detection.x is not None)
+            if self.compare:
+                for other in self.names():
+                    if other == name:
+                        continue
+                    # Each backend gets its own copy of the hints
+                    result, duration = self._timed_process(other, frame, roi, dict(state))
+                    deviation = None
+                    if result.x is not None and detection.x is not None:
+                        deviation = np.hypot(result.x - detection.x, result.y - detection.y)
+                    self.metrics.record(other, duration, result.x is not None, deviation)
+        return detection
@@ -0,0 +1,228 @@
+'''
+Localization of droplets: detection with the Hough transform, then
+incremental tracking of the droplet boundary with a radial profile fit around
+the last known circle.
+'''
+from __future__ import absolute_import
+import warnings
+
+try:
+    import cv2
+except:
+    warnings.warn('OpenCV not available')
+import numpy as np
+
+__all__ = ['detect_droplets', 'refine_circle', 'DropletTracker']
+
+
+def _grayscale(frame):
+    if frame.ndim == 3:
+        return frame[:, :, 0]
+    return frame
+
+
+def detect_droplets(frame, pixel_per_um=5., ratio=None):
+    '''
+    Detects droplets (circles of radius 200-1000 µm) with the Hough
+    transform.
+
+    Arguments
+    ---------
+    frame : the image
+    pixel_per_um : number of pixels per um
+    ratio : decimating ratio (to make the image smaller)
+
+    Returns
+    -------
+    circles : array of (x, y, r) rows, in pixels of the original image
+    '''
+    frame = _grayscale(frame)
+    height, width = frame.shape[:2]
+    if ratio is None:
+        ratio = max(width // 256, 1)
+    resized = cv2.resize(frame, (width // ratio, height // ratio))
+    pixel_per_um = pixel_per_um / ratio
+
+    # Filter
+    blur_size = int(pixel_per_um * 10)
+    if blur_size % 2 == 0:
+        blur_size += 1
+    filtered = cv2.GaussianBlur(resized, (blur_size, blur_size), 0)
+    if filtered.dtype != np.uint8:
+        filtered = cv2.normalize(filtered, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+    circles = cv2.HoughCircles(filtered, cv2.HOUGH_GRADIENT, 1, max(int(400 * pixel_per_um), 1),
+                               param1=max(int(50 / pixel_per_um), 1), param2=30,
+                               minRadius=int(200 * pixel_per_um),
+                               maxRadius=int(1000 * pixel_per_um))
+    if circles is None:
+        return np.zeros((0, 3))
+    return circles[0, :, :3] * ratio
+
+
+def _fit_circle(x, y):
+    # Algebraic (Kasa) fit: x^2 + y^2 + D*x + E*y + F = 0
+    A = np.column_stack([x, y, np.ones_like(x)])
+    (D, E, F), _, _, _ = np.linalg.lstsq(A, -(x**2 + y**2), rcond=None)
+    xc, yc = -D / 2., -E / 2.
+    return xc, yc, np.sqrt(max(xc**2 + yc**2 - F, 0.))
+
+
+def refine_circle(frame, circle, band=0.1, n_angles=64, n_samples=32,
+                  min_inliers=0.6):
+    '''
+    Refines the position of a circular boundary, from intensity profiles
+    along rays around a previous estimate. The boundary on each ray is the
+    point of steepest intensity change (if it stands out from the rest of the
+    profile); a circle is then fitted to these points (with outlier
+    rejection).
+
+    Parameters
+    ----------
+    frame : `~numpy.ndarray`
+        The image.
+    circle : tuple
+        The previous estimate ``(x, y, r)``.
+    band : float, optional
+        The searched band around the previous boundary, as a fraction of the
+        radius.
+    n_angles : int, optional
+        The number of rays.
+    n_samples : int, optional
+        The number of samples along each ray.
+    min_inliers : float, optional
+        Minimum fraction of rays consistent with the fitted circle.
+
+    Returns
+    -------
+    circle : tuple or None
+        The refined circle ``(x, y, r)``, or ``None`` if the fit failed (the
+        boundary was not found, or moved out of the searched band).
+    '''
+    frame = _grayscale(frame)
+    x, y, r = [float(v) for v in circle]
+    width = max(band * r, 3.)
+    angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
+    radii = np.linspace(r - width, r + width, n_samples)
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    sample_x = x + radii[None, :] * cos
+    sample_y = y + radii[None, :] * sin
+    # Rays (partly) out of the image are ignored
+    height, image_width = frame.shape[:2]
+    valid = ((sample_x.min(axis=1) >= 0) & (sample_x.max(axis=1) < image_width - 1) &
+             (sample_y.min(axis=1) >= 0) & (sample_y.max(axis=1) < height - 1))
+    if valid.sum() < min_inliers * n_angles:
+        return None
+    # Bilinear interpolation, only at the sampled points
+    sample_x, sample_y = sample_x[valid], sample_y[valid]
+    i, j = sample_y.astype(int), sample_x.astype(int)
+    dy, dx = sample_y - i, sample_x - j
+    profiles = ((frame[i, j] * (1 - dx) + frame[i, j + 1] * dx) * (1 - dy) +
+                (frame[i + 1, j] * (1 - dx) + frame[i + 1, j + 1] * dx) * dy)
+    # Smoothed radial derivative
+    smoothed = (profiles[:, :-2] + profiles[:, 1:-1] + profiles[:, 2:]) / 3.
+    gradient = np.abs(np.diff(smoothed, axis=1))
+    edge = np.argmax(gradient, axis=1)
+    # Rays without a clear edge are ignored
+    peak = gradient[np.arange(len(edge)), edge]
+    strong = peak > 4. * np.median(gradient, axis=1)
+    edge_radii = (radii[edge + 1] + radii[edge + 2]) / 2.
+    edge_x = (x + edge_radii * cos[valid, 0])[strong]
+    edge_y = (y + edge_radii * sin[valid, 0])[strong]
+    if len(edge_x) < min_inliers * n_angles:
+        return None
+    # Robust fit: reject the rays far from a first fit
+    inliers = np.ones(len(edge_x), dtype=bool)
+    for _ in range(2):
+        fitted = _fit_circle(edge_x[inliers], edge_y[inliers])
+        distance = np.abs(np.hypot(edge_x - fitted[0], edge_y - fitted[1]) - fitted[2])
+        inliers = distance <= max(2. * np.median(distance[inliers]), 1.)
+        if inliers.sum() < min_inliers * n_angles:
+            return None
+    fitted = _fit_circle(edge_x[inliers], edge_y[inliers])
+    if (abs(fitted[2] - r) > width or
+            np.hypot(fitted[0] - x, fitted[1] - y) > width):
+        return None
+    return fitted
+
+
+class DropletTracker(object):
+    '''
+    Locates droplets in a stream of images. Droplets are detected with the
+    Hough transform (`detect_droplets`) when needed; known droplets are
+    stored relative to the stage, and followed from frame to frame with
+    `refine_circle`, which is much cheaper.
+
+    Parameters
+    ----------
+    pixel_per_um : float, optional
+        The number of pixels per µm.
+    ratio : int, optional
+        Decimating ratio for the Hough transform.
+    band : float, optional
+        The searched band around the previous boundary (see `refine_circle`).
+    '''
+    def __init__(self, pixel_per_um=5., ratio=None, band=0.1):
+        self.pixel_per_um = pixel_per_um
+        self.ratio = ratio
+        self.band = band
+        # Known droplets as (x, y, r), with (x, y) relative to the stage
+        self.droplets = []
+
+    def clear(self):
+        '''
+        Forgets all droplets.
+        '''
+        self.droplets = []
+
+    def _add(self, circle):
+        # Adds a droplet, or replaces a known droplet at the same place
+        for i, (x, y, r) in enumerate(self.droplets):
+            if np.hypot(circle[0] - x, circle[1] - y) < r / 2.:
+                self.droplets[i] = circle
+                return i
+        self.droplets.append(circle)
+        return len(self.droplets) - 1
+
+    def locate(self, frame, stage_position=None, xc=None, yc=None):
+        '''
+        Locates the droplet enclosing a point.
+
+        Arguments
+        ---------
+        frame : the image
+        stage_position : position of the stage in the reference system, i.e.
+                         the position of the image center relative to the
+                         stage (by default, the stage is assumed not to move)
+        xc, yc : coordinate of a point inside the droplet (by default, the
+                 image center)
+
+        Returns
+        -------
+        x, y, r : position and radius on screen
+        '''
+        height, width = frame.shape[:2]
+        if xc is None:
+            xc, yc = width / 2., height / 2.
+        # Screen position = position relative to the stage + stage position
+        offset = np.zeros(2)
+        if stage_position is not None:
+            offset = np.asarray(stage_position[:2], dtype=float)
+        # Follow a known droplet
+        candidates = [(np.hypot(x + offset[0] - xc, y + offset[1] - yc), i)
+                      for i, (x, y, r) in enumerate(self.droplets)
+                      if np.hypot(x + offset[0] - xc, y + offset[1] - yc) < r]
+        for _, i in sorted(candidates):
+            x, y, r = self.droplets[i]
+            refined = refine_circle(frame, (x + offset[0], y + offset[1], r),
+                                    band=self.band)
+            if refined is not None:
+                x, y, r = refined
+                self.droplets[i] = (x - offset[0], y - offset[1], r)
+                return x, y, r
+        # Detect droplets
+        for x, y, r in detect_droplets(frame, self.pixel_per_um, self.ratio):
+            self._add((x - offset[0], y - offset[1], r))
+            if (x - xc)**2 + (y - yc)**2 < r**2:
+                return x, y, r
+        return None, None, None
@@ -0,0 +1,322 @@
+'''
+Large image mosaics assembled tile by tile, stored on disk.
+
+The mosaic is stored as a pyramid of memory-mapped arrays: level 0 has the full
+resolution, each following level is downsampled by a factor of 2 (for fast
+display of large fields). Tiles are blended into the mosaic as they arrive
+(feathering: each pixel is weighted by its distance to the tile border), so
+that only the region covered by the current tile is touched in memory.
+'''
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .phase_cross_correlation import phase_cross_correlation, _window
+
+__all__ = ['Mosaic']
+
+
+def _feather_weights(shape, width):
+    '''
+    Blending weights of a tile: 1 in the center, decreasing linearly over
+    ``width`` pixels towards the borders (but never 0).
+    '''
+    weights = []
+    for n in shape:
+        distance = np.minimum(np.arange(n), np.arange(n)[::-1]) + 1.
+        weights.append(np.clip(distance / max(width, 1), 0, 1))
+    return np.outer(weights[0], weights[1]).astype(np.float32)
+
+
+def _subpixel_shift(tile, dy, dx):
+    '''
+    Shifts the content of a tile by a fraction of a pixel (``0 <= dy, dx <
+    1``) along each axis, with linear interpolation (border pixels are
+    repeated).
+    '''
+    tile = np.asarray(tile, dtype=np.float32)
+    if dy > 0:
+        tile = (1 - dy) * tile + dy * np.concatenate([tile[:1], tile[:-1]], axis=0)
+    if dx > 0:
+        tile = (1 - dx) * tile + dx * np.concatenate([tile[:, :1], tile[:, :-1]], axis=1)
+    return tile
+
+
+def _overlap_rectangle(covered):
+    '''
+    A large rectangle (as a tuple of slices) within the covered area of a tile.
+    The overlap of a tile is typically a strip along one or two of its
+    borders, with jagged edges when the neighbouring tiles are not aligned.
+    '''
+    best, best_area = None, 0
+    for axis in (0, 1):
+        # Lines (rows or columns) well covered along the strip direction
+        counts = covered.sum(axis=axis)
+        lines = counts >= 0.5 * counts.max()
+        # Extent of the strip where all these lines are covered
+        if axis == 0:
+            across = np.flatnonzero(covered[:, lines].all(axis=1))
+        else:
+            across = np.flatnonzero(covered[lines, :].all(axis=0))
+        if not len(across):
+            continue
+        across = slice(across[0], across[-1] + 1)
+        if axis == 0:
+            along = np.flatnonzero(covered[across, :].all(axis=0))
+        else:
+            along = np.flatnonzero(covered[:, across].all(axis=1))
+        if not len(along):
+            continue
+        along = slice(along[0], along[-1] + 1)
+        box = (across, along) if axis == 0 else (along, across)
+        area = (box[0].stop - box[0].start) * (box[1].stop - box[1].start)
+        if area > best_area and covered[box].all():
+            best, best_area = box, area
+    return best
+
+
+class Mosaic(object):
+    '''
+    An image mosaic stored as a pyramid of memory-mapped arrays.
+
+    Parameters
+    ----------
+    shape : tuple
+        The ``(height, width)`` of the full resolution mosaic, in pixels.
+    directory : str, optional
+        The directory where the arrays are stored (``level0.dat``,
+        ``level1.dat``, ... and ``weights.dat``). By default, a temporary
+        directory is used and deleted by `close` (called at the end of a
+        ``with`` block, or when the mosaic is garbage collected).
+    levels : int, optional
+        The number of levels of the pyramid (by default, levels are added
+        until the smallest one fits in 1024 pixels).
+    feather : int, optional
+        The width (in pixels) of the blending ramp at the tile borders,
+        typically the overlap between tiles.
+    dtype : dtype, optional
+        The data type of the stored image.
+    '''
+    def __init__(self, shape, directory=None, levels=None, feather=32,
+                 dtype=np.float32):
+        self.shape = tuple(int(s) for s in shape)
+        if levels is None:
+            levels = 1
+            while max(self.shape) > 1024 * 2**(levels - 1):
+                levels += 1
+        self._temporary = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='holypipette-mosaic-')
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.feather = feather
+        self.levels = []
+        for level in range(int(levels)):
+            level_shape = tuple(max(s >> level, 1) for s in self.shape)
+            self.levels.append(np.memmap(os.path.join(directory, 'level{}.dat'.format(level)),
+                                         dtype=dtype, mode='w+', shape=level_shape))
+        # Sum of blending weights at each pixel (0 where nothing was acquired)
+        self.weights = np.memmap(os.path.join(directory, 'weights.dat'),
+                                 dtype=np.float32, mode='w+', shape=self.shape)
+        self._tile_weights = {}  # tile shape -> feathering weights
+
+    def _clip(self, y, x, shape):
+        # Intersection of a tile placed at (y, x) with the mosaic, as slices
+        # in the mosaic and in the tile
+        y0, x0 = max(y, 0), max(x, 0)
+        y1, x1 = min(y + shape[0], self.shape[0]), min(x + shape[1], self.shape[1])
+        if y1 <= y0 or x1 <= x0:
+            return None
+        return ((slice(y0, y1), slice(x0, x1)),
+                (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)))
+
+    def coverage(self, position, shape):
+        '''
+        The fraction of a tile of the given shape, placed at ``position``,
+        that overlaps with already acquired tiles.
+        '''
+        x, y = [int(round(p)) for p in position]
+        slices = self._clip(y, x, shape)
+        if slices is None:
+            return 0.
+        return np.count_nonzero(self.weights[slices[0]]) / float(shape[0] * shape[1])
+
+    def register(self, tile, position, max_shift=None, min_overlap=0.05,
+                 upsample_factor=10):
+        '''
+        Refines the position of a tile by phase correlation of its overlap
+        with the already acquired tiles.
+
+        Parameters
+        ----------
+        tile : `~numpy.ndarray`
+            The tile.
+        position : tuple
+            The expected ``(x, y)`` position of the tile's top left corner in
+            the mosaic.
+        max_shift : float, optional
+            Corrections larger than this (in pixels) are rejected (by default,
+            a quarter of the overlap size).
+        min_overlap : float, optional
+            Minimum fraction of the tile overlapping acquired tiles.
+        upsample_factor : int, optional
+            Subpixel precision (see `phase_cross_correlation`).
+
+        Returns
+        -------
+        position : tuple
+            The refined ``(x, y)`` position (the expected position if the
+            overlap is too small or the correction is rejected).
+        '''
+        refined = position
+        # A second pass uses the overlap at the refined position, which
+        # reduces the bias due to the parts of the overlap not seen in both
+        for _ in range(2):
+            result = self._registration_shift(tile, refined, min_overlap,
+                                              upsample_factor)
+            if result is None:
+                break
+            x, y, shifts, overlap_size = result
+            limit = max_shift
+            if limit is None:
+                limit = max(overlap_size / 4., 1)
+            # The content of the tile is at the (rounded) position + shifts in
+            # the mosaic
+            candidate = (x + shifts[1], y + shifts[0])
+            if max(abs(candidate[0] - position[0]), abs(candidate[1] - position[1])) > limit:
+                break
+            refined = candidate
+            if (int(round(refined[0])), int(round(refined[1]))) == (x, y):
+                break
+        return refined
+
+    def _registration_shift(self, tile, position, min_overlap, upsample_factor):
+        # Shift of the tile at the rounded position, from the overlap with the
+        # acquired tiles: (x, y, shifts, overlap size), or None if the overlap
+        # is too small
+        x, y = [int(round(p)) for p in position]
+        slices = self._clip(y, x, tile.shape)
+        if slices is None:
+            return None
+        mosaic_slices, tile_slices = slices
+        covered = self.weights[mosaic_slices] > 0
+        if np.count_nonzero(covered) < min_overlap * tile.shape[0] * tile.shape[1]:
+            return None
+        box = _overlap_rectangle(covered)
+        if box is None:
+            return None
+        reference = np.asarray(self.levels[0][mosaic_slices][box], dtype=float)
+        moving = np.asarray(tile[tile_slices][box], dtype=float)
+        if min(reference.shape) < 8:
+            return None
+        # The window reduces the bias of subpixel estimates on narrow strips
+        window = _window(reference.shape)
+        shifts = phase_cross_correlation((reference - reference.mean()) * window,
+                                         (moving - moving.mean()) * window,
+                                         upsample_factor=upsample_factor,
+                                         return_error=False)
+        return x, y, shifts, min(reference.shape)
+
+    def add_tile(self, tile, position):
+        '''
+        Blends a tile into the mosaic and updates the downsampled levels.
+
+        Parameters
+        ----------
+        tile : `~numpy.ndarray`
+            The tile (2D array).
+        position : tuple
+            The ``(x, y)`` position of the tile's top left corner in the mosaic
+            (fractional positions are interpolated).
+        '''
+        x, y = [int(np.floor(p)) for p in position]
+        tile = _subpixel_shift(tile, position[1] - y, position[0] - x)
+        slices = self._clip(y, x, tile.shape)
+        if slices is None:
+            return
+        mosaic_slices, tile_slices = slices
+        if tile.shape not in self._tile_weights:
+            self._tile_weights[tile.shape] = _feather_weights(tile.shape, self.feather)
+        weight = self._tile_weights[tile.shape][tile_slices]
+        previous_weight = self.weights[mosaic_slices]
+        total = previous_weight + weight
+        image = self.levels[0]
+        image[mosaic_slices] = ((image[mosaic_slices] * previous_weight +
+                                 tile[tile_slices] * weight) / total)
+        self.weights[mosaic_slices] = total
+        self._update_levels(mosaic_slices)
+
+    def _update_levels(self, region):
+        (y0, y1), (x0, x1) = [(s.start, s.stop) for s in region]
+        for level in range(1, len(self.levels)):
+            # Region of this level affected by the change (rounded outwards)
+            y0, x0 = y0 // 2, x0 // 2
+            y1, x1 = (y1 + 1) // 2, (x1 + 1) // 2
+            target = self.levels[level]
+            y1, x1 = min(y1, target.shape[0]), min(x1, target.shape[1])
+            source = self.levels[level - 1][2*y0:2*y1, 2*x0:2*x1]
+            if source.shape[0] < 2*(y1 - y0) or source.shape[1] < 2*(x1 - x0):
+                # Odd size at the border: only use full 2x2 blocks
+                y1, x1 = y0 + source.shape[0] // 2, x0 + source.shape[1] // 2
+                source = source[:2*(y1 - y0), :2*(x1 - x0)]
+            target[y0:y1, x0:x1] = source.reshape(y1 - y0, 2, x1 - x0, 2).mean(axis=(1, 3))
+
+    def level_for(self, scale):
+        '''
+        The pyramid level best suited to display the mosaic at ``scale``
+        (displayed pixels per mosaic pixel).
+        '''
+        if scale <= 0:
+            return len(self.levels) - 1
+        level = int(np.floor(-np.log2(min(scale, 1.))))
+        return min(level, len(self.levels) - 1)
+
+    def region(self, x0, y0, x1, y1, level=0):
+        '''
+        A region of the mosaic, given in full resolution coordinates, at the
+        given pyramid level.
+        '''
+        image = self.levels[level]
+        return np.asarray(image[max(y0, 0) >> level:max(y1, 0) >> level,
+                                max(x0, 0) >> level:max(x1, 0) >> level])
+
+    @property
+    def image(self):
+        '''
+        The full resolution mosaic (memory-mapped).
+        '''
+        return self.levels[0]
+
+    def flush(self):
+        '''
+        Writes all changes to disk.
+        '''
+        for image in self.levels + [self.weights]:
+            image.flush()
+
+    def close(self):
+        '''
+        Closes the files (and deletes them if the mosaic is temporary).
+        '''
+        if self.weights is None:  # already closed
+            return
+        self.flush()
+        self.levels = []
+        self.weights = None
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Do not leave temporary files behind
+        if getattr(self, 'weights', None) is not None and self._temporary:
+            self.close()
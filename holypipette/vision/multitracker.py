@@ -0,0 +1,248 @@
+'''
+Tracking of multiple objects with correlation filters (MOSSE), updated for
+all objects at once.
+'''
+from __future__ import absolute_import
+import threading
+
+import numpy as np
+
+from .phase_cross_correlation import _window
+
+__all__ = ['CorrelationMultiTracker']
+
+
+def _parabola_offset(minus, center, plus):
+    # Position of the maximum of the parabola through three points at -1, 0, 1
+    curvature = minus - 2 * center + plus
+    valid = curvature < 0
+    return np.where(valid, 0.5 * (minus - plus) / np.where(valid, curvature, -1.), 0.)
+
+
+class CorrelationMultiTracker(object):
+    '''
+    Tracks several objects with adaptive correlation filters (MOSSE, Bolme et
+    al., 2010). All objects use search windows of the same shape, so that the
+    filters are stored as a single array: each frame is preprocessed once, the
+    windows of all objects are extracted with a single indexing operation, and
+    all correlations are computed in one batched FFT.
+
+    The filters are updated with a learning rate that depends on the
+    confidence of the detection (its peak-to-sidelobe ratio, PSR): they are
+    not updated when the object is lost (PSR below ``min_psr``), and updated
+    with the full rate above ``update_psr``. Lost objects are searched again at
+    their last position, corrected for the movement of the stage if the stage
+    position is given to `update`.
+
+    Parameters
+    ----------
+    padding : float, optional
+        The size of the search window, relative to the size of the first
+        bounding box.
+    sigma : float, optional
+        The width (in pixels) of the desired correlation peak.
+    learning_rate : float, optional
+        The maximal learning rate of the filters.
+    min_psr : float, optional
+        Objects with a lower PSR are considered as lost.
+    update_psr : float, optional
+        PSR for the maximal learning rate.
+    regularization : float, optional
+        Regularization of the filters, relative to the mean power of the
+        training windows.
+
+    Objects can be added or removed from another thread than the one calling
+    `update` (e.g. a GUI command while frames are processed).
+    '''
+    def __init__(self, padding=2., sigma=2., learning_rate=0.125, min_psr=6.,
+                 update_psr=10., regularization=0.01):
+        self.padding = padding
+        self.sigma = sigma
+        self.learning_rate = learning_rate
+        self.min_psr = min_psr
+        self.update_psr = update_psr
+        self.regularization = regularization
+        self.shape = None  # shape of the search windows
+        self.keys = []
+        self.centers = np.zeros((0, 2))  # object centers (x, y) on screen
+        self.sizes = np.zeros((0, 2))  # bounding box sizes (width, height)
+        self.found = np.zeros(0, dtype=bool)
+        self.psr = np.zeros(0)
+        self._numerator = self._denominator = None  # the filters are their ratio
+        self._target = None  # spectrum of the desired correlation output
+        self._stage_position = None
+        self._next_key = 0
+        if not hasattr(self, '_lock'):
+            self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _initialize(self, size):
+        height, width = [int(16 * np.ceil(max(s * self.padding, 32) / 16.)) for s in size[::-1]]
+        self.shape = (height, width)
+        # Gaussian peak at zero displacement (index 0, with wraparound)
+        dy = (np.arange(height) + height // 2) % height - height // 2
+        dx = (np.arange(width) + width // 2) % width - width // 2
+        peak = np.exp(-(dy[:, None]**2 + dx[None, :]**2) / (2. * self.sigma**2))
+        self._target = np.fft.rfft2(peak)
+        self._numerator = np.zeros((0,) + self._target.shape, dtype=complex)
+        self._denominator = np.zeros((0,) + self._target.shape)
+
+    def _spectra(self, frame, centers):
+        # Real FFTs of the normalized, windowed search windows around the
+        # centers (only the windows are preprocessed, not the full frame)
+        height, width = self.shape
+        top = np.round(centers[:, 1]).astype(int) - height // 2
+        left = np.round(centers[:, 0]).astype(int) - width // 2
+        rows = np.clip(top[:, None] + np.arange(height), 0, frame.shape[0] - 1)
+        columns = np.clip(left[:, None] + np.arange(width), 0, frame.shape[1] - 1)
+        windows = frame[rows[:, :, None], columns[:, None, :]]
+        if windows.ndim == 4:
+            windows = windows.mean(axis=3)
+        windows = np.log1p(windows.astype(np.float32))
+        windows -= windows.mean(axis=(1, 2), keepdims=True)
+        windows /= windows.std(axis=(1, 2), keepdims=True) + 1e-5
+        windows *= _window(self.shape)
+        return np.fft.rfft2(windows)
+
+    def add(self, frame, bbox):
+        '''
+        Starts tracking an object.
+
+        Parameters
+        ----------
+        frame : `~numpy.ndarray`
+            The image.
+        bbox : tuple
+            The bounding box ``(x, y, width, height)`` of the object.
+
+        Returns
+        -------
+        key : int
+            The key of the object.
+        '''
+        with self._lock:
+            x, y, width, height = [float(v) for v in bbox]
+            if self.shape is None:
+                self._initialize((width, height))
+            center = np.array([[x + width / 2., y + height / 2.]])
+            spectrum = self._spectra(frame, center)
+            self._numerator = np.concatenate([self._numerator,
+                                              self._target * np.conj(spectrum)])
+            self._denominator = np.concatenate([self._denominator,
+                                                (spectrum * np.conj(spectrum)).real])
+            key = self._next_key
+            self._next_key += 1
+            self.keys.append(key)
+            self.centers = np.vstack([self.centers, center])
+            self.sizes = np.vstack([self.sizes, [[width, height]]])
+            self.found = np.append(self.found, True)
+            self.psr = np.append(self.psr, np.inf)
+            return key
+
+    def remove(self, key):
+        '''
+        Stops tracking an object.
+        '''
+        with self._lock:
+            index = self.keys.index(key)
+            del self.keys[index]
+            self.centers = np.delete(self.centers, index, axis=0)
+            self.sizes = np.delete(self.sizes, index, axis=0)
+            self.found = np.delete(self.found, index)
+            self.psr = np.delete(self.psr, index)
+            self._numerator = np.delete(self._numerator, index, axis=0)
+            self._denominator = np.delete(self._denominator, index, axis=0)
+
+    def clear(self):
+        '''
+        Stops tracking all objects.
+        '''
+        with self._lock:
+            self.__init__(self.padding, self.sigma, self.learning_rate, self.min_psr,
+                          self.update_psr, self.regularization)
+
+    def _peaks(self, responses, exclusion=5):
+        # Subpixel displacement of the correlation peaks and their PSR
+        n, height, width = responses.shape
+        flat = responses.reshape(n, -1)
+        index = np.argmax(flat, axis=1)
+        py, px = np.unravel_index(index, (height, width))
+        objects = np.arange(n)
+        peak = flat[objects, index]
+        # Parabolic interpolation (with wraparound)
+        dy = _parabola_offset(responses[objects, (py - 1) % height, px], peak,
+                              responses[objects, (py + 1) % height, px])
+        dx = _parabola_offset(responses[objects, py, (px - 1) % width], peak,
+                              responses[objects, py, (px + 1) % width])
+        displacement = np.column_stack([(px + width // 2) % width - width // 2 + dx,
+                                        (py + height // 2) % height - height // 2 + dy])
+        # Peak-to-sidelobe ratio, the sidelobe excluding a region around the peak
+        rows = (py[:, None] + np.arange(-exclusion, exclusion + 1)) % height
+        columns = (px[:, None] + np.arange(-exclusion, exclusion + 1)) % width
+        excluded = responses[objects[:, None, None], rows[:, :, None], columns[:, None, :]]
+        count = height * width - excluded[0].size
+        total = flat.sum(axis=1) - excluded.sum(axis=(1, 2))
+        squares = (flat**2).sum(axis=1) - (excluded**2).sum(axis=(1, 2))
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean**2, 1e-12))
+        return displacement, (peak - mean) / std
+
+    def update(self, frame, stage_position=None):
+        '''
+        Locates all objects in a new frame.
+
+        Parameters
+        ----------
+        frame : `~numpy.ndarray`
+            The image.
+        stage_position : array, optional
+            The position of the stage in the reference system (in pixels, see
+            `.CalibratedStage.reference_position`). If given, the objects are
+            searched at their last position shifted by the movement of the
+            stage since the last update.
+
+        Returns
+        -------
+        ok : bool
+            Whether all objects were found.
+        boxes : `~numpy.ndarray`
+            The bounding boxes ``(x, y, width, height)`` of the objects (their
+            last known position for lost objects), one row per object.
+        '''
+        with self._lock:
+            if stage_position is not None:
+                stage_position = np.asarray(stage_position[:2], dtype=float)
+                if self._stage_position is not None:
+                    # Objects fixed relative to the stage move with it on screen
+                    self.centers += stage_position - self._stage_position
+                self._stage_position = stage_position
+            if not len(self):
+                return True, np.zeros((0, 4))
+            rounded = np.round(self.centers)
+            spectra = self._spectra(frame, rounded)
+            regularization = self.regularization * self._denominator.mean(axis=(1, 2), keepdims=True)
+            filters = self._numerator / (self._denominator + regularization)
+            responses = np.fft.irfft2(filters * spectra, s=self.shape)
+            displacement, self.psr = self._peaks(responses)
+            self.found = self.psr >= self.min_psr
+            self.centers[self.found] = rounded[self.found] + displacement[self.found]
+            # Confidence-dependent update of the filters, at the new positions
+            rates = self.learning_rate * np.clip((self.psr - self.min_psr) /
+                                                 (self.update_psr - self.min_psr), 0, 1)
+            update = rates > 0
+            if update.any():
+                spectra = self._spectra(frame, self.centers[update])
+                numerator, denominator = self._numerator[update], self._denominator[update]
+                r = rates[update][:, None, None]
+                self._numerator[update] = (1 - r) * numerator + r * self._target * np.conj(spectra)
+                self._denominator[update] = (1 - r) * denominator + r * (spectra * np.conj(spectra)).real
+            return bool(self.found.all()), self.boxes()
+
+    def boxes(self):
+        '''
+        The bounding boxes ``(x, y, width, height)`` of the objects.
+        '''
+        with self._lock:
+            return np.column_stack([self.centers - self.sizes / 2., self.sizes])
@@ -0,0 +1,292 @@
+'''
+Overview map of the preparation, assembled from images taken at different
+stage positions.
+
+Positions on the map ("map coordinates") are positions in the reference system
+(in pixels) of points fixed relative to the stage: a point at position ``p``
+in the image (relative to the image center) is at ``p - r_stage`` on the map,
+where ``r_stage`` is the stage's position in the reference system (see
+`.CalibratedStage.map_position`).
+'''
+from __future__ import absolute_import
+import collections
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from holypipette.geometry.gridindex import GridIndex
+
+__all__ = ['OverviewMap', 'MapTile']
+
+#: An image on the map, with its bounds ``(x0, y0, x1, y1)`` in map
+#: coordinates and its resolution pyramid (level ``i`` is downsampled by
+#: ``2**i``)
+MapTile = collections.namedtuple('MapTile', ['key', 'bounds', 'levels'])
+
+
+def _downsample(image):
+    height, width = image.shape[0] // 2, image.shape[1] // 2
+    return image[:2*height, :2*width].reshape(height, 2, width, 2).mean(axis=(1, 3))
+
+
+class OverviewMap(object):
+    '''
+    Images of the preparation in map coordinates, with a spatial index to find
+    the images at any position, and remembered positions ("marks", e.g.
+    cells).
+
+    Images are stored on disk as ``.npy`` files (loaded as memory maps), so
+    that the map can be much larger than the available memory.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory where the map is stored. If it contains a map, the map
+        is loaded. By default, a temporary directory is used (deleted by
+        `close`).
+    cell_size : float, optional
+        The cell size of the spatial index (in pixels), typically the size of
+        a field of view.
+    '''
+    def __init__(self, directory=None, cell_size=1024):
+        self._temporary = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='holypipette-overview-')
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.tiles = collections.OrderedDict()
+        self.marks = collections.OrderedDict()
+        self.index = GridIndex(cell_size)
+        self._next_key = 0
+        self.load()
+
+    @property
+    def _index_filename(self):
+        return os.path.join(self.directory, 'overview.pickle')
+
+    def load(self):
+        '''
+        Loads the map stored in the directory (if any).
+        '''
+        if not os.path.exists(self._index_filename):
+            return
+        with open(self._index_filename, 'rb') as f:
+            state = pickle.load(f)
+        self.marks = collections.OrderedDict(state['marks'])
+        self._next_key = state['next_key']
+        for key, bounds, filenames in state['tiles']:
+            levels = [np.load(os.path.join(self.directory, filename), mmap_mode='r')
+                      for filename in filenames]
+            self._insert(MapTile(key, bounds, levels))
+
+    def save(self):
+        '''
+        Saves the list of tiles and the marks (the images are saved when they
+        are added).
+        '''
+        tiles = [(tile.key, tile.bounds,
+                  [os.path.basename(level.filename) for level in tile.levels])
+                 for tile in self.tiles.values()]
+        with open(self._index_filename, 'wb') as f:
+            pickle.dump({'tiles': tiles, 'marks': list(self.marks.items()),
+                         'next_key': self._next_key}, f)
+
+    def _insert(self, tile):
+        self.tiles[tile.key] = tile
+        self.index.insert(tile.key, tile.bounds)
+
+    def _store_level(self, key, level, image, rows=256):
+        # Copies the image into a .npy file by blocks of rows (the image can be
+        # a memory map larger than the available memory)
+        filename = os.path.join(self.directory, 'tile{}_level{}.npy'.format(key, level))
+        stored = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                                           shape=image.shape)
+        for row in range(0, image.shape[0], rows):
+            stored[row:row+rows] = image[row:row+rows]
+        stored.flush()
+        return np.load(filename, mmap_mode='r')
+
+    def add_image(self, image, position, levels=None, min_size=64):
+        '''
+        Adds an image to the map.
+
+        Parameters
+        ----------
+        image : `~numpy.ndarray`
+            The image (2D array).
+        position : tuple
+            The map coordinates ``(x, y)`` of the image's top left corner.
+        levels : list of `~numpy.ndarray`, optional
+            The downsampled versions of the image (each level downsampled by 2
+            with respect to the previous one), e.g. from a `.Mosaic`. By
+            default, they are calculated from the image.
+        min_size : int, optional
+            When levels are calculated, the smallest level is the first one
+            smaller than ``min_size`` pixels.
+
+        Returns
+        -------
+        tile : `MapTile`
+        '''
+        key = self._next_key
+        self._next_key += 1
+        if levels is None:
+            levels = [image]
+            while min(levels[-1].shape) >= 2 * min_size:
+                levels.append(_downsample(np.asarray(levels[-1], dtype=np.float32)))
+        else:
+            levels = [image] + list(levels)
+        stored = [self._store_level(key, i, level) for i, level in enumerate(levels)]
+        x, y = position
+        height, width = image.shape[:2]
+        tile = MapTile(key, (float(x), float(y), float(x + width), float(y + height)),
+                       stored)
+        self._insert(tile)
+        self.save()
+        return tile
+
+    def add_mosaic(self, mosaic, position):
+        '''
+        Adds a `.Mosaic` to the map (the images are copied to the map's
+        directory).
+
+        Parameters
+        ----------
+        mosaic : `.Mosaic`
+            The mosaic.
+        position : tuple
+            The map coordinates ``(x, y)`` of the mosaic's top left corner.
+        '''
+        return self.add_image(mosaic.levels[0], position, levels=mosaic.levels[1:])
+
+    def remove(self, key):
+        tile = self.tiles.pop(key)
+        self.index.remove(key)
+        for filename in [level.filename for level in tile.levels]:
+            try:
+                os.remove(filename)
+            except OSError:  # e.g. still mapped on Windows
+                pass
+        self.save()
+
+    def clear(self):
+        '''
+        Removes all images and marks.
+        '''
+        for key in list(self.tiles):
+            self.remove(key)
+        self.marks.clear()
+        self.save()
+
+    def tiles_at(self, position):
+        '''
+        The tiles containing a position, the most recent first.
+        '''
+        return [self.tiles[key] for key in reversed(self.index.query_point(*position))]
+
+    def bounds(self):
+        '''
+        The bounds ``(x0, y0, x1, y1)`` of all tiles (``None`` if the map is
+        empty).
+        '''
+        if not self.tiles:
+            return None
+        bounds = np.array([tile.bounds for tile in self.tiles.values()])
+        return (bounds[:, 0].min(), bounds[:, 1].min(),
+                bounds[:, 2].max(), bounds[:, 3].max())
+
+    def render(self, region, shape):
+        '''
+        Renders a region of the map, using for each tile the pyramid level
+        closest to the requested resolution. More recent tiles are drawn on
+        top of older ones.
+
+        Parameters
+        ----------
+        region : tuple
+            The region ``(x0, y0, x1, y1)`` in map coordinates.
+        shape : tuple
+            The ``(height, width)`` of the rendered image.
+
+        Returns
+        -------
+        image : `~numpy.ndarray`
+            The rendered image (float), NaN where the map is empty.
+        '''
+        x0, y0, x1, y1 = region
+        height, width = shape
+        image = np.full((height, width), np.nan, dtype=np.float32)
+        scale = min(width / float(x1 - x0), height / float(y1 - y0))  # pixels per map pixel
+        # Map coordinates of the rendered pixel centers
+        xs = x0 + (np.arange(width) + 0.5) * (x1 - x0) / float(width)
+        ys = y0 + (np.arange(height) + 0.5) * (y1 - y0) / float(height)
+        for key in self.index.query_rect(x0, y0, x1, y1):
+            tile = self.tiles[key]
+            tx0, ty0, tx1, ty1 = tile.bounds
+            level = 0
+            if scale < 1:
+                level = min(int(np.floor(-np.log2(scale))), len(tile.levels) - 1)
+            data = tile.levels[level]
+            factor = float(2 ** level)
+            columns = np.flatnonzero((xs >= tx0) & (xs < tx1))
+            rows = np.flatnonzero((ys >= ty0) & (ys < ty1))
+            if not len(columns) or not len(rows):
+                continue
+            source_columns = np.minimum(((xs[columns] - tx0) / factor).astype(int),
+                                        data.shape[1] - 1)
+            source_rows = np.minimum(((ys[rows] - ty0) / factor).astype(int),
+                                     data.shape[0] - 1)
+            # Only read the needed block of the (memory-mapped) level
+            block = np.asarray(data[source_rows[0]:source_rows[-1] + 1,
+                                    source_columns[0]:source_columns[-1] + 1])
+            image[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1] = \
+                block[np.ix_(source_rows - source_rows[0], source_columns - source_columns[0])]
+        return image
+
+    def mark(self, position, name=None):
+        '''
+        Remembers a position on the map.
+
+        Returns
+        -------
+        name : str
+            The name of the mark (by default, "Cell n").
+        '''
+        if name is None:
+            n = len(self.marks) + 1
+            while 'Cell {}'.format(n) in self.marks:
+                n += 1
+            name = 'Cell {}'.format(n)
+        self.marks[name] = (float(position[0]), float(position[1]))
+        self.save()
+        return name
+
+    def remove_mark(self, name):
+        del self.marks[name]
+        self.save()
+
+    def nearest_mark(self, position, max_distance=np.inf):
+        '''
+        The name of the mark closest to a position (``None`` if there is no mark
+        within ``max_distance``).
+        '''
+        if not self.marks:
+            return None
+        names = list(self.marks)
+        distances = np.sqrt(np.sum((np.array(list(self.marks.values())) -
+                                    np.asarray(position)[:2])**2, axis=1))
+        best = np.argmin(distances)
+        return names[best] if distances[best] <= max_distance else None
+
+    def close(self):
+        '''
+        Closes the map (and deletes it if it is temporary).
+        '''
+        self.tiles.clear()
+        self.index = GridIndex(self.index.cell_size)
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -15,9 +15,12 @@ except:
 import numpy as np
 from time import time
 
-from numpy import zeros,uint8,pi, uint16, around
+from numpy import zeros, pi
 
-__all__ = ["ParameciumTracker", "where_is_droplet", "where_is_paramecium2"]
+from holypipette.vision.droplet import detect_droplets
+
+__all__ = ["ParameciumTracker", "BackprojectionTracker", "where_is_droplet",
+           "where_is_paramecium2"]
 
 
 def backproject(source, target, scale = 1):
@@ -31,7 +34,8 @@ def backproject(source, target, scale = 1):
 def where_is_droplet(frame, pixel_per_um = 5., ratio = None,
                      xc = None, yc = None):
     '''
-    Locate a droplet in an image.
+    Locate a droplet in an image (to follow a droplet in a sequence of images,
+    use `.DropletTracker`).
 
     Arguments
     ---------
@@ -45,38 +49,17 @@ def where_is_droplet(frame, pixel_per_um = 5., ratio = None,
     x, y, r : position and radius on screen
     '''
 
-    # Resize
     height, width = frame.shape[:2]
-    if ratio is None:
-        ratio = width/256
-    resized = cv2.resize(frame, (width/ratio, height/ratio))
-    pixel_per_um = pixel_per_um/ratio
-
-    # Filter
-    blur_size = int(pixel_per_um*10)
-    if blur_size % 2 == 0:
-        blur_size+=1
-    filtered=cv2.GaussianBlur(resized, (blur_size, blur_size), 0)
-
-    # Find circles
-    circles = cv2.HoughCircles(filtered[:,:,0], cv2.HOUGH_GRADIENT, 1, int(400*pixel_per_um),\
-                param1 = int(50/pixel_per_um), param2 = 30, minRadius = int(200*pixel_per_um), maxRadius = int(1000*pixel_per_um))
-
-    # Center
     if xc is None:
         xc = width/2
         yc = height/2
 
     # Choose one that encloses the center
-    x,y,r = None,None,None
-    if circles is not None:
-        circles = uint16(around(circles))
-        for j in circles[0, :]:
-            xj,yj,rj = j[0]*ratio,j[1]*ratio,j[2]*ratio
-            if ((xj-xc)**2 + (yj-yc)**2)<rj**2:
-                x,y,r = xj,yj,rj
+    for x, y, r in detect_droplets(frame, pixel_per_um, ratio):
+        if ((x-xc)**2 + (y-yc)**2)<r**2:
+            return x,y,r
 
-    return x,y,r
+    return None,None,None
 
 
 TrackingResult = collections.namedtuple('TrackingResult',
@@ -102,8 +85,8 @@ class ParameciumTracker(object):
     def __init__(self, config=None, history_size=100):
         if config is None:
             # Avoid circular imports
-            from holypipette.interface.paramecium_droplet import ParameciumConfig
-            config = ParameciumConfig()
+            from holypipette.interface.paramecium_droplet import ParameciumDropletConfig
+            config = ParameciumDropletConfig()
         self.config = config
         self.previous = RecentPositions(maxlen=history_size)
         self.pixel_per_um = None
@@ -234,6 +217,20 @@ class ParameciumTracker(object):
             info['best_contour'] = None
             return TrackingResult(None, None, None, None, None, info=info)
 
+    def shift(self, displacement):
+        '''
+        Shifts the previous positions, e.g. to compensate for a movement of the
+        stage, so that the next search starts at the expected position.
+
+        Arguments
+        ---------
+        displacement : the displacement (x, y) on screen, in pixels
+        '''
+        for i, position in enumerate(self.previous):
+            position = np.array(position, dtype=float)
+            position[:2] += displacement
+            self.previous[i] = position
+
     def has_stopped(self):
         if len(self.previous) > self.config.stop_duration:
             positions = np.array(self.previous[-int(self.config.stop_duration):])
@@ -252,102 +249,181 @@ class ParameciumTracker(object):
         self.min_grad = self.max_grad = None
 
 
-def where_is_paramecium2(frame, pixel_per_um = 5., return_angle = False, previous_x = None, previous_y = None,
-                        ratio = None, background = None, debug = False, max_dist = 1e6): # Locate paramecium
-    from holypipette.gui import movingList
-    height, width = frame.shape[:2]
-    if ratio is None:
-        ratio = width / 256
-    frame = cv2.resize(frame, (width / ratio, height / ratio))
-    # Normalize image
-    normalized_img = zeros(frame.shape)
-    normalized_img = cv2.normalize(frame, normalized_img, 0, 255, cv2.NORM_MINMAX)
-    normalized_img = uint8(normalized_img)
-
-    pixel_per_um = pixel_per_um / ratio
-    #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    frame1 = cv2.adaptiveThreshold(frame, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-    kernel = np.ones((2, 2), np.uint8)
-    frame1 = cv2.morphologyEx(frame1, cv2.MORPH_GRADIENT, kernel)
-
-    kernel = np.ones((3, 3), np.uint8)
-    frame1 = cv2.morphologyEx(frame1, cv2.MORPH_CLOSE, kernel)
-    frame1 = cv2.morphologyEx(frame1, cv2.MORPH_OPEN, kernel)
-
-    _, cnts, _ = cv2.findContours(frame1,cv2.RETR_CCOMP, 2)
-
-    mask_use = np.ones(frame1.shape, np.uint8) * 255
-    for cnt in cnts:
-        length = cv2.arcLength(cnt, True) / pixel_per_um
-        if (length > 150) & (cnt.shape[0] > 10):
-            x, y, w, h = cv2.boundingRect(cnt)
-            cropped = np.zeros(frame.shape, np.uint8)
-            cropped[0:h,0:w] = frame[y:y+h, x:x+w]
-            roi = np.zeros((1, 2*(w+h), 3), np.uint8)
-            for i in range (0,w):
-                roi[0, i] = cropped[(0,i)]
-            for i in range(w+1,2*w):
-                roi[0, i] = cropped[(h-1,i-w-1)]
-            for i in range(2*w+1, 2*w+h):
-                roi[0, i] = cropped[(i-(2*w),0)]
-            for i in range(2*w+h+1, 2*(w+h)):
-                roi[0, i] = cropped[(i-(2*w+h),w-1)]
-
-            backproj = np.uint8(backproject(roi, cropped, scale=2))
-            mask_use[y:y + h, x:x + w] = backproj[0:h, 0:w]
-
-
-    ret, mask_use = cv2.threshold(mask_use, 50, 255, cv2.THRESH_BINARY_INV)
-    _, cnts, _ = cv2.findContours(mask_use, cv2.RETR_CCOMP, 2)
-
-    for cnt in cnts:
-        length = cv2.arcLength(cnt, True) / pixel_per_um
-        if (length < 150) or (cnt.shape[0] < 10):
-            rect = cv2.minAreaRect(cnt)
-            box = cv2.boxPoints(rect)
-            box = np.int0(box)
-            cv2.drawContours(mask_use, [box], 0, (0, 0, 0), cv2.FILLED)
-
-
-    kernel = np.ones((5, 5), np.uint8)
-    mask_use = cv2.morphologyEx(mask_use, cv2.MORPH_CLOSE, kernel)
-
-    mask_use = cv2.resize(mask_use, (width, height))
-    frame = cv2.resize(frame, (width, height))
-    _, cnts, _ = cv2.findContours(mask_use, cv2.RETR_CCOMP, 2)
-    cv2.drawContours(frame, cnts, -1, (255, 255, 255), 3)
-
-    i = 0.2
-
-    found = False
-    for cnt in cnts:
-        length = cv2.arcLength(cnt, True) / pixel_per_um
-        if (length > 250) & (cnt.shape[0] > 10):
-            if len(movingList.template) < 2:
-                movingList.template.append(cnt)
-            else:
-                ret1 = cv2.matchShapes(movingList.template[0], cnt, 1, 0.0)
-                ret2 = cv2.matchShapes(movingList.template[1], cnt, 1, 0.0)
-                if (ret1 < i) or (ret2 <i):
-                    movingList.template[1] = cnt
-                    found = True
+def _contours(image):
+    ret = cv2.findContours(image, cv2.RETR_CCOMP, 2)
+    return ret[-2]  # for compatibility with opencv 3 and 4
+
+
+def _border(image):
+    # Pixels on the border of an image
+    return np.concatenate([image[0, :], image[-1, :], image[1:-1, 0], image[1:-1, -1]])
+
+
+class BackprojectionTracker(ParameciumTracker):
+    '''
+    Locates a paramecium by its shape. Candidate objects are segmented by
+    backprojecting the intensity histogram of the border of their bounding box
+    (i.e., of the background around them); their contours are then compared
+    with template contours from the first frames.
+
+    This is an alternative to `ParameciumTracker`, with the same interface. All
+    the state (templates, previous positions, buffers) is stored in the
+    object, so that several trackers can be used independently.
+
+    Parameters
+    ----------
+    config : `.ParameciumDropletConfig`, optional
+        The configuration (stop detection parameters).
+    history_size : int, optional
+        The number of stored positions.
+    ratio : int, optional
+        Decimating ratio (by default, so that the image is 256 pixels wide).
+    min_object_length : float, optional
+        Minimum contour length (in µm) of a candidate object.
+    min_paramecium_length : float, optional
+        Minimum contour length (in µm) of a paramecium.
+    max_shape_distance : float, optional
+        Maximum distance (see ``cv2.matchShapes``) between the contour of the
+        paramecium and the templates.
+    '''
+    def __init__(self, config=None, history_size=100, ratio=None,
+                 min_object_length=150, min_paramecium_length=250,
+                 max_shape_distance=0.2):
+        super(BackprojectionTracker, self).__init__(config, history_size)
+        self.ratio = ratio
+        self.min_object_length = min_object_length
+        self.min_paramecium_length = min_paramecium_length
+        self.max_shape_distance = max_shape_distance
+        self.templates = []
+        self._mask = None  # preallocated mask of the decimated image
+
+    def clear(self):
+        super(BackprojectionTracker, self).clear()
+        self.templates = []
+
+    def _backproject_objects(self, frame, pixel_per_um):
+        # Mask (0 for candidate objects) obtained by backprojecting the
+        # background around each object
+        binary = cv2.adaptiveThreshold(frame, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY_INV, 11, 2)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_GRADIENT, np.ones((2, 2), np.uint8))
+        kernel = np.ones((3, 3), np.uint8)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+
+        if self._mask is None or self._mask.shape != frame.shape:
+            self._mask = np.empty(frame.shape, np.uint8)
+        mask = self._mask
+        mask.fill(255)
+        for contour in _contours(binary):
+            length = cv2.arcLength(contour, True) / pixel_per_um
+            if length > self.min_object_length and contour.shape[0] > 10:
+                x, y, w, h = cv2.boundingRect(contour)
+                crop = frame[y:y + h, x:x + w]
+                # Histogram of the border, normalized to 0-255
+                histogram = np.bincount(_border(crop), minlength=256).astype(np.float32)
+                histogram -= histogram.min()
+                histogram *= 255. / max(histogram.max(), 1)
+                # Backprojection (with scale 2)
+                lookup = np.uint8(np.minimum(np.round(2 * histogram), 255))
+                mask[y:y + h, x:x + w] = lookup[crop]
+        return mask
+
+    def locate(self, frame, pixel_per_um):
+        '''
+        Locate paramecium in an image.
+
+        Arguments
+        ---------
+        frame
+            the image
+        pixel_per_um : float
+            number of pixels per µm
+
+        Returns
+        -------
+        x, y, MA, ma, angle : Position and size of fitted ellipse
+        '''
+        self.pixel_per_um = pixel_per_um
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height, width = frame.shape[:2]
+        ratio = self.ratio
+        if ratio is None:
+            ratio = max(width // 256, 1)
+        frame = cv2.resize(frame, (width // ratio, height // ratio))
+        if frame.dtype != np.uint8:
+            frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        pixel_per_um = pixel_per_um / ratio
+
+        mask = self._backproject_objects(frame, pixel_per_um)
+        _, mask = cv2.threshold(mask, 50, 255, cv2.THRESH_BINARY_INV)
+        # Remove small objects
+        for contour in _contours(mask):
+            length = cv2.arcLength(contour, True) / pixel_per_um
+            if length < self.min_object_length or contour.shape[0] < 10:
+                box = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.int32)
+                cv2.drawContours(mask, [box], 0, 0, cv2.FILLED)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+
+        # Compare the shapes with the templates
+        info = {'mask': mask, 'all_contours': [], 'best_contour': None}
+        found = None
+        for contour in _contours(mask):
+            length = cv2.arcLength(contour, True) / pixel_per_um
+            if length > self.min_paramecium_length and contour.shape[0] > 10:
+                contour_pixel = contour * ratio
+                info['all_contours'].append(contour_pixel)
+                if len(self.templates) < 2:
+                    self.templates.append(contour_pixel)
+                elif min(cv2.matchShapes(template, contour_pixel, 1, 0.0)
+                         for template in self.templates) < self.max_shape_distance:
+                    self.templates[1] = contour_pixel
+                    found = contour_pixel
                     break
 
-    cv2.drawContours(frame, [movingList.template[1]], 0, (0, 0, 0), 3)
-    (xmin, ymin), (MA, ma), theta = cv2.fitEllipse(movingList.template[1])
-    angle = (theta + 90) * pi / 180.
+        if found is None:
+            return TrackingResult(None, None, None, None, None, info=info)
+        info['best_contour'] = found
+        (x, y), (ma, MA), theta = cv2.fitEllipse(found)
+        angle = (theta + 90) * pi / 180.
+        result = (x, y, MA / self.pixel_per_um, ma / self.pixel_per_um, angle)
+        self.previous.append(result)
+        return TrackingResult(*result, info=info)
+
 
-    if found:
-        if debug:
-            return xmin , ymin , normalized_img
-        elif return_angle:
-            return xmin , ymin , angle
-        else:
-            return xmin , ymin
+def where_is_paramecium2(frame, pixel_per_um = 5., return_angle = False, previous_x = None, previous_y = None,
+                        ratio = None, background = None, debug = False, max_dist = 1e6,
+                        tracker = None): # Locate paramecium
+    '''
+    Locate a paramecium in an image with a `BackprojectionTracker`.
+
+    Arguments
+    ---------
+    frame : the image
+    pixel_per_um : number of pixels per um
+    return_angle : whether to also return the angle
+    ratio : decimating ratio (to make the image smaller)
+    debug : whether to also return the normalized image
+    tracker : the tracker, which stores the templates between calls (by
+              default, a tracker shared by all calls)
+
+    Returns
+    -------
+    x, y : position on screen (and angle, or normalized image)
+    '''
+    global _default_tracker
+    if tracker is None:
+        if _default_tracker is None:
+            _default_tracker = BackprojectionTracker(ratio=ratio)
+        tracker = _default_tracker
+    result = tracker.locate(frame, pixel_per_um)
+    if debug:
+        normalized_img = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        return result.x, result.y, normalized_img
+    elif return_angle:
+        return result.x, result.y, result.angle
     else:
-        if debug:
-            return None, None, normalized_img
-        elif return_angle:
-            return None, None, None
-        else:
-            return None, None
\ No newline at end of file
+        return result.x, result.y
+
+_default_tracker = None
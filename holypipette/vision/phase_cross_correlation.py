@@ -1,11 +1,81 @@
 '''
 Copied from scikit-image.registration 0.18.0.
 Masking removed.
+
+Added: caching of the upsampling kernels and windows, and
+`RegistrationContext` for repeated registrations against the same reference.
 '''
+import collections
+import threading
+
 import numpy as np
 from scipy import fft
 
-__all__ = ['phase_cross_correlation']
+__all__ = ['phase_cross_correlation', 'RegistrationContext']
+
+
+class _LRUCache(object):
+    '''
+    A thread-safe cache keeping the ``size`` most recently used values.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        '''
+        The value for ``key``, created with ``create()`` if not in the cache.
+        '''
+        with self._lock:
+            if key in self._values:
+                value = self._values.pop(key)
+                self._values[key] = value  # most recently used
+                return value
+        value = create()
+        with self._lock:
+            self._values[key] = value
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+# Upsampling kernels without offset, for each (size, region size, factor)
+_kernel_cache = _LRUCache(32)
+# Window functions for each (shape, kind)
+_window_cache = _LRUCache(16)
+
+
+def _upsampling_kernel(n_items, ups_size, upsample_factor):
+    '''
+    The matrix ``exp(-2j*pi*k*f)`` for output indices ``k`` and frequencies
+    ``f``, together with the frequencies. Offsets are applied by multiplying
+    the columns by ``exp(2j*pi*offset*f)``.
+    '''
+    def create():
+        frequencies = fft.fftfreq(n_items, upsample_factor)
+        kernel = np.exp(-2j * np.pi * np.arange(ups_size)[:, None] * frequencies)
+        return kernel, frequencies
+    return _kernel_cache.get((n_items, int(ups_size), float(upsample_factor)), create)
+
+
+def _window(shape, kind='hann'):
+    '''
+    A separable window function (currently only ``'hann'``) for images of the
+    given shape.
+    '''
+    if kind != 'hann':
+        raise ValueError('Unknown window "{}"'.format(kind))
+    def create():
+        window = np.ones(())
+        for n in shape:
+            window = np.multiply.outer(window, np.hanning(n))
+        return window
+    return _window_cache.get((tuple(shape), kind), create)
 
 def _upsampled_dft(data, upsampled_region_size,
                    upsample_factor=1, axis_offsets=None):
@@ -60,9 +130,9 @@ def _upsampled_dft(data, upsampled_region_size,
     dim_properties = list(zip(data.shape, upsampled_region_size, axis_offsets))
 
     for (n_items, ups_size, ax_offset) in dim_properties[::-1]:
-        kernel = ((np.arange(ups_size) - ax_offset)[:, None]
-                  * fft.fftfreq(n_items, upsample_factor))
-        kernel = np.exp(-im2pi * kernel)
+        # Equivalent to exp(-im2pi * (arange(ups_size) - ax_offset)[:, None] * frequencies)
+        kernel, frequencies = _upsampling_kernel(n_items, ups_size, upsample_factor)
+        kernel = kernel * np.exp(im2pi * ax_offset * frequencies)
 
         # Equivalent to:
         #   data[i, j, k] = kernel[i, :] @ data[j, k].T
@@ -179,6 +249,22 @@ def phase_cross_correlation(reference_image, moving_image,
     else:
         raise ValueError('space argument must be "real" of "fourier"')
 
+    return _register(src_freq, target_freq, upsample_factor, return_error)
+
+
+def _power(freq, power=None):
+    if power is None:
+        power = np.sum(np.real(freq * freq.conj()))
+    return power
+
+
+def _register(src_freq, target_freq, upsample_factor=1, return_error=True,
+              src_power=None):
+    '''
+    Registration of two images given by their spectra (see
+    `phase_cross_correlation`). ``src_power`` is the sum of the squared
+    amplitudes of ``src_freq`` (calculated if not provided).
+    '''
     # Whole-pixel shift - Compute cross-correlation by an IFFT
     shape = src_freq.shape
     image_product = src_freq * target_freq.conj()
@@ -194,7 +280,7 @@ def phase_cross_correlation(reference_image, moving_image,
 
     if upsample_factor == 1:
         if return_error:
-            src_amp = np.sum(np.real(src_freq * src_freq.conj()))
+            src_amp = _power(src_freq, src_power)
             src_amp /= src_freq.size
             target_amp = np.sum(np.real(target_freq * target_freq.conj()))
             target_amp /= target_freq.size
@@ -223,7 +309,7 @@ def phase_cross_correlation(reference_image, moving_image,
         shifts = shifts + maxima / upsample_factor
 
         if return_error:
-            src_amp = np.sum(np.real(src_freq * src_freq.conj()))
+            src_amp = _power(src_freq, src_power)
             target_amp = np.sum(np.real(target_freq * target_freq.conj()))
 
     # If its only one row or column the shift along that dimension has no
@@ -247,3 +333,62 @@ def phase_cross_correlation(reference_image, moving_image,
             _compute_phasediff(CCmax)
     else:
         return shifts
+
+
+class RegistrationContext(object):
+    """
+    Registration of images against a fixed reference image. The spectrum of
+    the reference (and the window, if any) is computed once, so that each
+    registration costs a single forward FFT of the moving image (upsampling
+    kernels are cached across all registrations).
+
+    Parameters
+    ----------
+    reference_image : array
+        The reference image.
+    upsample_factor : int, optional
+        Upsampling factor (see `phase_cross_correlation`).
+    window : str, optional
+        A window function applied to both images (``'hann'``), or ``None``
+        (the default). Windowing reduces the effect of the image borders, but
+        biases the estimation towards small shifts.
+    subtract_mean : bool, optional
+        Whether to subtract the mean of each image before registration.
+    """
+    def __init__(self, reference_image, upsample_factor=1, window=None,
+                 subtract_mean=False):
+        self.shape = reference_image.shape
+        self.upsample_factor = upsample_factor
+        self.subtract_mean = subtract_mean
+        self.window = None if window is None else _window(self.shape, window)
+        self.src_freq = fft.fftn(self._prepare(reference_image))
+        self.src_power = _power(self.src_freq)
+
+    def _prepare(self, image):
+        image = np.asarray(image, dtype=float)
+        if self.subtract_mean:
+            image = image - image.mean()
+        if self.window is not None:
+            image = image * self.window
+        return image
+
+    def register(self, moving_image, return_error=True):
+        """
+        Registers an image against the reference.
+
+        Returns
+        -------
+        shifts : ndarray
+            Shift vector (in pixels) required to register ``moving_image``
+            with the reference (see `phase_cross_correlation`).
+        error : float
+            Translation invariant normalized RMS error (only if
+            ``return_error`` is set).
+        phasediff : float
+            Global phase difference (only if ``return_error`` is set).
+        """
+        if moving_image.shape != self.shape:
+            raise ValueError("images must be same shape")
+        target_freq = fft.fftn(self._prepare(moving_image))
+        return _register(self.src_freq, target_freq, self.upsample_factor,
+                         return_error, src_power=self.src_power)